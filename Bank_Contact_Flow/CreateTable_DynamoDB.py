@@ -1,47 +1,18 @@
-
 # resource: https://boto3.amazonaws.com/v1/documentation/api/latest/guide/dynamodb.html
 # resource: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/GettingStarted.Python.html
 
+from bank_common import tables
 
-import boto3 #The AWS SDK library for Python
-import json
-
-#Create table named BankAccounts
-
-def create_bank_accounts_table(table_name):
-
-    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-
-    table = dynamodb.create_table(
-    TableName=table_name,
-    KeySchema=[ #Key schema specifies attributes that make up primary key of table
-        { 
-            'AttributeName': 'AccountNumber',
-            'KeyType':'HASH' #Partition Key
-        }
-    ], 
-    AttributeDefinitions=[ #Attributes for table keys
-        { 
-            'AttributeName': 'AccountNumber',
-            'AttributeType': 'N'
-        }
-    ],
-    ProvisionedThroughput={
-        'ReadCapacityUnits': 5, #The maximum number of strongly consistent reads consumed per second 
-        #before DynamoDB returns a ThrottlingException
-        'WriteCapacityUnits':5 #The maximum number of writes consumed per second 
-        #before DynamoDB returns a ThrottlingException
-    })
-    
-    return table
 
+#Create the missing tables (BankAccounts, BankAccountsNew, account-counters and
+#survey-responses in us-east-1, data_dip_table and contact-list in ap-southeast-2) concurrently
+#from the specs in bank_common.tables, and print how existing tables differ from their spec
+#without touching them. To apply the differences run python -m bank_common.tables --apply, for
+#provisioned capacity with autoscaling add --billing-mode PROVISIONED. Account number counters
+#that earlier versions kept in the accounts tables are moved to account-counters afterwards
 
-ddb = boto3.resource('dynamodb')
+for table_name, actions in tables.ensure_tables().items():
+    print(table_name, '-', '; '.join(actions) or 'up to date')
 
-table_name = 'BankAccounts'
-try:
-    bank_table = create_bank_accounts_table(table_name)
-    print('Created Table', table_name)
-except:
-    bank_table = ddb.Table(table_name)
-    print('Table already exists. Table status:', bank_table.table_status)
+for table_name, actions in tables.move_legacy_counters().items():
+    print(table_name, '-', '; '.join(actions))
@@ -1,119 +1,39 @@
-import json
-import time
-import boto3
 import logging
+import time
 import os
-from decimal import Decimal
-
-
-
-#Configure Logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 
+from bank_common import accounts, caller_id, deadline, dynamo, lex, log, metrics
+from bank_common.router import IntentRouter
 
-#Initialize DynamoDB Client
-dynamodb = boto3.resource('dynamodb')
 
 
+# By default, treat the user request as coming from the America/New_York time zone.
+# Set once per container instead of on every invocation.
+os.environ['TZ'] = 'America/New_York'
+time.tzset()
 
-""" --- Generic functions used to simplify interaction with Amazon Lex --- """
 
+#Configure Logger, level/format/debug sampling come from LOG_LEVEL, LOG_FORMAT and LOG_DEBUG_SAMPLE_RATE
+logger = log.configure()
 
-def elicit_slot(session_attributes, intent_name, slots, slot_to_elicit, message):
-    ''' 
-    Informs Amazon Lex that the user is expected to provide a slot value in the response.
-    The intentName, slotToElicit, and slots fields are required. 
-    The message and responseCard fields are optional.
-
-    Note: "slots": {
-      "slot-name": "value",
-      "slot-name": "value",
-      "slot-name": "value"  
-   },
-    '''
-
-    return {
-        'sessionAttributes': session_attributes,
-        'dialogAction': {
-            'type': 'ElicitSlot',
-            'intentName': intent_name,
-            'slots': slots,
-            'slotToElicit': slot_to_elicit,
-            'message': message
-        }
-    }
-
-
-def confirm_intent(session_attributes, intent_name, slots, message):
-    '''
-    Informs Amazon Lex that the user is expected to give a yes or no answer to confirm or deny the current intent.
-
-    You must include the intentName and slots fields. 
-    The slots field must contain an entry for each of the filled slots for the specified intent.
-     You don't need to include a entry in the slots field for slots that aren't filled. 
-     You must include the message field if the intent's confirmationPrompt field is null.
-    '''
-    return {
-        'sessionAttributes':session_attributes,
-        'dialogAction': {
-            'type':'ConfirmIntent',
-            'intentName': intent_name,
-            'slots': slots,
-            'message': message
-        }
-    }
-
-def delegate(session_attributes, slots):
-    '''
-    Directs Amazon Lex to choose the next course of action based on the bot configuration. 
-    If the response does not include any session attributes Amazon Lex retains the existing attributes. 
-    If you want a slot value to be null, you don't need to include the slot field in the request
-    You will get a DependencyFailedException exception if your fulfillment function 
-    returns the Delegate dialog action without removing any slots.
-    '''
 
-    return {
-        'sessionAttributes': session_attributes,
-        'dialogAction': {
-            'type': 'Delegate',
-            'slots': slots
-        }
-    }
+#Initialize DynamoDB client during the init phase, it is needed by the first request
+dynamo.get_client()
 
-def elicit_intent(session_attributes, content):
-    '''
-    Informs Amazon Lex that the user is expected to respond with an utterance that includes an intent. 
-    For example, "I want a large pizza," which indicates the OrderPizzaIntent. 
-    '''
+#Every read and write of BankAccounts goes through the repository (see bank_common.accounts)
+bank_accounts = accounts.AccountRepository('BankAccounts', accounts.V1)
 
-    return {
-        'sessionAttributes': session_attributes,
-        'dialogAction': {
-            'type': 'ElicitIntent',
-            'message':{
-                'contentType':'PlainText',
-                'content': content
-            }
-        }
-    }
+#Answer when the invocation runs out of time, Failed sends the contact flow to its error branch
+FALLBACK_MESSAGE = 'Sorry, I cannot reach your account right now. Please hold while I transfer you to an agent.'
 
-def close(session_attributes, fulfillment_state, message):
-    '''
-    Informs Amazon Lex not to expect a response from the user. 
-    For example, "Your pizza order has been placed" does not require a response.
+#Card replacement failed without a single field to blame (unknown account, or changed meanwhile)
+DETAILS_MISMATCH_MESSAGE = 'Sorry! The details you gave do not match our records.'
 
-    The fulfillmentState field is required
-    '''
+#Intent handlers register themselves per code hook below
+router = IntentRouter(fallback=lambda request: lex.close(request, 'Failed', FALLBACK_MESSAGE))
 
-    return {
-        'sessionAttributes': session_attributes,
-        'dialogAction': {
-            'type':'Close',
-            'fulfillmentState': fulfillment_state,
-            'message': message
-        }
-    }
+#Card replacement field -> Lex V1 slot name
+REPLACE_CARD_SLOTS = {'accountNumber': 'AccountNumber', 'pin': 'Pin', 'firstName': 'FirstName', 'lastName': 'LastName'}
 
 
 
@@ -202,246 +122,155 @@ def validate_replace_card_information(accountNumber, pin, firstName, lastName):
 """ --- Helper Functions --- """
 
 
-def try_ex(func):
-    """
-    Call passed in function in try block. If KeyError is encountered return None.
-    This function is intended to be used to safely access dictionary.
-
-    Note that this function would have negative impact on performance.
-    """
+def get_account(accountNumber, fields):
+    '''
+    Fetches a request-scoped snapshot of the account with a single projected GetItem.
+    Only the requested fields are read; an unknown account yields None.
+    '''
 
     try:
-        return func()
-    except KeyError:
-        return None
-
-
+        return bank_accounts.get(accountNumber, fields)
+    except dynamo.ClientError as err:
+        if err.response['Error']['Code'] == 'InternalError':
+            logger.warning('Error Message: %s', err.response['Error']['Message'])
+            return None
+        else:
+            raise err
 
-def query(accountNumber, query_params):
 
-    from botocore.exceptions import ClientError
 
-    #DynamoDB table
-    table = dynamodb.Table('BankAccounts')
 
-    try:
-        response = table.get_item(Key={'AccountNumber': Decimal(accountNumber)})
-    except ClientError as err:
-        if err.response['Error']['Code'] == 'InternalError':
-            logger.info('Error Message: {}'.format(err.response['Error']['Message']))
-        else:
-            raise err
-        
+def slot_matches(slot_val, stored):
+    '''
+    Whether a slot value equals the stored attribute. Numbers (pins, account numbers) are
+    compared as numbers: the pin 0123 is stored as 123.
+    '''
 
-    return response['Item'][query_params]
+    if isinstance(stored, int) and str(slot_val).isdecimal():
+        return int(slot_val) == stored
+    return str(slot_val) == str(stored)
 
 
+""" --- Functions that control the bot's behavior --- """
 
+@router.dialog('AccountLookUp')
+def validate_balance(request):
 
-def update_accountNumber(accountNumber):
+    #Callers whose number matches exactly one account are not asked for it
+    caller_id.prefill_account(request, bank_accounts, 'AccountNumber')
 
-    from botocore.exceptions import ClientError
-    import random
-    
-    new_checkaccountNumber = Decimal(random.randint(1000000000000000, 9999999999999999))
+    #initialize slot variables
+    accountNumber = request.slot('AccountNumber')
+    pin = request.slot('Pin')
 
-    #DDB Table
-    table = dynamodb.Table('BankAccounts')
+    logger.debug('output_session_attributes=%s, source=%s', request.session_attributes, request.source)
 
-    try:
-        response = table.update_item(Key={'AccountNumber': Decimal(accountNumber)},
-            UpdateExpression="set CheckingAccountNumber = :g",
-            #ExpressionAttributeNames={'AccountNumber': accountNumber},
-            ExpressionAttributeValues={':g':new_checkaccountNumber},
-            ReturnValues="UPDATED_NEW"
-            )
-
-    except ClientError as err:
-        if err.response['Error']['Code'] == 'InternalError':
-            logger.info('Error Message: {}'.format(err.response['Error']['Message']))
-        else:
-            raise err
-        
-    res = response['Attributes']['CheckingAccountNumber']
+    #Validating User Data
+    validation_result = validate_balance_information(accountNumber, pin)
+    logger.debug('isValid=%s, violatedSlot=%s', validation_result['isValid'], validation_result['violatedSlot'])
+    if not validation_result['isValid']:
+        request.clear_slot(validation_result['violatedSlot'])
+        return lex.elicit_slot(request, validation_result['violatedSlot'], validation_result['message'])
 
-    if new_checkaccountNumber != res:
-        return False
-    else:
-        return res
+    return lex.delegate(request)
 
 
+@router.fulfillment('AccountLookUp')
+def retrieve_balance(request):
 
+    slots = request.slots
+    accountNumber = request.slot('AccountNumber')
 
-""" --- Functions that control the bot's behavior --- """
+    logger.debug('source=%s', request.source)
+    logger.debug('slots=%s', slots)
 
-def retrieve_balance(intent_request):
-    
+    #Slots are named after the V1 attributes they are checked against
+    fields = [accounts.V1.field(slot_name) for slot_name in slots]
 
-    slots = intent_request['currentIntent']['slots']
+    #Single read of every field this fulfillment needs, strongly consistent for the balance
+    account = get_account(accountNumber, [field for field in fields if field] + ['balance'])
 
-    #initialize slot variables
-    accountNumber = try_ex(lambda: slots['AccountNumber'])
-    pin = try_ex(lambda: slots['Pin'])
+    #Validation of Input Data with Database Values
+    for (slot_name, slot_val), field in zip(slots.items(), fields):
+        res = account.get(field) if account is not None and field else None
+        if not slot_matches(slot_val, res):
+            logger.debug('slot=%s mismatch', slot_name)
+            return lex.close(request, 'Failed', f'Sorry! The {slot_name} you entered does not exist in our database.')
 
+    balance = account.balance
+    logger.debug('balance retrieved')
 
-    output_session_attributes = intent_request['sessionAttributes'] if intent_request['sessionAttributes'] is not None else {}
-    source = intent_request['invocationSource']
+    return lex.close(request, 'Fulfilled', f'Your debit card balance is ${balance:,.2f} dollars.')
 
-    logger.debug('output_session_attributes={}, source={}'.format(output_session_attributes, source))
 
+@router.dialog('ReplaceCard')
+def validate_replace_card(request):
 
-    #Validating User Data
-    if source == 'DialogCodeHook':
-        validation_result = validate_balance_information(accountNumber, pin)
-        logger.debug(validation_result)
-        if not validation_result['isValid']:
-            slots[validation_result['violatedSlot']] == None
-            return elicit_slot(
-                output_session_attributes, 
-                intent_request['currentIntent']['name'],
-                slots,
-                validation_result['violatedSlot'],
-                validation_result['message']
-            )
-    
-        return delegate(output_session_attributes, intent_request['currentIntent']['slots'])
+    #Callers whose number matches exactly one account are not asked for it
+    caller_id.prefill_account(request, bank_accounts, 'AccountNumber')
 
-    
-    #Now source = 'FullfillmentCodeHook
-    
-    source=intent_request['invocationSource']
-    logger.info('source={}'.format(source))
-    logger.info('slots={}'.format(slots))
+    #initialize slot variables
+    accountNumber = request.slot('AccountNumber')
+    pin = request.slot('Pin')
+    firstName = request.slot('FirstName')
+    lastName = request.slot('LastName')
 
-    #Validation of Input Data with Database Values
-    for slot_name, slot_val in slots.items():
-        if (slot_val != query(accountNumber, slot_name)):
-            res = query(accountNumber, slot_name)
-            logger.info('slot_val={}, query_res={}'.format(slot_val, res))
-            validation_result = build_validation_result(False, slot_name, f'The {slot_name} {slot_val} does not exist in our database.')
-            logger.debug(validation_result)
-            return close( 
-                output_session_attributes,
-                'Failed',
-                {
-                    'contentType':'PlainText',
-                    'content': f'Sorry! The {slot_name} {slot_val} does not exist in our database.'
-                }
-            )
-
-    balance = query(accountNumber, 'AccountBalance')
-    logger.info('balance={}'.format(balance))
-
-    return close(
-        output_session_attributes,
-        'Fulfilled',
-        {
-            'contentType':'PlainText',
-            'content': f'Your debit card balance is ${balance:,.2f} dollars.'
-        }
-    )
+    logger.debug('output_session_attributes=%s, source=%s', request.session_attributes, request.source)
 
+    #Validating User Data
+    validation_result = validate_replace_card_information(accountNumber, pin, firstName, lastName)
+    logger.debug('isValid=%s, violatedSlot=%s', validation_result['isValid'], validation_result['violatedSlot'])
+    if not validation_result['isValid']:
+        request.clear_slot(validation_result['violatedSlot'])
+        return lex.elicit_slot(request, validation_result['violatedSlot'], validation_result['message']) #reprompts user to enter data
 
-def replace_card(intent_request):
+    return lex.delegate(request) #returns control back to Lex Bot to go to next step
 
 
-    slots = intent_request['currentIntent']['slots']
+@router.fulfillment('ReplaceCard')
+def replace_card(request):
 
     #initialize slot variables
-    accountNumber = try_ex(lambda: slots['AccountNumber'])
-    pin = try_ex(lambda: slots['Pin'])
-    firstName = try_ex(lambda: slots['FirstName'])
-    lastName = try_ex(lambda: slots['LastName'])
+    accountNumber = request.slot('AccountNumber')
+    pin = request.slot('Pin')
+    firstName = request.slot('FirstName')
+    lastName = request.slot('LastName')
 
+    logger.debug('source=%s', request.source)
 
-    output_session_attributes = intent_request['sessionAttributes'] if intent_request['sessionAttributes'] is not None else {}
-    source = intent_request['invocationSource']
+    #Identity check and card rotation in one conditional update
+    result = bank_accounts.replace_card(accountNumber, pin, firstName, lastName)
 
-    logger.debug('output_session_attributes={}, source={}'.format(output_session_attributes, source))
+    if not result.replaced:
+        if result.failed_field is None:
+            return lex.close(request, 'Failed', DETAILS_MISMATCH_MESSAGE)
+        slot_name = REPLACE_CARD_SLOTS[result.failed_field]
+        logger.debug('replace card failed on %s', slot_name)
+        return lex.close(request, 'Failed', f'Sorry! The {slot_name} you entered does not exist in our database.')
 
-    #Validating User Data
-    if source == 'DialogCodeHook':
-        validation_result = validate_replace_card_information(accountNumber, pin, firstName, lastName)
-        logger.info(validation_result)
-        if not validation_result['isValid']:
-            slots[validation_result['violatedSlot']] == None
-            return elicit_slot( #reprompts user to enter data
-                output_session_attributes, 
-                intent_request['currentIntent']['name'],
-                slots,
-                validation_result['violatedSlot'],
-                validation_result['message']
-            ) 
-
-        return delegate(output_session_attributes, intent_request['currentIntent']['slots']) #returns control back to Lex Bot to go to next step
-
-    #Now source == 'FulfillmentCodeHook'
-    
-    source=intent_request['invocationSource']
-    logger.info('source={}'.format(source))
-    #Validation of Input Data with Database Values
-    logger.info('slots={}'.format(slots))
-    for slot_name, slot_val in slots.items():
-        res = query(accountNumber, slot_name)
-        logger.info('query_res={}'.format(res))
-        if (str(slot_val).lower() != str(res).lower()):
-            validation_result = build_validation_result(False, slot_name, f'The {slot_name} {slot_val} does not exist in our database.')
-            logger.debug(validation_result)
-            return close( 
-                output_session_attributes,
-                'Failed',
-                {
-                    'contentType':'PlainText',
-                    'content': f'Sorry! The {slot_name} {slot_val} does not exist in our database.'
-                }
-            )
-
-
-    new_checkaccountNumber = update_accountNumber(accountNumber)
-
-    if not new_checkaccountNumber:
-        raise Exception('Error generating new debit card number')
-
-    new_accountNumber = str(new_checkaccountNumber)
-    street_address = query(accountNumber, 'StreetAddress')
-    email_address = query(accountNumber, 'Email Address')
+    new_accountNumber = str(result.account.cardNumber)
+    street_address = result.account.streetAddress
+    email_address = result.account.email
 
     message = f'An email has been sent to {email_address} containing your new debit card information. ' 
     message2 = f'Your new debit card ending in {new_accountNumber[-4:]} has been mailed out to {street_address}. '
     message3 = 'Please expect it to arrive within five to seven business days.'
     
-    return close(
-        output_session_attributes,
-        'Fulfilled',
-        {
-            'contentType':'PlainText',
-            'content': message+message2+message3
-        }
-    )
+    return lex.close(request, 'Fulfilled', message+message2+message3)
 
 
 """ --- Intents --- """
 
 
-def dispatch(intent_request):
+def dispatch(request):
     '''
     Called when the user specifies an intent for this bot.
+    Unknown intents get the router's default Failed response.
     '''
 
-    logger.debug('dispatch userId= {}, intentName={}'.format(intent_request['userId'], intent_request['currentIntent']['name']))
+    logger.debug('dispatch userId=%s, intentName=%s', request.user_id, request.intent_name)
 
-    intent_name = intent_request['currentIntent']['name']
-
-    #Dispatch to your bot's intent handlers
-
-    if intent_name == 'AccountLookUp':
-        return retrieve_balance(intent_request)
-    
-    elif intent_name == 'ReplaceCard':
-        return replace_card(intent_request)
-    
-    else:
-        raise Exception('Intent with name ' + intent_name + ' not supported')
+    return router.dispatch(request)
 
 
 
@@ -452,10 +281,16 @@ def lambda_handler(event, context):
     Route the incoming request based on intent.
     """
 
-    # By default, treat the user request as coming from the America/New_York time zone.
-    os.environ['TZ'] = 'America/New_York'
-    time.tzset()
+    request = lex.parse(event)
+
+    with log.invocation(request.user_id, bot=request.bot_name, intent=request.intent_name, source=request.source), \
+            metrics.invocation(Intent=request.intent_name, Source=request.source), \
+            deadline.invocation(context):
+        logger.debug('event.bot.name=%s', request.bot_name)
 
-    logger.debug('event.bot.name={}, userMessage={}'.format(event['bot']['name'], event['inputTranscript']))
+        response = dispatch(request)
+        #stats() builds a dict, only worth it when the line is written
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('router_stats=%s', router.stats())
 
-    return dispatch(event)
+    return response
@@ -1,135 +1,50 @@
-import json
+import logging
 import os
 import time
-import boto3
-import logging
-from decimal import Decimal
-
-
-#Configure logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
 
-#Initialize DynamoDB resource
-dyn_resource = boto3.resource('dynamodb')
-tbl_name = 'BankAccountsNew'
-
-
-""" --- Generic functions used to simplify interaction with Amazon Lex --- """
+from bank_common import accounts, bloom, caller_id, deadline, dynamo, lex, log, metrics, session_token
+from bank_common.cache import AccountCache
+from bank_common.router import IntentRouter
 
-def get_slots(intent_request):
-    return intent_request['sessionState']['intent']['slots']
 
+# By default, treat the user request as coming from the America/New_York time zone.
+# Set once per container instead of on every invocation.
+os.environ['TZ'] = 'America/New_York'
+time.tzset()
 
-# def get_slot(intent_request, slotName):
-#     slots = try_ex(lambda: get_slots(intent_request))
-#     if slots is not None and slotName in slots and slots[slotName] is not None:
-#         return slots[slotName]['value']['interpretedValue']
-#     else:
-#         return None 
 
+#Configure logger, level/format/debug sampling come from LOG_LEVEL, LOG_FORMAT and LOG_DEBUG_SAMPLE_RATE
+logger = log.configure()
 
-def get_session_attributes(intent_request):
-    sessionState = intent_request['sessionState']
-    if 'sessionAttributes' in sessionState:
-        return sessionState['sessionAttributes']
-    
-    return {}
-
-
-
-def close(intent_name, session_attributes, fulfillment_state, message):
-    '''Closes/Ends current Lex session with customer'''
-
-    response = {
-        'messages': [
-            message
-        ],
-        'sessionState': {
-            'dialogAction': {
-                'type': 'Close'           
-            },
-            'sessionAttributes': session_attributes,
-            'intent': {
-                'confirmationState': 'Confirmed',
-                'name': intent_name,
-                'state': fulfillment_state
-            }
-        }
-    }
 
-    return response
-    
+#Initialize DynamoDB client during the init phase, it is needed by the first request
+dynamo.get_client()
+tbl_name = 'BankAccountsNew'
 
+#Account numbers known to the table, mistyped numbers skip the GetItem (see bank_common.bloom)
+known_accounts = bloom.KeyFilter(tbl_name)
 
-def elicit_intent(session_attributes, message):
-    '''Informs Amazon Lex that the user is expected to respond with an utterance that includes an intent. '''
-    
-    return {
-        'sessionState':{
-            'dialogAction':{
-                'type':'ElicitIntent'
-            },
-            'sessionAttributes': session_attributes
-        },
-        'messages': [message] if message != None else None
-    }
+#Account items cached across warm invocations
+account_cache = AccountCache()
 
+#Every read and write of the table goes through the repository (see bank_common.accounts)
+bank_accounts = accounts.AccountRepository(tbl_name, accounts.V2, cache=account_cache, key_filter=known_accounts)
 
-def confirm_intent(session_attributes, intent_name, slots, message):
-    '''Informs Amazon Lex that the user is expected to give a yes or no answer to confirm or deny the current intent'''
-    return {
-        'messages': [
-            message
-        ],
-        'sessionState': {
-            'sessionAttributes': session_attributes,
-            'dialogAction': {
-                'type': 'ConfirmIntent'
-            },
-            'intent': {
-                'name': intent_name,
-                'slots': slots
-            }
-        }
-    }
+#Read by the dialog's account check: only the pin it verifies, so the read is eventually
+#consistent. The balance is read strongly consistent by the fulfillment that speaks it
+VALIDATION_FIELDS = ('pin',)
 
+#Answer when the invocation runs out of time, Failed sends the contact flow to its error branch
+FALLBACK_MESSAGE = 'Sorry, I cannot reach your account right now. Please hold while I transfer you to an agent.'
 
-def elicit_slot(intent_name, slots, violated_slot, session_attributes, message):
-    '''Re-prompts user to provide a slot value in the response'''
-    return {
-        'sessionState':{
-            'sessionAttributes': session_attributes,
-            'dialogAction':{
-                'slotToElicit': violated_slot,
-                'type':'ElicitSlot'
-            },
-            'intent':{
-                'confirmationState': 'Denied',
-                'name':intent_name,
-                'slots':slots,
-                'state':'InProgress'
-            }
-        },
-        'messages': [message] if message != None else None
-    }
+#Card replacement failed without a single field to blame (unknown account, or changed meanwhile)
+DETAILS_MISMATCH_MESSAGE = 'Sorry! The details you gave do not match our records.'
 
+#Balance asked for an account that no longer exists (closed, or removed since it was verified)
+ACCOUNT_MISSING_MESSAGE = 'Sorry! I could not find your account. Please hold while I transfer you to an agent.'
 
-def delegate(intent_name, slots, session_attributes):
-    '''Directs Amazon Lex to choose the next course of action based on the bot configuration. '''
-    return {
-        'sessionState':{
-            'sessionAttributes': session_attributes,
-            'dialogAction':{
-                'type':'Delegate'
-            },
-            'intent':{
-                'name':intent_name,
-                'slots': slots
-            }
-        }
-    }
+#Intent handlers register themselves per code hook below
+router = IntentRouter(fallback=lambda request: lex.close(request, 'Failed', FALLBACK_MESSAGE))
 
 
 ''' --- Validation Functions --- '''
@@ -161,7 +76,6 @@ def isValid_Pin(pin):
     if pin:
         try:
             pin = str(pin)
-            logger.info(f'isValid PinNumber={pin}')
             if (pin.isnumeric() == 1) & (len(pin) == 4): 
                 return True
         except ValueError:
@@ -174,7 +88,6 @@ def isValid_AccountNumber(accountNumber):
     if accountNumber is not None:
         try:
             accountNumber = str(accountNumber)
-            logger.info(f'isValid AccountNumber={accountNumber}')
             if (len(accountNumber) == 12) & (accountNumber.isnumeric() == 1):
                 return True
         except ValueError:
@@ -191,19 +104,21 @@ def isValid_AccountType(accountType):
 
 
 
-def validate_balance_information(slots):
-
-    table_name = tbl_name 
+def validate_balance_information(slots, verified=None):
+    '''
+    Validates the filled slots. Lookups already covered by a verification token from an
+    earlier turn (verified) are skipped.
+    '''
 
     #Get slots
-    accountType = try_ex(lambda: slots['accountType'])
-    accountNumber = try_ex(lambda: slots['accountNumber'])
-    pin = try_ex(lambda: slots['pin'])
+    accountType = slots.get('accountType')
+    accountNumber = slots.get('accountNumber')
+    pin = slots.get('pin')
 
-    logger.info(f'accountType={accountType}, accountNumber={accountNumber}, pin={pin}')
+    logger.debug('accountType=%s, accountNumber=%s', accountType, accountNumber)
 
 
-    if accountType and not isValid_AccountType(accountType['value']['interpretedValue']):
+    if accountType and not isValid_AccountType(accountType):
         return build_validation_result(
             False,
             'accountType',
@@ -211,29 +126,31 @@ def validate_balance_information(slots):
         )
     
     if accountNumber:
-        if not isValid_AccountNumber(accountNumber['value']['interpretedValue']):
+        if not isValid_AccountNumber(accountNumber):
             return build_validation_result(
                 False,
                 'accountNumber',
-                'Sorry I did not understand. Please enter your twelve digit {} account number'.format(accountType['value']['interpretedValue'])
+                'Sorry I did not understand. Please enter your twelve digit {} account number'.format(accountType)
             )
-        if not validate_account_dynamodb(table_name, accountNumber['value']['interpretedValue']):
+        if verified is not None and verified.matches(accountNumber):
+            logger.debug('accountNumber verified on an earlier turn')
+        elif not bank_accounts.get(accountNumber, VALIDATION_FIELDS):
             return build_validation_result(
                 False,
                 'accountNumber',
-                'Sorry but the account number {} does not exist in our database. Please enter your twelve digit account number.'.format(accountNumber['value']['interpretedValue'])
+                'Sorry but the account number {} does not exist in our database. Please enter your twelve digit account number.'.format(accountNumber)
             )
     
     if pin:
-        user_pin = pin['value']['interpretedValue']
-        logger.info(f'pin={pin} and user_pin={user_pin}')
-        if not isValid_Pin(user_pin):
+        if not isValid_Pin(pin):
             return build_validation_result(
                 False,
                 'pin',
                 'Sorry this is not a valid pin. Please enter your four digit pin number.'
             )
-        if Decimal(user_pin) != get_item_dynamodb(table_name, accountNumber['value']['interpretedValue'], 'Pin'):
+        if verified is not None and verified.matches(accountNumber) and verified.covers('pin', pin):
+            logger.debug('pin verified on an earlier turn')
+        elif int(pin) != get_pin(accountNumber):
             return build_validation_result(
                 False,
                 'pin',
@@ -243,164 +160,206 @@ def validate_balance_information(slots):
     return {'isValid':True}
 
 
+def validate_replace_card_information(slots):
+    '''Format checks only, the identity check happens in the conditional update at fulfillment'''
+
+    accountNumber = slots.get('accountNumber')
+    pin = slots.get('pin')
+    firstName = slots.get('firstName')
+    lastName = slots.get('lastName')
+
+    if accountNumber and not isValid_AccountNumber(accountNumber):
+        return build_validation_result(
+            False,
+            'accountNumber',
+            'Sorry I did not understand. Please enter your twelve digit account number.'
+        )
+
+    if firstName and not isValid_Word(firstName):
+        return build_validation_result(
+            False,
+            'firstName',
+            'Sorry I did not understand. Please say your first name.'
+        )
+
+    if lastName and not isValid_Word(lastName):
+        return build_validation_result(
+            False,
+            'lastName',
+            'Sorry I did not understand. Please say your last name.'
+        )
+
+    if pin and not isValid_Pin(pin):
+        return build_validation_result(
+            False,
+            'pin',
+            'Sorry this is not a valid pin. Please enter your four digit pin number.'
+        )
+
+    return {'isValid':True}
+
+
     
 """ --- Helper Functions --- """
 
-def get_item_dynamodb(table_name, accountNumber, query_params):
-    '''retrieves element from DynamoDB'''
+def get_pin(accountNumber):
+    '''The account's pin, None for an unknown account; a cache hit after the account check'''
 
-    table = dyn_resource.Table(table_name)
-    
-    if (accountNumber is None) | (query_params is None): return False
+    if accountNumber is None: return None
 
-    try:
-        response = table.get_item(Key={
-            'AccountNumber': Decimal(accountNumber)
-        })['Item']
-    except KeyError:
-        return False
+    account = bank_accounts.get(accountNumber, VALIDATION_FIELDS)
 
-    return response[query_params]
+    return account.pin if account is not None else None
 
-def write_item_dynamodb(table_name, items):
-    '''Inserts element into DynamoDB'''
 
-    from botocore.exceptions import ClientError
 
-    table = dyn_resource.Table(table_name)
+def store_verification(session_attributes, slots, session_id):
+    '''Records the account and pin that passed validation this turn in sessionAttributes'''
 
-    try:
-        response = table.put_item(Item=items)
-    except ClientError as err:
-        if err.response['Error']['Code'] == 'InternalError':
-            logger.info('Error Message: {}'.format(err.response['Error']['Message']))
-        else:
-            raise err
+    accountNumber = slots.get('accountNumber')
+    pin = slots.get('pin')
+    if not accountNumber:
+        return
 
-    return True
-    
+    verified_slots = {'accountNumber': accountNumber}
+    if pin:
+        verified_slots['pin'] = pin
+
+    token = session_token.issue(accountNumber, verified_slots, session_id)
+    if token is not None:
+        session_attributes[session_token.SESSION_ATTRIBUTE] = token
 
-def validate_account_dynamodb(table_name, accountNumber):
-    '''Checks if account number exists in DynamoDB'''
-    
-    if accountNumber is None: return False
 
-    table = dyn_resource.Table(table_name)
+def balance_message(balance):
 
-    try:
-        response = table.get_item(Key={
-            'AccountNumber': Decimal(accountNumber)
-        })['Item']
-    except KeyError:
-        return False
+    output1 = f'The balance on your account is ${balance:,.2f} dollars. '
+    output2 = 'Thank you for banking with Example Bank. We appreciate your business. '
+    output3= 'Please stay on the line if you would like to take our customer experience survey.'
 
-    return True
+    return lex.message(output1+output2+output3)
 
 
+""" --- Functions that control the bot's behavior --- """
 
-def try_ex(func):
-    """
-    Call passed in function in try block. If KeyError is encountered return None.
-    This function is intended to be used to safely access dictionary.
-    Note that this function would have negative impact on performance.
-    """
 
-    try:
-        return func()
-    except KeyError:
-        return None
+@router.dialog('CheckBalance')
+def CheckBalanceDialog(request):
 
+    #Callers whose number matches exactly one account are not asked for it
+    caller_id.prefill_account(request, bank_accounts, 'accountNumber')
 
+    #Initialize required response parameters
+    session_attributes = request.session_attributes
+    slots = request.slots
+
+    logger.debug('source=%s, slots=%s, confirmation_status=%s', request.source, slots, request.confirmation_state)
+
+    # Valdiate any slots which have been specified. If any are invalid, re-elicit for their value.
+    verified = session_token.verify(session_attributes.get(session_token.SESSION_ATTRIBUTE), request.user_id)
+    validation_result = validate_balance_information(slots, verified)
+    logger.debug('validation_result is %s for the non-empty slots in %s', validation_result['isValid'], slots)
+    if not validation_result['isValid']:
+        request.clear_slot(validation_result['violatedSlot'])
+        logger.debug('slots=%s', slots)
+        logger.debug('violatedSlot=%s', validation_result['violatedSlot'])
+        return lex.elicit_slot(request, validation_result['violatedSlot'], validation_result['message'])
+
+    store_verification(session_attributes, slots, request.user_id)
+    
+    return lex.delegate(request)
 
 
+@router.fulfillment('CheckBalance')
+def CheckBalance(request):
 
-""" --- Functions that control the bot's behavior --- """
+    accountNumber = request.slot('accountNumber')
+    
+    account = bank_accounts.get(accountNumber, ('balance',))
+    if account is None:
+        return lex.close(request, 'Failed', ACCOUNT_MISSING_MESSAGE)
+    logger.debug('balance retrieved')
 
+    fulfillment_state = 'Fulfilled'
 
-def CheckBalance(intent_request):
+    message = balance_message(account.balance)
+    
+    return lex.close(request, fulfillment_state, message)
 
 
-    table_name = tbl_name
+@router.intent('FollowupCheckBalance')
+def FollowupCheckBalance(request):
+    '''Answers a repeat balance question using the account verified earlier in the session'''
 
-    #Initialize required response parameters
-    intent_name = intent_request['sessionState']['intent']['name']
-    session_attributes = get_session_attributes(intent_request)
-    source = intent_request['invocationSource']
-    confirmation_status = intent_request['sessionState']['intent']['confirmationState']
-    slots = get_slots(intent_request)
+    verified = session_token.verify(request.session_attributes.get(session_token.SESSION_ATTRIBUTE), request.user_id)
 
-    logger.info(f'source={source}, slots={slots}, confirmation_status={confirmation_status}')
+    if verified is None or not verified.has('pin'):
+        return lex.close(request, 'Failed', 'I need to verify your account first. Please ask to check your balance.')
 
+    account = bank_accounts.get(verified.accountNumber, ('balance',))
+    if account is None:
+        return lex.close(request, 'Failed', ACCOUNT_MISSING_MESSAGE)
+    logger.debug('balance retrieved')
 
-    #Get slot values
-    accountType = slots['accountType']
-    accountNumber = slots['accountNumber']
-    pin = slots['pin']
+    return lex.close(request, 'Fulfilled', balance_message(account.balance))
 
-    logger.info(f'accountType={accountType}, accountNumber={accountNumber}, pin={pin}')
 
+@router.dialog('ReplaceCard')
+def ReplaceCardDialog(request):
 
+    caller_id.prefill_account(request, bank_accounts, 'accountNumber')
 
+    slots = request.slots
 
-    if source == 'DialogCodeHook':
-        # Valdiate any slots which have been specified. If any are invalid, re-elicit for their value.
-        validation_result = validate_balance_information(slots)
-        logger.info('validation_result is {} for the non-empty slots in {}'.format(validation_result['isValid'],slots))
-        if not validation_result['isValid']:
-            slots[validation_result['violatedSlot']] = None
-            logger.debug(f'slots={slots}')
-            logger.info('violatedSlot={}, message={}'.format(validation_result['violatedSlot'], validation_result['message']))
-            return elicit_slot(
-                intent_name,
-                slots,
-                validation_result['violatedSlot'],
-                session_attributes,
-                validation_result['message']
-            )
-        
-        return delegate(intent_name,intent_request['sessionState']['intent']['slots'] ,session_attributes)
+    logger.debug('source=%s, slots=%s', request.source, slots)
 
-    
-    balance = get_item_dynamodb(table_name, accountNumber['value']['interpretedValue'], 'Account Balance')
-    logger.info(f'balance={balance}')
+    validation_result = validate_replace_card_information(slots)
+    if not validation_result['isValid']:
+        request.clear_slot(validation_result['violatedSlot'])
+        logger.debug('violatedSlot=%s', validation_result['violatedSlot'])
+        return lex.elicit_slot(request, validation_result['violatedSlot'], validation_result['message'])
 
-    output1 = f'The balance on your account is ${balance:,.2f} dollars. '
-    output2 = 'Thank you for banking with Example Bank. We appreciate your business. '
-    output3= 'Please stay on the line if you would like to take our customer experience survey.'
-    output = output1+output2+output3
-    fulfillment_state = 'Fulfilled'
+    return lex.delegate(request)
 
-    message = {'contentType':'PlainText', 'content':output}
-    
-    return close(intent_name, session_attributes, fulfillment_state, message)
 
+@router.fulfillment('ReplaceCard')
+def ReplaceCard(request):
+
+    slots = request.slots
+    accountNumber = slots['accountNumber']
+
+    #Identity check and card rotation in one conditional update
+    result = bank_accounts.replace_card(
+        accountNumber,
+        slots['pin'],
+        slots['firstName'],
+        slots['lastName']
+    )
+
+    if not result.replaced:
+        logger.debug('replace card failed on %s', result.failed_field)
+        if result.failed_field is None:
+            return lex.close(request, 'Failed', DETAILS_MISMATCH_MESSAGE)
+        return lex.close(request, 'Failed', f'Sorry! The {result.failed_field} you entered does not match our records.')
 
-def FollowupCheckBalance(intent_request):
-    pass
+    new_card_number = str(result.account.cardNumber)
 
+    output1 = f'An email has been sent to {result.account.email} containing your new debit card information. '
+    output2 = f'Your new debit card ending in {new_card_number[-4:]} has been mailed out to {result.account.streetAddress}. '
+    output3 = 'Please expect it to arrive within five to seven business days.'
 
-def ReplaceCard(intent_request):
-    pass
+    return lex.close(request, 'Fulfilled', output1+output2+output3)
 
 
 
 ''' --- INTENTS --- '''
 
 
-def dispatch(intent_request):
+def dispatch(request):
 
-    intent_name = intent_request['sessionState']['intent']['name']
-    
-    logger.info(f'intent_name={intent_name}')
-    
+    logger.debug('intent_name=%s', request.intent_name)
 
     #Dispatch to bot's intent handlers
-    if intent_name == 'CheckBalance':
-        return CheckBalance(intent_request)
-    elif intent_name == 'FollowupCheckBalance':
-        return FollowupCheckBalance(intent_request)
-    elif intent_name == 'ReplaceCard':
-        return ReplaceCard(intent_request)
+    return router.dispatch(request)
 
 
 ''' --- MAIN handler --- '''
@@ -409,16 +368,17 @@ def dispatch(intent_request):
 
 def lambda_handler(event, context):
     
-    # By default, treat the user request as coming from the America/New_York time zone.
-    os.environ['TZ'] = 'America/New_York'
-    time.tzset()
+    request = lex.parse(event)
 
-    bot_name = event['bot']['name']
-    userMessage = event['inputTranscript'] #string
-    inputType = event['inputMode'] #DTMF | Speech | Text
-    
+    with log.invocation(request.user_id, bot=request.bot_name, intent=request.intent_name, source=request.source), \
+            metrics.invocation(Intent=request.intent_name, Source=request.source), \
+            deadline.invocation(context):
+        logger.debug('event.bot.name=%s, inputType=%s', request.bot_name, request.input_mode)
 
-    logger.info(f'event.bot.name={bot_name}, userMessage={userMessage}, inputType={inputType}')
+        response = dispatch(request)
+        log.annotate(account_cache=account_cache.stats())
+        #stats() builds a dict, only worth it when the line is written
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('router_stats=%s', router.stats())
 
-
-    return dispatch(event)
\ No newline at end of file
+    return response
@@ -1,219 +1,102 @@
-import json
+import logging
 import os
 import time
-import boto3
-import logging
 from decimal import Decimal
 
+from bank_common import accounts, deadline, dynamo, lex, log, metrics
+from bank_common.router import IntentRouter
 
-#Configure logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
-
-#Initialize DynamoDB resource
-dyn_resource = boto3.resource('dynamodb')
-tbl_name = 'BankAccountsNew'
 
+# By default, treat the user request as coming from the America/New_York time zone.
+# Set once per container instead of on every invocation.
+os.environ['TZ'] = 'America/New_York'
+time.tzset()
 
 
-""" --- Generic functions used to simplify interaction with Amazon Lex --- """
-
-def get_slots(intent_request):
-    return intent_request['sessionState']['intent']['slots']
-
-# def get_slot(intent_request, slotName):
-#     slots = get_slots(intent_request)
-#     if slots is not None and slotName in slots and slots[slotName] is not None:
-#         return slots[slotName]['value']['interpretedValue']
-#     else:
-#         return None 
-
-def get_session_attributes(intent_request):
-    sessionState = intent_request['sessionState']
-    if 'sessionAttributes' in sessionState:
-        return sessionState['sessionAttributes']
-    
-    return {}
-
-def elicit_slot(session_attributes, intent_name, slots, slot_to_elicit, message):
-    return {
-        'messages': [
-            message
-        ],
-        'sessionState': {
-            'sessionAttributes': session_attributes,
-            'dialogAction': {
-                'type': 'ElicitSlot',            
-                'slotToElicit': slot_to_elicit
-            },
-            'intent': {
-                'name': intent_name,
-                'slots': slots
-            }
-        }
-    }
-
-
-def confirm_intent(session_attributes, intent_name, slots, message):
-    return {
-        'messages': [
-            message
-        ],
-        'sessionState': {
-            'sessionAttributes': session_attributes,
-            'dialogAction': {
-                'type': 'ConfirmIntent'
-            },
-            'intent': {
-                'name': intent_name,
-                'slots': slots
-            }
-        }
-    }
-
-
-def close(session_attributes, intent_name, fulfillment_state, message):
-    response = {
-        'messages': [
-            message
-        ],
-        'sessionState': {
-            'dialogAction': {
-                'type': 'Close'           
-            },
-            'sessionAttributes': session_attributes,
-            'intent': {
-                'name': intent_name,
-                'state': fulfillment_state
-            }
-        }
-    }
+#Configure logger, level/format/debug sampling come from LOG_LEVEL, LOG_FORMAT and LOG_DEBUG_SAMPLE_RATE
+logger = log.configure()
 
-    return response
 
+#Initialize DynamoDB client during the init phase, it is needed by the first request
+dynamo.get_client()
+tbl_name = 'BankAccountsNew'
 
-def delegate(session_attributes, intent_name, slots):
-    return {
-        'sessionState': {
-            'dialogAction': {
-                'type': 'Delegate'           
-            },
-            'sessionAttributes': session_attributes,
-            'intent': {
-                'name': intent_name,
-                'slots': slots
-            }
-        }
-    }
+#Answer when the invocation runs out of time, Failed sends the contact flow to its error branch
+FALLBACK_MESSAGE = 'Sorry, I cannot open your account right now. Please hold while I transfer you to an agent.'
 
-''' --- Validation Functions --- '''
+#Intent handlers register themselves below
+router = IntentRouter(fallback=lambda request: lex.close(request, 'Failed', FALLBACK_MESSAGE))
 
-def build_validation_result():
-    pass 
+#New accounts are written with one conditional put under numbers leased in blocks per container
+bank_accounts = accounts.AccountRepository(tbl_name, accounts.V2)
 
+#Spoken account type -> stored account type
+ACCOUNT_TYPES = {'checking': 'Checking', 'checkings': 'Checking', 'savings': 'Savings', 'saving': 'Savings'}
 
 
 
 """ --- Helper Functions --- """
 
 
-def try_ex(func):
-    """
-    Call passed in function in try block. If KeyError is encountered return None.
-    This function is intended to be used to safely access dictionary.
-
-    Note that this function would have negative impact on performance.
-    """
-
-    try:
-        return func()
-    except KeyError:
-        return None
-
+def open_account(accountType):
+    '''Creates an empty account of the given type and returns its new account number'''
 
-def write_item_dynamodb(table_name, items):
-    '''Inserts element into DynamoDB'''
+    accountNumber = bank_accounts.create({'accountType': accountType, 'balance': Decimal(0)})
+    logger.debug('opened %s account', accountType)
 
-    from botocore.exceptions import ClientError
+    return accountNumber
 
-    table = dyn_resource.Table(table_name)
 
-    try:
-        response = table.put_item(Item=items)
-    except ClientError as err:
-        if err.response['Error']['Code'] == 'InternalError':
-            logger.info('Error Message: {}'.format(err.response['Error']['Message']))
-        else:
-            raise err
-
-    return True
-    
-
-def validate_account_dynamodb(table_name, accountNumber):
-    '''Checks if account number exists in DynamoDB'''
-    
-    if accountNumber is None: return False
-
-    table = dyn_resource.Table(table_name)
-
-    try:
-        response = table.get_item(Key={
-            'AccountNumber': Decimal(accountNumber)
-        })['Item']
-    except KeyError:
-        return False
-
-    return True
-
-
-def generate_account_number():
+""" --- Functions that control the bot's behavior --- """
 
-    import uuid
+@router.dialog('OpenAccount')
+def OpenAccountDialog(request):
 
-    #Generate unique 12-digit Account Number
-    newAccountNumber = Decimal(str(uuid.uuid4().int)[:12])
+    accountType = request.slot('accountType')
 
+    logger.debug('source=%s, slots=%s, confirmation_status=%s', request.source, request.slots, request.confirmation_state)
 
-    #Validation check for uniqueness/existence
-    if validate_account_dynamodb(table_name, newAccountNumber):
-        generate_account_number()
-    
-    return Decimal(newAccountNumber)
+    if accountType and accountType.lower() not in ACCOUNT_TYPES:
+        request.clear_slot('accountType')
+        return lex.elicit_slot(
+            request,
+            'accountType',
+            'Sorry I did not understand. Would you like to open a Checking account or a Savings account?'
+        )
 
+    return lex.delegate(request)
 
-""" --- Functions that control the bot's behavior --- """
 
-def OpenAccount(intent_request):
+@router.fulfillment('OpenAccount')
+def OpenAccount(request):
 
-    #Set DynamoDB table name
-    table_name = tbl_name
+    session_attributes = request.session_attributes
+    accountType = ACCOUNT_TYPES[request.slot('accountType').lower()]
 
-    #Initialize required response parameters
-    intent_name = intent_request['sessionState']['intent']['name']
-    session_attributes = get_session_attributes(intent_request)
-    source = intent_request['invocationSource']
-    confirmation_status = intent_request['sessionState']['intent']['confirmationState']
-    slots = get_slots(intent_request)
+    #A repeated fulfillment of the same conversation must not open a second account
+    accountNumber = session_attributes.get('openedAccount')
+    if accountNumber is None:
+        accountNumber = str(open_account(accountType))
+        session_attributes['openedAccount'] = accountNumber
 
-    logger.info(f'source={source}, slots={slots}, confirmation_status={confirmation_status}')
+    output1 = f'Your new {accountType} account is open. Your account number is {" ".join(accountNumber)}. '
+    output2 = 'Thank you for banking with Example Bank.'
 
+    return lex.close(request, 'Fulfilled', output1+output2)
 
-    #Get slot values
-    accountType = slots['accountType']
-    
 
 
 ''' --- INTENTS --- '''
 
 
-def dispatch(intent_request):
+def dispatch(request):
 
-    intent_name = intent_request['sessionState']['intent']['name']
+    intent_name = request.intent_name
+
+    logger.debug('intent_name=%s', intent_name)
 
     #Dispatch to bot's intent handlers
-    if intent_name == 'OpenAccount':
-        return OpenAccount(intent_request)
+    return router.dispatch(request)
 
 
 ''' --- MAIN handler --- '''
@@ -221,20 +104,16 @@ def dispatch(intent_request):
 
 def lambda_handler(event, context):
     
-    # By default, treat the user request as coming from the America/New_York time zone.
-    os.environ['TZ'] = 'America/New_York'
-    time.tzset()
-
-
-    bot_name = event['bot']['name']
-    userMessage = event['inputTranscript'] #string
-    inputType = event['inputMode'] #DTMF | Speech | Text
-    
-
-    logger.info(f'event.bot.name={bot_name}, userMessage={userMessage}, inputType={inputType}')
-
-
-    return dispatch(event)
+    request = lex.parse(event)
 
+    with log.invocation(request.user_id, bot=request.bot_name, intent=request.intent_name, source=request.source), \
+            metrics.invocation(Intent=request.intent_name, Source=request.source), \
+            deadline.invocation(context):
+        logger.debug('event.bot.name=%s, inputType=%s', request.bot_name, request.input_mode)
 
+        response = dispatch(request)
+        #stats() builds a dict, only worth it when the line is written
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('router_stats=%s', router.stats())
 
+    return response
@@ -1,240 +1,163 @@
-import json
+import logging
 import os
 import time
-import boto3
-import logging
-from decimal import Decimal
-
-
-#Configure logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
-
-#Initialize DynamoDB resource
-dyn_resource = boto3.resource('dynamodb')
-tbl_name = 'BankAccountsNew'
-
-
-
-""" --- Generic functions used to simplify interaction with Amazon Lex --- """
-
-def get_slots(intent_request):
-    return intent_request['sessionState']['intent']['slots']
-
-# def get_slot(intent_request, slotName):
-#     slots = get_slots(intent_request)
-#     if slots is not None and slotName in slots and slots[slotName] is not None:
-#         return slots[slotName]['value']['interpretedValue']
-#     else:
-#         return None 
-
-def get_session_attributes(intent_request):
-    sessionState = intent_request['sessionState']
-    if 'sessionAttributes' in sessionState:
-        return sessionState['sessionAttributes']
-    
-    return {}
-
-def elicit_slot(session_attributes, intent_name, slots, slot_to_elicit, message):
-    return {
-        'messages': [
-            message
-        ],
-        'sessionState': {
-            'sessionAttributes': session_attributes,
-            'dialogAction': {
-                'type': 'ElicitSlot',            
-                'slotToElicit': slot_to_elicit
-            },
-            'intent': {
-                'name': intent_name,
-                'slots': slots
-            }
-        }
-    }
-
-
-def confirm_intent(session_attributes, intent_name, slots, message):
-    return {
-        'messages': [
-            message
-        ],
-        'sessionState': {
-            'sessionAttributes': session_attributes,
-            'dialogAction': {
-                'type': 'ConfirmIntent'
-            },
-            'intent': {
-                'name': intent_name,
-                'slots': slots
-            }
-        }
-    }
-
-
-def close(session_attributes, intent_name, fulfillment_state, message):
-    response = {
-        'messages': [
-            message
-        ],
-        'sessionState': {
-            'dialogAction': {
-                'type': 'Close'           
-            },
-            'sessionAttributes': session_attributes,
-            'intent': {
-                'name': intent_name,
-                'state': fulfillment_state
-            }
-        }
-    }
 
-    return response
+from bank_common import deadline, dynamo, lex, log, metrics, survey
+from bank_common.router import IntentRouter
 
 
-def delegate(session_attributes, intent_name, slots):
-    return {
-        'sessionState': {
-            'dialogAction': {
-                'type': 'Delegate'           
-            },
-            'sessionAttributes': session_attributes,
-            'intent': {
-                'name': intent_name,
-                'slots': slots
-            }
-        }
-    }
+# By default, treat the user request as coming from the America/New_York time zone.
+# Set once per container instead of on every invocation.
+os.environ['TZ'] = 'America/New_York'
+time.tzset()
 
-''' --- Validation Functions --- '''
 
-def build_validation_result():
-    pass 
+#Configure logger, level/format/debug sampling come from LOG_LEVEL, LOG_FORMAT and LOG_DEBUG_SAMPLE_RATE
+logger = log.configure()
 
 
+#Initialize DynamoDB client during the init phase, it is needed by the first flush
+dynamo.get_client()
 
+#Answers of every caller served by this container, written in batches (see bank_common.survey)
+answers = survey.AnswerBuffer()
 
-""" --- Helper Functions --- """
+#Answer when the invocation runs out of time, Failed sends the contact flow to its error branch
+FALLBACK_MESSAGE = 'Sorry, I cannot record your answers right now. Thank you for your time.'
 
+#Intent handlers register themselves below
+router = IntentRouter(fallback=lambda request: lex.close(request, 'Failed', FALLBACK_MESSAGE))
 
-def try_ex(func):
-    """
-    Call passed in function in try block. If KeyError is encountered return None.
-    This function is intended to be used to safely access dictionary.
+#Questions already buffered for this caller, so a later turn does not record them again
+ANSWERED_ATTRIBUTE = 'surveyAnswered'
+
+#Spoken yes / no -> stored answer
+YES_NO = {'yes': 'yes', 'yeah': 'yes', 'yep': 'yes', 'sure': 'yes', 'no': 'no', 'nope': 'no', 'not really': 'no'}
+
+
+
+''' --- Validation Functions --- '''
 
-    Note that this function would have negative impact on performance.
-    """
+def parse_rating(value, lowest, highest):
+    '''A spoken rating as an int, None when it is not a whole number from lowest to highest'''
 
-    try:
-        return func()
-    except KeyError:
+    value = str(value).strip()
+    if not value.isdecimal():
         return None
+    rating = int(value)
+    return rating if lowest <= rating <= highest else None
 
 
-def write_item_dynamodb(table_name, items):
-    '''Inserts element into DynamoDB'''
+def parse_yes_no(value):
 
-    from botocore.exceptions import ClientError
+    return YES_NO.get(str(value).strip().lower())
 
-    table = dyn_resource.Table(table_name)
 
-    try:
-        response = table.put_item(Item=items)
-    except ClientError as err:
-        if err.response['Error']['Code'] == 'InternalError':
-            logger.info('Error Message: {}'.format(err.response['Error']['Message']))
-        else:
-            raise err
+#Survey slot -> (parser returning the stored answer or None, prompt when the answer is not understood)
+QUESTIONS = {
+    'satisfaction': (
+        lambda value: parse_rating(value, 1, 5),
+        'Sorry I did not understand. On a scale of 1 to 5, how satisfied were you with your call today?'
+    ),
+    'resolved': (
+        parse_yes_no,
+        'Sorry I did not understand. Was your question resolved today? Please say yes or no.'
+    ),
+    'recommend': (
+        lambda value: parse_rating(value, 0, 10),
+        'Sorry I did not understand. On a scale of 0 to 10, how likely are you to recommend Example Bank to a friend?'
+    ),
+}
 
-    return True
-    
 
-def validate_account_dynamodb(table_name, accountNumber):
-    '''Checks if account number exists in DynamoDB'''
-    
-    if accountNumber is None: return False
 
-    table = dyn_resource.Table(table_name)
 
-    try:
-        response = table.get_item(Key={
-            'AccountNumber': Decimal(accountNumber)
-        })['Item']
-    except KeyError:
-        return False
+""" --- Helper Functions --- """
 
-    return True
 
+def record_answers(request):
+    '''
+    Buffers the newly given answers of this turn. Returns the slot to elicit again when an
+    answer was not understood, None when every given answer was recorded.
+    '''
 
-def generate_account_number():
+    answered = request.session_attributes.get(ANSWERED_ATTRIBUTE, '').split()
 
-    import uuid
+    for question, (parse, _) in QUESTIONS.items():
+        value = request.slot(question)
+        if value is None or question in answered:
+            continue
 
-    #Generate unique 12-digit Account Number
-    newAccountNumber = Decimal(str(uuid.uuid4().int)[:12])
+        answer = parse(value)
+        if answer is None:
+            return question
 
+        answers.record(request.user_id, question, answer, bot=request.bot_name)
+        answered.append(question)
+        request.session_attributes[ANSWERED_ATTRIBUTE] = ' '.join(answered)
 
-    #Validation check for uniqueness/existence
-    if validate_account_dynamodb(table_name, newAccountNumber):
-        generate_account_number()
-    
-    return Decimal(newAccountNumber)
+    return None
 
 
 """ --- Functions that control the bot's behavior --- """
 
-def OpenAccount(intent_request):
+@router.dialog('Survey')
+def SurveyDialog(request):
+
+    logger.debug('source=%s, slots=%s, confirmation_status=%s', request.source, request.slots, request.confirmation_state)
+
+    #Each answer is recorded on the turn it is given, a caller who hangs up midway still counts
+    question = record_answers(request)
+    if question is not None:
+        request.clear_slot(question)
+        return lex.elicit_slot(request, question, QUESTIONS[question][1])
 
-    #Set DynamoDB table name
-    table_name = tbl_name
+    return lex.delegate(request)
 
-    #Initialize required response parameters
-    intent_name = intent_request['sessionState']['intent']['name']
-    session_attributes = get_session_attributes(intent_request)
-    source = intent_request['invocationSource']
-    confirmation_status = intent_request['sessionState']['intent']['confirmationState']
-    slots = get_slots(intent_request)
 
-    logger.info(f'source={source}, slots={slots}, confirmation_status={confirmation_status}')
+@router.fulfillment('Survey')
+def Survey(request):
 
+    question = record_answers(request)
+    if question is not None:
+        request.clear_slot(question)
+        return lex.elicit_slot(request, question, QUESTIONS[question][1])
+
+    return lex.close(request, 'Fulfilled', 'Thank you for taking our survey. We appreciate your business!')
 
-    #Get slot values
-    accountType = slots['accountType']
-    
 
 
 ''' --- INTENTS --- '''
 
 
-def dispatch(intent_request):
+def dispatch(request):
+
+    intent_name = request.intent_name
 
-    intent_name = intent_request['sessionState']['intent']['name']
+    logger.debug('intent_name=%s', intent_name)
 
     #Dispatch to bot's intent handlers
-    if intent_name == 'OpenAccount':
-        return OpenAccount(intent_request)
+    return router.dispatch(request)
 
 
 ''' --- MAIN handler --- '''
 
 
 def lambda_handler(event, context):
-    
-    # By default, treat the user request as coming from the America/New_York time zone.
-    os.environ['TZ'] = 'America/New_York'
-    time.tzset()
 
+    request = lex.parse(event)
 
-    bot_name = event['bot']['name']
-    userMessage = event['inputTranscript'] #string
-    inputType = event['inputMode'] #DTMF | Speech | Text
-    
-
-    logger.info(f'event.bot.name={bot_name}, userMessage={userMessage}, inputType={inputType}')
-
-
-    return dispatch(event)
+    with log.invocation(request.user_id, bot=request.bot_name, intent=request.intent_name, source=request.source), \
+            metrics.invocation(Intent=request.intent_name, Source=request.source), \
+            deadline.invocation(context):
+        logger.debug('event.bot.name=%s, inputType=%s', request.bot_name, request.input_mode)
 
+        response = dispatch(request)
+        #stats() builds a dict, only worth it when the line is written
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('router_stats=%s', router.stats())
 
+        #Only every batch_size-th caller (or an old buffer) pays for a write
+        answers.flush_if_due()
 
+    return response
@@ -1,45 +1,100 @@
 #Lambda example found on StackExchange performing Data dip from DynamoDB.
 
-import boto3
-import json
-from boto3.dynamodb.conditions import Key, Attr
+import os
+
+from bank_common import bloom, contact_list, deadline, dynamo, fanout, log, metrics
+
+
+#Configure logger, level/format/debug sampling come from LOG_LEVEL, LOG_FORMAT and LOG_DEBUG_SAMPLE_RATE
+logger = log.configure()
+
+#Client and table are created once per container instead of on every call
+dynamo.get_client('ap-southeast-2')
+table = dynamo.get_table('data_dip_table', region_name='ap-southeast-2')
+
+#Transfer route of the caller, read next to the greeting (see bank_common.contact_list for the table)
+contacts = dynamo.get_table(os.environ.get('CONTACT_LIST_TABLE', contact_list.DEFAULT_TABLE), region_name='ap-southeast-2')
+
+#Numbers known to data_dip_table, most callers are not and skip the GetItem (see bank_common.bloom)
+known_numbers = bloom.KeyFilter('data_dip_table')
+
+#Amazon Connect stops waiting for a data dip after 8 seconds, answer before it does
+CONNECT_TIMEOUT_MS = 8000
+
+#Generic greeting when the lookup cannot finish in time
+FALLBACK_RESPONSE = {'welcomeMessage': 'Welcome!'}
+
 
 def lambda_handler(event, context):
-    print("Lambda Trigger event: " + json.dumps(event))
 
-    try:
+    contact_data = event.get('Details', {}).get('ContactData', {})
+
+    with log.invocation(contact_data.get('ContactId'), handler='data_dip') as summary, \
+            metrics.invocation(Intent='DataDip', Source='ContactFlow'), \
+            deadline.invocation(context, max_ms=CONNECT_TIMEOUT_MS):
+        logger.debug('Lambda Trigger event: %s', event)
+
+        try:
+
+            phoneNumber = contact_data['CustomerEndpoint']['Address']
+            logger.debug('Customer Phone Number : %s', phoneNumber)
+
+            known = known_numbers.might_contain(phoneNumber)
+
+            #Greeting and route side by side, the dip takes as long as the slower of the two reads
+            with fanout.Fanout() as calls:
+                route = calls.get_item(contacts, Key={'origin': phoneNumber}, **dynamo.projection(['transferTo']))
+                if known:
+                    #Only the greeting's field, eventually consistent (half the read units)
+                    greeting = calls.get_item(table, Key={
+                                            'phone-number': phoneNumber
+                                            }, **dynamo.projection(['first-name']))
+
+            result = { 'welcomeMessage' : 'Welcome!' }
 
-        phoneNumber = event['Details']['ContactData']['CustomerEndpoint']['Address']
-        print("Customer Phone Number : " + phoneNumber)
+            try:
+                transferTo = route.result().get('Item', {}).get('transferTo')
+            except dynamo.ClientError:
+                #The route is optional, the caller is still greeted
+                logger.exception('Contact list lookup failed')
+                transferTo = None
+            if transferTo:
+                summary['transfer'] = True
+                result['transferTo'] = transferTo
 
-        dynamodb = boto3.resource('dynamodb',region_name='ap-southeast-2')
+            if not known:
+                summary['match'] = False
+                summary['filtered'] = True
 
-        table = dynamodb.Table('data_dip_table')
+                return result
 
-        response = table.get_item(Key={
-                                'phone-number': phoneNumber
-                                })
-        print("dynamodb response: " + json.dumps(response))
+            response = greeting.result()
+            logger.debug('dynamodb response: %s', response)
 
-        if 'Item' in response:
-            # TODO: Match Found
-            print("Phone number match found!")
+            if 'Item' in response:
+                # TODO: Match Found
+                summary['match'] = True
 
-            firstName = response['Item']['first-name']
-            print("Customer First Name: " + firstName)
+                firstName = response['Item']['first-name']
 
-            welcomeMessage = 'Welcome' + firstName + ' to Our data dip'
-            print("welcome message :" + welcomeMessage)
+                welcomeMessage = 'Welcome' + firstName + ' to Our data dip'
+                logger.debug('welcome message : %s', welcomeMessage)
 
-            return {'welcomeMessage' : welcomeMessage }
+                result['welcomeMessage'] = welcomeMessage
+                return result
 
-        else:
-            print("Phone Number was not Found")
+            else:
+                summary['match'] = False
+                known_numbers.false_positive()
 
-            return { 'welcomeMessage' : 'Welcome!' }
+                return result
 
-    except Exception as e:
-        print("An Error Has Occurred")
-        print(e)
-        return {'welcomeMessage' : 'Welcome !'}
+        except deadline.DeadlineExceeded as e:
+            logger.warning('%s, answering with the fallback greeting', e)
+            metrics.count('DeadlineFallbacks')
+            summary['fallback'] = True
+            return FALLBACK_RESPONSE
 
+        except Exception as e:
+            logger.exception('An Error Has Occurred')
+            return {'welcomeMessage' : 'Welcome !'}
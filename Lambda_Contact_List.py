@@ -0,0 +1,45 @@
+#Contact list Lambda from CreateContactList.ipynb: stores and looks up where a caller is transferred to.
+
+from bank_common import contact_list, deadline, log, metrics
+
+
+#Configure logger, level/format/debug sampling come from LOG_LEVEL, LOG_FORMAT and LOG_DEBUG_SAMPLE_RATE
+logger = log.configure()
+
+#Whole contact list in memory, loaded on the first call and refreshed inline when due (see bank_common.contact_list)
+routes = contact_list.RouteTable()
+
+#Amazon Connect stops waiting for a Lambda after 8 seconds
+CONNECT_TIMEOUT_MS = 8000
+
+
+def lambda_handler(event, context):
+
+    details = event.get('Details', {})
+    contact_data = details.get('ContactData', {})
+
+    with log.invocation(contact_data.get('ContactId'), handler='contact_list') as summary, \
+            metrics.invocation(Intent='ContactList', Source='ContactFlow'), \
+            deadline.invocation(context, max_ms=CONNECT_TIMEOUT_MS):
+        logger.debug('Lambda Trigger event: %s', event)
+
+        address = contact_data.get('CustomerEndpoint', {}).get('Address')
+        if not address:
+            raise ValueError('JSON object is invalid')
+
+        transferTo = details.get('Parameters', {}).get('transferTo')
+
+        if transferTo: #will update if transferTo is in parameters
+            routes.put(address, transferTo)
+            summary['update'] = True
+
+            return {'origin': address, 'transferTo': transferTo}
+
+        #else it will look the route up
+        transferTo = routes.get(address)
+        summary['match'] = transferTo is not None
+        if transferTo is None:
+            #The contact flow takes its error branch when there is no route
+            raise LookupError('not found')
+
+        return {'origin': address, 'transferTo': transferTo}
@@ -0,0 +1,6 @@
+'''
+Shared helpers for the bank Lambda functions (Lex V1, Lex V2 and Amazon Connect data dips).
+
+Package the repository root (or this folder as a Lambda layer) so that the handlers in
+Bank_Contact_Flow and Bank_Contact_Flow_V2 can import it.
+'''
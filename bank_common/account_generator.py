@@ -0,0 +1,308 @@
+'''
+Seeded, vectorized synthetic bank-account generator for load testing.
+
+Accounts are produced in NumPy chunks and streamed to NDJSON in the BankAccounts (Lex V1) or
+BankAccountsNew (Lex V2, space-separated attribute names) schema, so 1M-50M rows never sit in
+memory at once. The same seed and chunk size always yield the same accounts; account and card
+numbers depend on the row number alone.
+
+Uniqueness without bookkeeping: row i gets AccountNumber 10^11 + (a*i + b) mod 9*10^11, an
+affine permutation of all 12-digit numbers (a is coprime with the modulus). Card numbers use
+the same construction over 14 digits behind a '4' issuer prefix plus a Luhn check digit, so
+they are unique, 16 digits long and pass card-number validation.
+
+    python -m bank_common.account_generator --count 1000000 --schema v2 --output accounts.ndjson
+
+The output feeds bank_common.bulk_load directly.
+'''
+
+import sys
+import json
+import math
+import gzip
+import argparse
+
+import numpy as np
+
+from bank_common import accounts
+
+
+ACCOUNT_BASE = 10 ** 11
+ACCOUNT_SPACE = 9 * 10 ** 11 #every 12-digit number
+CARD_PREFIX = 4 * 10 ** 15
+CARD_SPACE = 10 ** 14 #14 digits between the issuer prefix and the check digit
+
+#Weighted pools, weights are relative frequencies
+FIRST_NAMES = {
+    'James': 3.3, 'Mary': 2.6, 'Robert': 3.1, 'Patricia': 1.1, 'John': 3.2, 'Jennifer': 1.0,
+    'Michael': 2.6, 'Linda': 1.0, 'David': 2.4, 'Elizabeth': 0.9, 'William': 2.4, 'Barbara': 1.0,
+    'Richard': 1.7, 'Susan': 0.8, 'Joseph': 1.5, 'Jessica': 0.8, 'Thomas': 1.4, 'Sarah': 0.8,
+    'Maria': 0.8, 'Larry': 0.5, 'Laura': 0.5, 'Ayesha': 0.2, 'Brian': 0.7, 'Steven': 0.7,
+    'Omar': 0.2, 'Lorenzo': 0.2, 'Wei': 0.3, 'Priya': 0.2, 'Carlos': 0.5, 'Fatima': 0.2,
+}
+
+LAST_NAMES = {
+    'Smith': 2.4, 'Johnson': 1.9, 'Williams': 1.6, 'Brown': 1.4, 'Jones': 1.4, 'Garcia': 1.2,
+    'Miller': 1.1, 'Davis': 1.1, 'Rodriguez': 1.1, 'Martinez': 1.1, 'Hernandez': 1.0, 'Lopez': 0.9,
+    'Gonzalez': 0.8, 'Wilson': 0.8, 'Anderson': 0.8, 'Doe': 0.3, 'Diaz': 0.6, 'Chowdhury': 0.2,
+    'Lee': 0.7, 'Napoli': 0.1, 'Mann': 0.2, 'Omarion': 0.1, 'Lorentz': 0.1, 'Nguyen': 0.5,
+    'Patel': 0.4, 'Kim': 0.4, 'Chen': 0.4, 'Singh': 0.3,
+}
+
+#(city, state, area code, first zipcode, zipcodes in the city): weight
+CITIES = {
+    ('New York', 'NY', '212', 10001, 280): 8.3,
+    ('Brooklyn', 'NY', '718', 11201, 40): 2.6,
+    ('Boston', 'MA', '617', 2108, 30): 0.7,
+    ('Chicago', 'IL', '312', 60601, 60): 2.7,
+    ('Los Angeles', 'CA', '213', 90001, 90): 3.9,
+    ('Houston', 'TX', '713', 77001, 99): 2.3,
+    ('Phoenix', 'AZ', '602', 85001, 55): 1.6,
+    ('Philadelphia', 'PA', '215', 19102, 50): 1.6,
+    ('Atlanta', 'GA', '404', 30301, 60): 0.5,
+    ('Seattle', 'WA', '206', 98101, 99): 0.7,
+}
+
+STREETS = {
+    'Main': 1.0, 'Broadway': 0.8, 'Fickleberry': 0.1, 'Fair': 0.3, 'Division': 0.3, 'Seaman': 0.1,
+    'Amherst': 0.2, 'Elmhurst': 0.2, 'Oak': 0.9, 'Pine': 0.8, 'Maple': 0.8, 'Cedar': 0.6,
+    'Washington': 0.7, 'Lake': 0.5, 'Hill': 0.5, 'Park': 0.7, 'Dalmations': 0.05, 'MilkyWay': 0.05,
+}
+
+STREET_SUFFIXES = {'Street': 3.0, 'Avenue': 2.0, 'Road': 1.0, 'Drive': 1.0, 'Way': 0.5, 'Place': 0.4, 'Boulevard': 0.3}
+
+EMAIL_DOMAINS = {'gmail.com': 5.0, 'yahoo.com': 1.5, 'outlook.com': 1.2, 'icloud.com': 1.0, 'aol.com': 0.3}
+
+ACCOUNT_TYPES = {'Checking': 0.7, 'Savings': 0.3}
+
+APARTMENT_SHARE = 0.45
+OVERDRAWN_SHARE = 0.02
+
+#Logical field -> attribute name in each table
+V1_SCHEMA = accounts.V1.attributes
+V2_SCHEMA = accounts.V2.attributes
+
+SCHEMAS = {'v1': V1_SCHEMA, 'v2': V2_SCHEMA}
+
+#Numeric fields are written as JSON numbers, the rest as strings
+NUMERIC_FIELDS = frozenset({'accountNumber', 'cardNumber', 'pin', 'zipcode', 'balance', 'ssn'})
+
+
+def _pool(weights):
+    values = list(weights)
+    probabilities = np.array([weights[v] for v in values], dtype=float)
+    return values, probabilities / probabilities.sum()
+
+
+def _mulmod(x, a, m):
+    '''(x * a) % m elementwise for uint64 x < m < 2**53 without overflowing 64 bits'''
+
+    result = np.zeros_like(x)
+    for shift in range(math.ceil(a.bit_length() / 10) * 10 - 10, -10, -10):
+        chunk = np.uint64((a >> shift) & 0x3FF)
+        result = (result * np.uint64(1 << 10) + x * chunk) % np.uint64(m)
+    return result
+
+
+def _affine_parameters(rng, modulus):
+    '''Multiplier coprime with the modulus and an offset, so i -> (a*i + b) % m is a permutation'''
+
+    while True:
+        a = int(rng.integers(modulus // 3, modulus - 1))
+        if math.gcd(a, modulus) == 1:
+            return a, int(rng.integers(0, modulus))
+
+
+def luhn_check_digits(numbers, length):
+    '''Check digit appended to each number of `length` digits'''
+
+    total = np.zeros(numbers.shape, dtype=np.int64)
+    remaining = numbers.astype(np.int64)
+    for position in range(length):
+        digit = remaining % 10
+        remaining //= 10
+        if position % 2 == 0:
+            #Rightmost payload digit is doubled once the check digit is appended
+            digit = digit * 2
+            digit = np.where(digit > 9, digit - 9, digit)
+        total += digit
+    return (10 - total % 10) % 10
+
+
+class AccountGenerator:
+    '''Reproducible account stream: chunk(start, size) always returns the same rows'''
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        parameters = np.random.default_rng([seed, 0])
+        self.account_affine = _affine_parameters(parameters, ACCOUNT_SPACE)
+        self.card_affine = _affine_parameters(parameters, CARD_SPACE)
+
+        self.first_names = _pool(FIRST_NAMES)
+        self.last_names = _pool(LAST_NAMES)
+        self.cities = _pool(CITIES)
+        self.streets = _pool(STREETS)
+        self.suffixes = _pool(STREET_SUFFIXES)
+        self.domains = _pool(EMAIL_DOMAINS)
+        self.account_types = _pool(ACCOUNT_TYPES)
+
+    def _choice(self, rng, pool, size):
+        return rng.choice(len(pool[0]), size=size, p=pool[1])
+
+    def chunk(self, start, size):
+        '''Column arrays (logical field -> numpy array) for rows start .. start + size - 1'''
+
+        #Per-chunk generator keyed by the chunk start: chunks can be generated in any order
+        rng = np.random.default_rng([self.seed, 1, start])
+        index = np.arange(start, start + size, dtype=np.uint64)
+
+        a, b = self.account_affine
+        account_numbers = (_mulmod(index, a, ACCOUNT_SPACE) + np.uint64(b)) % np.uint64(ACCOUNT_SPACE)
+        account_numbers = account_numbers + np.uint64(ACCOUNT_BASE)
+
+        a, b = self.card_affine
+        card_body = (_mulmod(index, a, CARD_SPACE) + np.uint64(b)) % np.uint64(CARD_SPACE)
+        card_payload = card_body + np.uint64(CARD_PREFIX // 10)
+        card_numbers = card_payload * np.uint64(10) + luhn_check_digits(card_payload, 15).astype(np.uint64)
+
+        first = self._choice(rng, self.first_names, size)
+        last = self._choice(rng, self.last_names, size)
+        city = self._choice(rng, self.cities, size)
+        city_rows = self.cities[0]
+        zip_base = np.array([c[3] for c in city_rows])[city]
+        zip_span = np.array([c[4] for c in city_rows])[city]
+
+        street = self._choice(rng, self.streets, size)
+        suffix = self._choice(rng, self.suffixes, size)
+        house = rng.integers(1, 10000, size)
+        apartment = rng.random(size) < APARTMENT_SHARE
+        floor = rng.integers(1, 30, size)
+        unit = rng.integers(0, 12, size)
+
+        balance = np.round(rng.lognormal(mean=8.5, sigma=1.6, size=size)).astype(np.int64)
+        overdrawn = rng.random(size) < OVERDRAWN_SHARE
+        balance = np.where(overdrawn, -rng.integers(1, 500, size), balance)
+
+        return {
+            'accountNumber': account_numbers,
+            'cardNumber': card_numbers,
+            'pin': rng.integers(1000, 10000, size),
+            'firstName': first,
+            'lastName': last,
+            'city': city,
+            'zipcode': zip_base + rng.integers(0, zip_span),
+            'street': street,
+            'suffix': suffix,
+            'house': house,
+            'apartment': apartment,
+            'floor': floor,
+            'unit': unit,
+            'email_number': rng.integers(1, 1000, size),
+            'email_has_number': rng.random(size) < 0.6,
+            'domain': self._choice(rng, self.domains, size),
+            'accountType': self._choice(rng, self.account_types, size),
+            'balance': balance,
+            'ssn': rng.integers(100000000, 900000000, size),
+            'phone': rng.integers(2000000, 10000000, size),
+        }
+
+    def records(self, start, size):
+        '''Plain dicts (logical field names) for a chunk, mostly for small outputs and tests'''
+
+        columns = self.chunk(start, size)
+        return [dict(zip(LOGICAL_FIELDS, row)) for row in self._rows(columns)]
+
+    def _rows(self, columns):
+        '''Yields tuples of python values in LOGICAL_FIELDS order'''
+
+        first_names, last_names = self.first_names[0], self.last_names[0]
+        cities, streets, suffixes = self.cities[0], self.streets[0], self.suffixes[0]
+        domains, account_types = self.domains[0], self.account_types[0]
+
+        lists = {name: column.tolist() for name, column in columns.items()}
+        for i in range(len(lists['accountNumber'])):
+            first = first_names[lists['firstName'][i]]
+            last = last_names[lists['lastName'][i]]
+            city, state, area_code = cities[lists['city'][i]][:3]
+
+            street = f'{lists["house"][i]} {streets[lists["street"][i]]} {suffixes[lists["suffix"][i]]}'
+            if lists['apartment'][i]:
+                street += f' Apt. {lists["floor"][i]}{"ABCDEFGHJKLM"[lists["unit"][i]]}'
+
+            email = f'{first.lower()}.{last.lower()}'
+            if lists['email_has_number'][i]:
+                email += str(lists['email_number'][i])
+            email += '@' + domains[lists['domain'][i]]
+
+            yield (
+                lists['accountNumber'][i], lists['cardNumber'][i], lists['pin'][i], lists['zipcode'][i],
+                last, first, account_types[lists['accountType'][i]], lists['balance'][i], email, street,
+                state, city, lists['ssn'][i], f'+1{area_code}{lists["phone"][i]}', first.lower(), last.lower()
+            )
+
+
+#Order of the values yielded by AccountGenerator._rows
+LOGICAL_FIELDS = (
+    'accountNumber', 'cardNumber', 'pin', 'zipcode', 'lastName', 'firstName', 'accountType', 'balance',
+    'email', 'streetAddress', 'state', 'city', 'ssn', 'phoneNumber', 'firstNameNormalized', 'lastNameNormalized'
+)
+
+
+def ndjson_lines(generator, count, schema=V1_SCHEMA, chunk_size=100000):
+    '''Yields one NDJSON block (many lines) per chunk, attributes in the schema's order'''
+
+    #Every string comes from the pools above (no quotes or escapes), one %-template per row is enough
+    positions = [LOGICAL_FIELDS.index(field) for field in schema]
+    template = '{' + ', '.join(
+        f'{json.dumps(schema[field])}: ' + ('%d' if field in NUMERIC_FIELDS else '"%s"') for field in schema
+    ) + '}\n'
+
+    for start in range(0, count, chunk_size):
+        size = min(chunk_size, count - start)
+        rows = generator._rows(generator.chunk(start, size))
+        yield ''.join([template % tuple([row[position] for position in positions]) for row in rows])
+
+
+def write_ndjson(path, count, schema='v1', seed=0, chunk_size=100000, progress=None):
+    '''Streams count accounts to path ('-' for stdout, .gz for gzip) and returns the row count'''
+
+    generator = AccountGenerator(seed)
+    if path == '-':
+        out = sys.stdout
+    elif path.endswith('.gz'):
+        out = gzip.open(path, 'wt')
+    else:
+        out = open(path, 'w')
+
+    written = 0
+    try:
+        for block in ndjson_lines(generator, count, SCHEMAS[schema], chunk_size):
+            out.write(block)
+            written = min(written + chunk_size, count)
+            if progress is not None:
+                progress.write(f'{written}/{count} accounts\n')
+                progress.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=1000000, help='number of accounts')
+    parser.add_argument('--schema', choices=sorted(SCHEMAS), default='v1', help='v1 = BankAccounts, v2 = BankAccountsNew')
+    parser.add_argument('--seed', type=int, default=0, help='same seed, same accounts')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='rows generated per NumPy chunk')
+    parser.add_argument('--output', default='-', help="NDJSON file ('-' for stdout, .gz to compress)")
+    args = parser.parse_args(argv)
+
+    if args.count > ACCOUNT_SPACE:
+        parser.error(f'at most {ACCOUNT_SPACE} unique 12-digit account numbers exist')
+
+    write_ndjson(args.output, args.count, args.schema, args.seed, args.chunk_size, progress=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+'''
+Collision-free account number allocation for new accounts.
+
+A new account is written with a single conditional put (attribute_not_exists on the key), so
+two callers can never take the same number and no read is needed to check that a number is
+free. A failed condition just moves on to the next number.
+
+Numbers come from blocks leased per warm container: one UpdateItem on a counter item hands
+out block_size sequence numbers that no other container will use, so opening an account costs
+one write in the common case (plus one counter update per block). Sequence numbers are spread
+over all 12-digit numbers with an affine permutation, so consecutive accounts do not get
+consecutive, guessable numbers. With block_size 0 numbers are drawn at random instead.
+
+    ACCOUNT_NUMBER_BLOCK_SIZE  - numbers leased per counter update (default 100, 0 = random)
+    ACCOUNT_COUNTER_TABLE      - table of the counters, one item per accounts table (default account-counters)
+
+The permutation can be inverted, so might_have_issued() tells a number some container may have
+handed out (its sequence number is below the counter, plus a margin for counter updates since
+it was read) from one nobody has, e.g. a mistyped one. Key filters built before an account was
+opened use it to recheck their misses (see accounts.AccountRepository).
+
+The counters live in a table of their own, so scans and exports of an accounts table only
+return accounts. Counters used to live in the accounts table under AccountNumber = 0:
+move_legacy_counter() moves such a counter over once, from the table bootstrap (python -m
+bank_common.tables), so sequence numbers keep counting from where they were and the handlers
+never look for it.
+'''
+
+import os
+import time
+import secrets
+import threading
+
+from bank_common import dynamo, metrics
+
+
+ACCOUNT_BASE = 10 ** 11
+ACCOUNT_SPACE = 9 * 10 ** 11 #every 12-digit number
+
+#Sequence -> number permutation, MULTIPLIER is coprime with ACCOUNT_SPACE (no factor 2, 3 or 5)
+MULTIPLIER = 387_420_489_127
+OFFSET = 271_828_182_845
+INVERSE = pow(MULTIPLIER, -1, ACCOUNT_SPACE)
+
+#Sequence numbers past the last counter read that may have been handed out meanwhile; a mistyped
+#number lands below counter + margin about once in ACCOUNT_SPACE / ISSUED_MARGIN (9000) tries
+ISSUED_MARGIN = 10 ** 8
+ISSUED_REFRESH_SECONDS = 3600
+
+DEFAULT_COUNTER_TABLE = 'account-counters'
+#Key of the counter table, its value is the name of the accounts table
+COUNTER_KEY_NAME = 'counter'
+COUNTER_ATTRIBUTE = 'NextSequence'
+#Where the counter used to be, never a valid 12-digit account number
+LEGACY_COUNTER_KEY = 0
+DEFAULT_BLOCK_SIZE = 100
+
+
+def number_for(sequence):
+    '''The account number of a sequence number, distinct for every sequence < ACCOUNT_SPACE'''
+
+    return ACCOUNT_BASE + (MULTIPLIER * sequence + OFFSET) % ACCOUNT_SPACE
+
+
+def sequence_of(number):
+    '''The sequence number of an account number, inverse of number_for'''
+
+    return ((number - ACCOUNT_BASE - OFFSET) * INVERSE) % ACCOUNT_SPACE
+
+
+class AllocationError(Exception):
+    '''No free number was found within max_attempts conditional puts'''
+
+
+class AccountNumberAllocator:
+    '''Creates account items under fresh numbers; one instance per container, thread-safe'''
+
+    def __init__(self, table, key_name='AccountNumber', counter_table=None, block_size=None, max_attempts=5,
+                 clock=time.monotonic):
+        self.table = table
+        self.key_name = key_name
+        if counter_table is None:
+            counter_table = dynamo.get_table(
+                os.environ.get('ACCOUNT_COUNTER_TABLE', DEFAULT_COUNTER_TABLE), region_name=table.region_name
+            )
+        self.counter_table = counter_table
+        self.counter_key = {COUNTER_KEY_NAME: table.name}
+        self.block_size = block_size if block_size is not None else \
+            int(os.environ.get('ACCOUNT_NUMBER_BLOCK_SIZE', DEFAULT_BLOCK_SIZE))
+        self.max_attempts = max_attempts
+        self.clock = clock
+
+        self._next = 0 #next sequence number of the leased block
+        self._end = 0 #end of the leased block (exclusive)
+        self._issued = None #(counter value, monotonic time it was read)
+        self._lock = threading.Lock()
+
+    def _lease(self):
+        '''Reserves the next block of sequence numbers with one counter update'''
+
+        response = self.counter_table.update_item(
+            Key=self.counter_key,
+            UpdateExpression='ADD #next :block',
+            ExpressionAttributeNames={'#next': COUNTER_ATTRIBUTE},
+            ExpressionAttributeValues={':block': self.block_size},
+            ReturnValues='UPDATED_NEW'
+        )
+        end = int(response['Attributes'][COUNTER_ATTRIBUTE])
+        metrics.count('AccountNumberBlocksLeased')
+        return end - self.block_size, end
+
+    def might_have_issued(self, number):
+        '''
+        False when number was certainly never handed out by any allocator of this table. Reads
+        the counter at most once per ISSUED_REFRESH_SECONDS.
+        '''
+
+        if not self.block_size:
+            #Random numbers, any of them may be new
+            return True
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return False
+        if not ACCOUNT_BASE <= number < ACCOUNT_BASE + ACCOUNT_SPACE:
+            return False
+
+        issued = self._issued
+        if issued is None or self.clock() - issued[1] >= ISSUED_REFRESH_SECONDS:
+            item = self.counter_table.get_item(
+                Key=self.counter_key, ProjectionExpression='#next', ExpressionAttributeNames={'#next': COUNTER_ATTRIBUTE}
+            ).get('Item', {})
+            issued = self._issued = (int(item.get(COUNTER_ATTRIBUTE, 0)), self.clock())
+        return sequence_of(number) < issued[0] + ISSUED_MARGIN
+
+    def next_number(self):
+        if not self.block_size:
+            return ACCOUNT_BASE + secrets.randbelow(ACCOUNT_SPACE)
+
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._lease()
+            sequence = self._next
+            self._next += 1
+
+        if sequence >= ACCOUNT_SPACE:
+            raise AllocationError('Every 12-digit account number has been handed out')
+        return number_for(sequence)
+
+    def create(self, item):
+        '''
+        Writes item under a new account number and returns the number. Numbers already taken
+        (e.g. accounts loaded before the allocator existed) are skipped.
+        '''
+
+        for _ in range(self.max_attempts):
+            number = self.next_number()
+            try:
+                self.table.put_item(
+                    Item=dict(item, **{self.key_name: number}),
+                    ConditionExpression='attribute_not_exists(#key)',
+                    ExpressionAttributeNames={'#key': self.key_name}
+                )
+            except dynamo.ClientError as err:
+                if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                metrics.count('AccountNumberCollisions')
+                continue
+            return number
+
+        raise AllocationError(f'No free account number after {self.max_attempts} attempts')
+
+
+def move_legacy_counter(table, counter_table=None, key_name='AccountNumber', dry_run=False):
+    '''
+    Moves the counter an earlier version kept in the accounts table (AccountNumber = 0) to the
+    counter table. Returns the moved NextSequence, None when there was nothing to move. Run
+    from the bootstrap before new containers lease blocks. The counter table keeps the higher
+    of both counters, and the update comes before the delete, so a rerun after a failure is safe.
+    '''
+
+    allocator = AccountNumberAllocator(table, key_name=key_name, counter_table=counter_table)
+    key = {key_name: LEGACY_COUNTER_KEY}
+    legacy = table.get_item(Key=key, ConsistentRead=True).get('Item')
+    if legacy is None:
+        return None
+
+    next_sequence = int(legacy.get(COUNTER_ATTRIBUTE, 0))
+    if dry_run:
+        return next_sequence
+
+    try:
+        allocator.counter_table.update_item(
+            Key=allocator.counter_key,
+            UpdateExpression='SET #next = :next',
+            ConditionExpression='attribute_not_exists(#next) OR #next < :next',
+            ExpressionAttributeNames={'#next': COUNTER_ATTRIBUTE},
+            ExpressionAttributeValues={':next': next_sequence}
+        )
+    except dynamo.ClientError as err:
+        #The counter table is already ahead (moved by an earlier run)
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    table.delete_item(Key=key)
+    return next_sequence
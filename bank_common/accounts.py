@@ -0,0 +1,273 @@
+'''
+Account data access shared by every bank handler.
+
+AccountRepository is the one place that reads and writes account items. Handlers ask for
+logical fields (balance, pin, email, ...) and get an Account back whichever table they use: the
+V1 table (BankAccounts) and the V2 table (BankAccountsNew) store the same fields under
+different attribute names ('AccountBalance' / 'Account Balance'), V1 and V2 map between them.
+
+Reads fetch only the fields asked for, through dynamo.projection, so names with spaces need
+no special handling at the call site. Consistency is chosen per read: reads that include the
+balance are strongly consistent, all others are eventually consistent at half the read units.
+Numbers come back as int, except the money fields (MONEY_FIELDS), which stay Decimal.
+
+get_many reads several accounts with BatchGetItem. With an AccountCache, fresh cached fields
+are served without a read; with a bloom.KeyFilter, unknown account numbers are rejected
+without one. A filter only knows the accounts of its last build, so its misses are still read
+when the number may have been handed out by the account number allocator since (see
+account_numbers.AccountNumberAllocator.might_have_issued); mistyped numbers are not.
+'''
+
+from bank_common import card_replacement, dynamo
+from bank_common.account_numbers import AccountNumberAllocator
+from bank_common.cache import MISSING
+
+
+#GSI on the phone number attribute, see bank_common.tables and bank_common.caller_id
+PHONE_INDEX = 'PhoneNumberIndex'
+
+#Fields whose reads are strongly consistent unless the call site says otherwise
+CONSISTENT_FIELDS = frozenset({'balance'})
+
+#Fields read as Decimal, every other number is an int
+MONEY_FIELDS = frozenset({'balance'})
+
+
+class AccountSchema:
+    '''Logical field -> attribute name of one table'''
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.fields = {attribute: field for field, attribute in attributes.items()}
+
+    def attribute(self, field):
+        return self.attributes[field]
+
+    def field(self, attribute):
+        '''The logical field stored in attribute, None for attributes outside the schema'''
+
+        return self.fields.get(attribute)
+
+    def to_account(self, item):
+        return Account(**{self.fields[attribute]: value for attribute, value in item.items() if attribute in self.fields})
+
+    def to_item(self, fields):
+        '''Item of an account, with the normalized names card replacement checks (see card_replacement)'''
+
+        fields = dict(fields)
+        for field in ('firstName', 'lastName'):
+            if fields.get(field) is not None:
+                fields[field + 'Normalized'] = card_replacement.normalize_name(fields[field])
+        return {self.attributes[field]: value for field, value in fields.items() if value is not None}
+
+
+V1 = AccountSchema('v1', {
+    'accountNumber': 'AccountNumber',
+    'cardNumber': 'CheckingAccountNumber',
+    'pin': 'Pin',
+    'zipcode': 'Zipcode',
+    'lastName': 'LastName',
+    'firstName': 'FirstName',
+    'accountType': 'AccountType',
+    'balance': 'AccountBalance',
+    'email': 'Email Address',
+    'streetAddress': 'StreetAddress',
+    'state': 'State',
+    'city': 'City',
+    'ssn': 'SSN',
+    'phoneNumber': 'PhoneNumber',
+    'firstNameNormalized': 'FirstNameNormalized',
+    'lastNameNormalized': 'LastNameNormalized',
+})
+
+V2 = AccountSchema('v2', {
+    'accountNumber': 'AccountNumber',
+    'accountType': 'Account Type',
+    'pin': 'Pin',
+    'cardNumber': 'Checking Account Number',
+    'lastName': 'Last Name',
+    'firstName': 'First Name',
+    'balance': 'Account Balance',
+    'streetAddress': 'Street Address',
+    'state': 'State',
+    'city': 'City',
+    'zipcode': 'Zipcode',
+    'email': 'Email Address',
+    'ssn': 'SSN',
+    'phoneNumber': 'Phone Number',
+    'firstNameNormalized': 'First Name Normalized',
+    'lastNameNormalized': 'Last Name Normalized',
+})
+
+FIELDS = tuple(V1.attributes)
+
+
+class Account:
+    '''One account in logical field names; fields that were not read are None'''
+
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for field in FIELDS:
+            setattr(self, field, fields.get(field))
+
+    def get(self, field, default=None):
+        value = getattr(self, field)
+        return default if value is None else value
+
+    def as_dict(self):
+        '''The fields that were read'''
+
+        return {field: getattr(self, field) for field in FIELDS if getattr(self, field) is not None}
+
+
+class AccountRepository:
+    '''Reads and writes the accounts of one table; one instance per container'''
+
+    def __init__(self, table_name, schema, region_name=None, cache=None, key_filter=None):
+        self.table = dynamo.get_table(
+            table_name, region_name=region_name,
+            decimal_attributes=[schema.attribute(field) for field in MONEY_FIELDS]
+        )
+        self.schema = schema
+        self.cache = cache
+        self.key_filter = key_filter
+        self._allocator = None
+
+    @property
+    def allocator(self):
+        if self._allocator is None:
+            self._allocator = AccountNumberAllocator(self.table, key_name=self.schema.attribute('accountNumber'))
+        return self._allocator
+
+    def _key(self, accountNumber):
+        return {self.schema.attribute('accountNumber'): int(accountNumber)}
+
+    def _attributes(self, fields):
+        '''Attribute names to read, the key always included so an existing account is never empty'''
+
+        fields = ('accountNumber',) + tuple(fields or FIELDS)
+        return [self.schema.attribute(field) for field in dict.fromkeys(fields)]
+
+    def _read_options(self, fields, consistent):
+        if consistent is None:
+            consistent = not CONSISTENT_FIELDS.isdisjoint(fields or FIELDS)
+        options = {'ConsistentRead': consistent}
+        if fields:
+            options.update(dynamo.projection(self._attributes(fields)))
+        return options
+
+    def _unknown(self, accountNumber):
+        '''True when there is certainly no such account, so no read is needed'''
+
+        return self.key_filter is not None and \
+            not self.key_filter.might_contain(accountNumber, recheck=self.allocator.might_have_issued)
+
+    def _cached(self, accountNumber, attributes):
+        if self.cache is None:
+            return None
+        item = {}
+        for attribute in attributes:
+            value = self.cache.get(accountNumber, attribute)
+            if value is MISSING:
+                return None
+            item[attribute] = value
+        return self.schema.to_account(item)
+
+    def get(self, accountNumber, fields=None, consistent=None):
+        '''
+        The account with the given fields read (all of them when fields is None), None when
+        there is no such account. consistent overrides the per-field consistency policy.
+        '''
+
+        account = self._cached(accountNumber, self._attributes(fields))
+        if account is not None:
+            return account
+
+        #Definitely unknown (e.g. mistyped), no read needed
+        if self._unknown(accountNumber):
+            return None
+
+        item = self.table.get_item(Key=self._key(accountNumber), **self._read_options(fields, consistent)).get('Item')
+        if item is None:
+            if self.key_filter is not None:
+                self.key_filter.false_positive()
+            return None
+
+        if self.cache is not None:
+            self.cache.put(accountNumber, item)
+        return self.schema.to_account(item)
+
+    def exists(self, accountNumber):
+        if self.cache is not None and self.cache.contains(accountNumber):
+            return True
+        return self.get(accountNumber, ('accountNumber',)) is not None
+
+    def get_many(self, accountNumbers, fields=None, consistent=None):
+        '''Accounts (or None) in the order of accountNumbers, read with as few BatchGetItem calls as possible'''
+
+        attributes = self._attributes(fields)
+        accounts = [self._cached(accountNumber, attributes) for accountNumber in accountNumbers]
+
+        missing = [
+            i for i, (accountNumber, account) in enumerate(zip(accountNumbers, accounts))
+            if account is None and not self._unknown(accountNumber)
+        ]
+        if not missing:
+            return accounts
+
+        items = self.table.batch_get([self._key(accountNumbers[i]) for i in missing], **self._read_options(fields, consistent))
+        for i, item in zip(missing, items):
+            if item is None:
+                continue
+            if self.cache is not None:
+                self.cache.put(accountNumbers[i], item)
+            accounts[i] = self.schema.to_account(item)
+
+        return accounts
+
+    def find_by_phone(self, phoneNumber, limit=2):
+        '''Account numbers registered to an E.164 phone number, from the PhoneNumberIndex GSI'''
+
+        response = self.table.query(
+            IndexName=PHONE_INDEX,
+            KeyConditionExpression='#phone = :phone',
+            ExpressionAttributeNames={'#phone': self.schema.attribute('phoneNumber'), '#key': self.schema.attribute('accountNumber')},
+            ExpressionAttributeValues={':phone': phoneNumber},
+            ProjectionExpression='#key',
+            Limit=limit
+        )
+        return [item[self.schema.attribute('accountNumber')] for item in response.get('Items', [])]
+
+    def create(self, fields):
+        '''Writes a new account under a freshly allocated number and returns the number'''
+
+        accountNumber = self.allocator.create(self.schema.to_item(fields))
+        if self.key_filter is not None:
+            self.key_filter.add(accountNumber)
+        return accountNumber
+
+    def put(self, fields):
+        '''Writes a whole account (fields must include accountNumber)'''
+
+        #Drop any cached copy before the account changes
+        if self.cache is not None:
+            self.cache.invalidate(fields['accountNumber'])
+        if self.key_filter is not None:
+            self.key_filter.add(fields['accountNumber'])
+
+        self.table.put_item(Item=self.schema.to_item(fields))
+
+    def replace_card(self, accountNumber, pin, firstName, lastName):
+        '''
+        Verifies pin and name and rotates the debit card number in one conditional update
+        (see bank_common.card_replacement). result.account holds the updated account.
+        '''
+
+        result = card_replacement.replace_card(self.table, self.schema.attributes, accountNumber, pin, firstName, lastName)
+        if self.cache is not None:
+            self.cache.invalidate(accountNumber)
+        if result.replaced:
+            result.account = self.schema.to_account(result.item)
+        return result
@@ -0,0 +1,373 @@
+'''
+Bloom filters of known table keys, so lookups of keys that certainly do not exist skip DynamoDB.
+
+A filter is built offline from the table (parallel scan of the key attribute only) or from an
+export file, saved next to the deployment (or in S3) and loaded at cold start. A definite miss
+means the key was not in the table when the filter was built; a hit only means "maybe", the
+caller still reads DynamoDB. Keys written after the build are only known to the container that
+wrote them (KeyFilter.add), so callers whose keys can be created elsewhere pass a recheck that
+turns a miss on a possibly newer key back into "maybe" (see accounts.AccountRepository).
+
+Configured from the environment:
+
+    BLOOM_FILTER_DIR              - directory or s3://bucket/prefix holding <name>.bloom files
+                                    (default: filters/ at the repository root); no file, no filter
+    BLOOM_FILTER_REFRESH_SECONDS  - warm containers reload a filter this often (default 3600)
+
+Building, e.g. from a scheduled job:
+
+    python -m bank_common.bloom build data_dip_table phone-number --fp-rate 0.001 \
+        --output filters/data_dip_table.bloom
+    python -m bank_common.bloom build BankAccountsNew AccountNumber --input export.ndjson.gz \
+        --output s3://bank-filters/BankAccountsNew.bloom
+'''
+
+import io
+import os
+import sys
+import gzip
+import json
+import math
+import time
+import struct
+import hashlib
+import logging
+import argparse
+import threading
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+from bank_common import dynamo, metrics
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'filters')
+DEFAULT_REFRESH_SECONDS = 3600
+DEFAULT_FP_RATE = 0.01
+
+#magic, version, bits, hashes, keys added, build time
+_HEADER = struct.Struct('<4sBQBQd')
+_MAGIC = b'BLM1'
+
+
+def normalize_key(value):
+    '''One text form per key: Decimal('189714330257'), 189714330257 and '189714330257' match'''
+
+    if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+        return str(int(value)) if value == int(value) else str(value)
+    return str(value)
+
+
+class BloomFilter:
+    '''Bit array with k probes per key (double hashing over one BLAKE2b digest)'''
+
+    def __init__(self, num_bits, num_hashes, bits=None, count=0, created=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.count = count
+        self.created = created if created is not None else time.time()
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate=DEFAULT_FP_RATE):
+        '''Smallest filter holding capacity keys at the target false-positive rate'''
+
+        capacity = max(int(capacity), 1)
+        num_bits = max(int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)), 8)
+        num_hashes = max(int(round(num_bits / capacity * math.log(2))), 1)
+        return cls(num_bits, num_hashes)
+
+    def _probes(self, key):
+        digest = hashlib.blake2b(normalize_key(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for probe in self._probes(key):
+            bits[probe >> 3] |= 1 << (probe & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[probe >> 3] & (1 << (probe & 7)) for probe in self._probes(key))
+
+    def __len__(self):
+        return self.count
+
+    def false_positive_rate(self):
+        '''Expected rate for the keys added so far'''
+
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def to_bytes(self):
+        return _HEADER.pack(_MAGIC, 1, self.num_bits, self.num_hashes, self.count, self.created) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, num_bits, num_hashes, count, created = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != 1:
+            raise ValueError('Not a bloom filter file')
+        bits = bytearray(data[_HEADER.size:])
+        if len(bits) != (num_bits + 7) // 8:
+            raise ValueError('Truncated bloom filter file')
+        return cls(num_bits, num_hashes, bits, count, created)
+
+
+""" --- Storage --- """
+
+
+def _s3_location(uri):
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def _s3_client():
+    import botocore.session
+    return botocore.session.get_session().create_client('s3')
+
+
+def save(bloom, location):
+    '''Writes a filter to a local path or an s3:// URI (local files are replaced atomically)'''
+
+    data = bloom.to_bytes()
+    if location.startswith('s3://'):
+        bucket, key = _s3_location(location)
+        _s3_client().put_object(Bucket=bucket, Key=key, Body=data)
+        return
+
+    directory = os.path.dirname(location)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = location + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, location)
+
+
+def load(location):
+    '''Reads a filter from a local path or an s3:// URI, None when there is none'''
+
+    if location.startswith('s3://'):
+        bucket, key = _s3_location(location)
+        client = _s3_client()
+        try:
+            data = client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except client.exceptions.NoSuchKey:
+            return None
+        return BloomFilter.from_bytes(data)
+
+    if not os.path.exists(location):
+        return None
+    with open(location, 'rb') as f:
+        return BloomFilter.from_bytes(f.read())
+
+
+""" --- Handler side --- """
+
+
+class KeyFilter:
+    '''
+    The filter of one table as the handlers use it: loaded on first use, reloaded by the first
+    lookup after refresh_seconds, and counting the DynamoDB reads it saves. Without a filter
+    file every key "might" exist, so handlers behave exactly as before.
+    '''
+
+    def __init__(self, name, location=None, refresh_seconds=None, clock=time.monotonic):
+        self.name = name
+        directory = os.environ.get('BLOOM_FILTER_DIR', DEFAULT_DIR)
+        self.location = location or f'{directory.rstrip("/")}/{name}.bloom'
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else \
+            float(os.environ.get('BLOOM_FILTER_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS))
+        self.clock = clock
+
+        self._bloom = None
+        self._added = {} #normalized key -> time this container wrote it
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            bloom = load(self.location)
+        except Exception:
+            logger.warning('Could not load bloom filter %s', self.location, exc_info=True)
+            bloom = None
+        with self._lock:
+            if bloom is not None or self._bloom is None:
+                self._bloom = bloom
+                #Keys written after the new filter was built are still only known here
+                created = bloom.created if bloom is not None else 0
+                self._added = {key: written for key, written in self._added.items() if written >= created}
+            self._loaded_at = self.clock()
+
+    def _current(self):
+        #Loaded inline: Lambda freezes the container between invocations, a background load would stall
+        if self._loaded_at is None or self.clock() - self._loaded_at >= self.refresh_seconds:
+            self._load()
+        return self._bloom
+
+    @property
+    def active(self):
+        return self._current() is not None
+
+    def might_contain(self, key, recheck=None):
+        '''
+        False only when key is certainly not in the table; counts the read it saves. recheck(key)
+        returning True marks a miss as possibly written after the filter was built.
+        '''
+
+        bloom = self._current()
+        if bloom is None or key in bloom or normalize_key(key) in self._added:
+            return True
+        if recheck is not None and recheck(key):
+            metrics.count('BloomFilterRechecks')
+            return True
+        metrics.count('BloomFilterSkippedReads')
+        return False
+
+    def add(self, key):
+        '''Records a key this container just wrote, the next rebuild picks it up for everyone'''
+
+        with self._lock:
+            self._added[normalize_key(key)] = time.time()
+
+    def false_positive(self):
+        '''Called when a "maybe" turned out to be missing, to track the real false-positive rate'''
+
+        if self._bloom is not None:
+            metrics.count('BloomFilterFalsePositives')
+
+
+""" --- Building --- """
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), newline='')
+    return open(path, newline='')
+
+
+def keys_from_file(path, key_name):
+    '''
+    Key values from an NDJSON, JSON array or CSV file of items. Lines of a DynamoDB S3 export
+    ({"Item": {"name": {"S": ...}}}) are deserialized.
+    '''
+
+    from bank_common import bulk_load
+
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.csv':
+        reader = bulk_load.read_csv
+    elif extension == '.json':
+        with _open(path) as f:
+            reader = bulk_load.read_json_array if f.read(64).lstrip().startswith('[') else bulk_load.read_ndjson
+    else:
+        reader = bulk_load.read_ndjson
+
+    with _open(path) as f:
+        for item in reader(f):
+            if set(item) == {'Item'} and isinstance(item['Item'], dict):
+                item = dynamo.deserialize_item(item['Item'])
+            if item.get(key_name) is not None:
+                yield item[key_name]
+
+
+def keys_from_table(table_name, key_name, region_name=None, segments=4):
+    '''Key values of every item, read with a parallel scan that projects the key only'''
+
+    client = dynamo.get_client(region_name)
+
+    def scan(segment):
+        keys, start_key = [], None
+        while True:
+            request = {
+                'TableName': table_name, 'ProjectionExpression': '#k', 'ExpressionAttributeNames': {'#k': key_name},
+                'Segment': segment, 'TotalSegments': segments
+            }
+            if start_key:
+                request['ExclusiveStartKey'] = start_key
+            response = client.scan(**request)
+            keys += [dynamo.deserialize(item[key_name]) for item in response.get('Items', []) if key_name in item]
+            start_key = response.get('LastEvaluatedKey')
+            if not start_key:
+                return keys
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        for keys in pool.map(scan, range(segments)):
+            yield from keys
+
+
+def build(keys, capacity, fp_rate=DEFAULT_FP_RATE):
+    bloom = BloomFilter.for_capacity(capacity, fp_rate)
+    for key in keys:
+        bloom.add(key)
+    return bloom
+
+
+def build_from_table(table_name, key_name, fp_rate=DEFAULT_FP_RATE, capacity=None, region_name=None, segments=4, headroom=1.25):
+    '''
+    Filter of a table's keys. Sized from the table's ItemCount (refreshed by DynamoDB about every
+    six hours) plus headroom unless capacity is given.
+    '''
+
+    if capacity is None:
+        item_count = dynamo.get_client(region_name).describe_table(TableName=table_name)['Table']['ItemCount']
+        capacity = item_count * headroom
+    return build(keys_from_table(table_name, key_name, region_name, segments), capacity, fp_rate)
+
+
+def build_from_file(path, key_name, fp_rate=DEFAULT_FP_RATE, capacity=None):
+    '''Filter of the keys in an export file, sized exactly with a first counting pass'''
+
+    if capacity is None:
+        capacity = sum(1 for _ in keys_from_file(path, key_name))
+    return build(keys_from_file(path, key_name), capacity, fp_rate)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    builder = commands.add_parser('build', help='build a filter from a table or an export file')
+    builder.add_argument('table', help='DynamoDB table name')
+    builder.add_argument('key', help='key attribute to index')
+    builder.add_argument('--output', required=True, help='filter file path or s3:// URI')
+    builder.add_argument('--input', help='export file (NDJSON, JSON array, CSV, optionally .gz) instead of a scan')
+    builder.add_argument('--fp-rate', type=float, default=DEFAULT_FP_RATE, help='target false-positive rate')
+    builder.add_argument('--capacity', type=int, help='keys to size for (default: counted or the table ItemCount)')
+    builder.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    builder.add_argument('--region', help='AWS region (default: AWS_REGION)')
+
+    info = commands.add_parser('info', help='print the size and fill of a filter')
+    info.add_argument('location', help='filter file path or s3:// URI')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        bloom = load(args.location)
+        if bloom is None:
+            sys.exit(f'No filter at {args.location}')
+    else:
+        start = time.monotonic()
+        if args.input:
+            bloom = build_from_file(args.input, args.key, args.fp_rate, args.capacity)
+        else:
+            bloom = build_from_table(args.table, args.key, args.fp_rate, args.capacity, args.region, args.segments)
+        save(bloom, args.output)
+        print(f'built in {time.monotonic() - start:.1f} s', file=sys.stderr)
+
+    print(json.dumps({
+        'keys': bloom.count,
+        'bits': bloom.num_bits,
+        'hashes': bloom.num_hashes,
+        'bytes': len(bloom.bits),
+        'expected_fp_rate': round(bloom.false_positive_rate(), 6),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(bloom.created)),
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+'''
+Parallel, resumable bulk loader for DynamoDB tables.
+
+Records are streamed from NDJSON, JSON (a top level array) or CSV files without reading the
+whole file, grouped into 25-item BatchWriteItem requests and written by a pool of threads.
+UnprocessedItems and throttled batches are retried with capped exponential backoff and jitter.
+
+Progress is checkpointed as a watermark: the number of leading records whose batches have all
+been written. An interrupted load restarted with the same checkpoint file skips those records
+and resumes; batches that were in flight are written again, which is safe because puts are
+idempotent.
+
+    python -m bank_common.bulk_load Bank_Contact_Flow/finalbankdata.json BankAccounts \
+        --key AccountNumber --workers 8 --checkpoint load.ckpt
+'''
+
+import os
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+from bank_common import dynamo
+
+
+BATCH_SIZE = 25
+
+_INTEGER = frozenset('0123456789')
+
+
+""" --- Readers --- """
+
+
+def _csv_value(text):
+    '''CSV cells are strings: numbers without leading zeros become Decimal, empty cells are dropped'''
+
+    if text == '':
+        return None
+    digits = text[1:] if text[:1] == '-' else text
+    if digits and set(digits) <= _INTEGER and (digits == '0' or digits[0] != '0'):
+        return Decimal(text)
+    return text
+
+
+def read_ndjson(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line, parse_float=Decimal)
+
+
+def read_json_array(f, chunk_size=1 << 16):
+    '''Yields the elements of a top level JSON array, reading the file in chunks'''
+
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('JSON input must be an array of items (use NDJSON for one item per line)')
+    buffer = buffer[1:]
+
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            item, end = None, len(buffer)
+        #An element ending exactly at the end of the buffer may be cut short, read on to be sure
+        if end == len(buffer):
+            chunk = f.read(chunk_size)
+            if chunk:
+                buffer += chunk
+                continue
+            if item is None:
+                raise ValueError('Truncated or invalid JSON input')
+        yield item
+        buffer = buffer[end:]
+        if len(buffer) < chunk_size:
+            buffer += f.read(chunk_size)
+
+
+def read_csv(f):
+    for row in csv.DictReader(f):
+        yield {name: value for name, value in ((k, _csv_value(v)) for k, v in row.items()) if value is not None}
+
+
+READERS = {'ndjson': read_ndjson, 'json': read_json_array, 'csv': read_csv}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    if extension == '.csv':
+        return 'csv'
+    if extension == '.json':
+        #finalbankdata.json is an array, generated files are one item per line
+        with open(path) as f:
+            return 'json' if f.read(64).lstrip().startswith('[') else 'ndjson'
+    raise ValueError(f'Cannot tell the format of {path}, pass --format')
+
+
+""" --- Checkpoint --- """
+
+
+class Checkpoint:
+    '''Records-written watermark for one input file, rewritten atomically'''
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('source') != self.source:
+            raise ValueError(f'Checkpoint {self.path} belongs to {state.get("source")}, not {self.source}')
+        return state['committed']
+
+    def save(self, committed, done=False):
+        if not self.path:
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'source': self.source, 'committed': committed, 'done': done, 'updated': time.time()}, f)
+        os.replace(temporary, self.path)
+
+
+""" --- Loader --- """
+
+
+class LoadStats:
+
+    def __init__(self):
+        self.items = 0
+        self.batches = 0
+        self.retries = 0
+        self.unprocessed = 0
+        self.consumed_wcu = 0.0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'items': self.items,
+            'batches': self.batches,
+            'retries': self.retries,
+            'unprocessed': self.unprocessed,
+            'consumed_wcu': self.consumed_wcu,
+            'elapsed_s': round(elapsed, 3),
+            'items_per_s': round(self.items / elapsed, 1) if elapsed else 0.0,
+            'wcu_per_s': round(self.consumed_wcu / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+class BulkLoader:
+    '''
+    Writes items to one table with `workers` concurrent BatchWriteItem streams. key_names are
+    the table's key attributes, used to keep duplicate keys out of a single batch (DynamoDB
+    rejects such a batch).
+    '''
+
+    def __init__(self, table_name, key_names=('AccountNumber',), region_name=None, workers=8,
+                 max_retries=10, base_backoff=0.05, max_backoff=5.0, progress_interval=2.0, out=sys.stderr):
+        self.table_name = table_name
+        self.key_names = tuple(key_names)
+        self.region_name = region_name
+        self.workers = workers
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.progress_interval = progress_interval
+        self.checkpoint_interval = 1.0
+        self.out = out
+        self.stats = LoadStats()
+
+        self._done = set() #sequence numbers of written batches
+        self._ends = {} #sequence number -> records consumed up to the end of that batch
+        self._next_commit = 0
+        self._committed = 0
+        self._saved = 0.0
+        self._state_lock = threading.Lock()
+
+    @property
+    def client(self):
+        return dynamo.get_client(self.region_name)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.base_backoff * 2 ** attempt, self.max_backoff))
+
+    def write_batch(self, requests):
+        '''Writes one batch until DynamoDB has accepted every request'''
+
+        attempt = 0
+        while requests:
+            try:
+                response = self.client.batch_write_item(
+                    RequestItems={self.table_name: requests}, ReturnConsumedCapacity='TOTAL'
+                )
+            except dynamo.ClientError as err:
+                if err.response['Error']['Code'] not in ('ProvisionedThroughputExceededException', 'ThrottlingException'):
+                    raise
+                response = {'UnprocessedItems': {self.table_name: requests}}
+
+            consumed = sum(entry.get('CapacityUnits', 0) for entry in response.get('ConsumedCapacity', []) or [])
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            with self.stats.lock:
+                self.stats.consumed_wcu += consumed
+                self.stats.items += len(requests) - len(unprocessed)
+                if unprocessed:
+                    self.stats.retries += 1
+                    self.stats.unprocessed += len(unprocessed)
+
+            requests = unprocessed
+            if requests:
+                if attempt >= self.max_retries:
+                    raise RuntimeError(f'{len(requests)} items still unprocessed after {attempt} retries')
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+
+        with self.stats.lock:
+            self.stats.batches += 1
+
+    def _batches(self, records, skip):
+        '''Yields (sequence, records consumed so far, requests) with no duplicate key in a batch'''
+
+        sequence, consumed = 0, 0
+        requests, keys = [], set()
+        for item in records:
+            consumed += 1
+            if consumed <= skip:
+                continue
+            key = tuple(str(item.get(name)) for name in self.key_names)
+            if key in keys or len(requests) == BATCH_SIZE:
+                yield sequence, consumed - 1, requests
+                sequence += 1
+                requests, keys = [], set()
+            keys.add(key)
+            requests.append({'PutRequest': {'Item': dynamo.serialize_item(item)}})
+
+        if requests:
+            yield sequence, consumed, requests
+
+    def _complete(self, sequence, checkpoint):
+        with self._state_lock:
+            self._done.add(sequence)
+            while self._next_commit in self._done:
+                self._done.discard(self._next_commit)
+                self._committed = self._ends.pop(self._next_commit)
+                self._next_commit += 1
+
+            #Saved under the lock so writers never race on the file, at most once a second
+            now = time.monotonic()
+            if checkpoint is not None and now - self._saved >= self.checkpoint_interval:
+                checkpoint.save(self._committed)
+                self._saved = now
+
+    def _report(self, stop):
+        last_items, last_wcu, last_time = 0, 0.0, time.monotonic()
+        while not stop.wait(self.progress_interval):
+            now = time.monotonic()
+            with self.stats.lock:
+                items, wcu = self.stats.items, self.stats.consumed_wcu
+            interval = now - last_time
+            self.out.write(
+                f'{items} items  {(items - last_items) / interval:,.0f} items/s  '
+                f'{(wcu - last_wcu) / interval:,.1f} WCU/s  retries {self.stats.retries}\n'
+            )
+            self.out.flush()
+            last_items, last_wcu, last_time = items, wcu, now
+
+    def load(self, records, checkpoint=None):
+        '''Writes every record, resuming after the checkpoint's watermark; returns LoadStats'''
+
+        skip = checkpoint.load() if checkpoint is not None else 0
+        self._committed = skip
+
+        stop = threading.Event()
+        reporter = None
+        if self.progress_interval:
+            reporter = threading.Thread(target=self._report, args=(stop,), daemon=True)
+            reporter.start()
+
+        #At most two batches per worker are buffered, the input is never read ahead further
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        failures = []
+
+        def write(sequence, requests):
+            try:
+                self.write_batch(requests)
+                self._complete(sequence, checkpoint)
+            except Exception as exc:
+                failures.append(exc)
+            finally:
+                slots.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for sequence, consumed, requests in self._batches(records, skip):
+                    slots.acquire()
+                    if failures:
+                        slots.release()
+                        break
+                    with self._state_lock:
+                        self._ends[sequence] = consumed
+                    pool.submit(write, sequence, requests)
+        finally:
+            stop.set()
+            if reporter is not None:
+                reporter.join()
+
+        if failures:
+            raise failures[0]
+        if checkpoint is not None:
+            checkpoint.save(self._committed, done=True)
+
+        return self.stats
+
+
+def load_file(path, table_name, format=None, checkpoint_path=None, **options):
+    '''Streams path into table_name; options are passed to BulkLoader'''
+
+    reader = READERS[format or detect_format(path)]
+    checkpoint = Checkpoint(checkpoint_path, path) if checkpoint_path else None
+
+    with open(path, newline='') as f:
+        return BulkLoader(table_name, **options).load(reader(f), checkpoint)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='NDJSON, JSON array or CSV file of items')
+    parser.add_argument('table', help='DynamoDB table name')
+    parser.add_argument('--key', nargs='+', default=['AccountNumber'], help='key attribute names of the table')
+    parser.add_argument('--format', choices=sorted(READERS), help='input format (default: from the file)')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent BatchWriteItem streams')
+    parser.add_argument('--checkpoint', help='progress file; rerun with the same file to resume')
+    parser.add_argument('--region', help='AWS region (default: AWS_REGION)')
+    parser.add_argument('--max-retries', type=int, default=10, help='retries of a batch with unprocessed items')
+    parser.add_argument('--progress-interval', type=float, default=2.0, help='seconds between progress lines, 0 for none')
+    args = parser.parse_args(argv)
+
+    stats = load_file(
+        args.path, args.table, format=args.format, checkpoint_path=args.checkpoint,
+        key_names=args.key, region_name=args.region, workers=args.workers,
+        max_retries=args.max_retries, progress_interval=args.progress_interval
+    )
+    print(json.dumps(stats.as_dict()))
+
+
+if __name__ == '__main__':
+    main()
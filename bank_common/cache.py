@@ -0,0 +1,118 @@
+'''
+Read-through cache for account items that lives across warm Lambda invocations.
+
+Entries are kept per account and per attribute so that short lived fields (balances)
+can expire while static fields (names, addresses) keep serving repeat callers.
+'''
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+#Attribute name -> TTL class, covers both the V1 and V2 table schemas
+ATTRIBUTE_CLASSES = {
+    'AccountBalance': 'balance',
+    'Account Balance': 'balance',
+    'Pin': 'credential',
+    'CheckingAccountNumber': 'card',
+    'Checking Account Number': 'card',
+}
+
+#TTL in seconds per attribute class, 'static' applies to everything not listed above
+DEFAULT_TTLS = {
+    'balance': 5,
+    'credential': 60,
+    'card': 60,
+    'static': 900,
+}
+
+
+def _ttls_from_env():
+    '''Reads ACCOUNT_CACHE_TTL_<CLASS> overrides, e.g. ACCOUNT_CACHE_TTL_BALANCE=2'''
+
+    return {
+        ttl_class: float(os.environ.get(f'ACCOUNT_CACHE_TTL_{ttl_class.upper()}', ttl))
+        for ttl_class, ttl in DEFAULT_TTLS.items()
+    }
+
+
+class AccountCache:
+    '''Bounded LRU of account items with per-attribute-class expiry and hit/miss counters'''
+
+    def __init__(self, max_size=None, ttls=None, clock=time.monotonic):
+        self.max_size = max_size if max_size is not None else int(os.environ.get('ACCOUNT_CACHE_SIZE', 1024))
+        self.ttls = ttls if ttls is not None else _ttls_from_env()
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() #account key -> {attribute: (value, expires_at)}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(accountNumber):
+        return int(accountNumber)
+
+    def _ttl(self, attribute):
+        return self.ttls[ATTRIBUTE_CLASSES.get(attribute, 'static')]
+
+    def get(self, accountNumber, attribute):
+        '''Returns the cached attribute value or MISSING'''
+
+        key = self._key(accountNumber)
+        with self._lock:
+            entry = self._entries.get(key)
+            cached = entry.get(attribute) if entry is not None else None
+            if cached is None or cached[1] <= self.clock():
+                self.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+    def contains(self, accountNumber):
+        '''True if any attribute of the account is still fresh, i.e. the account is known to exist'''
+
+        key = self._key(accountNumber)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and any(expires_at > now for _, expires_at in entry.values()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            return False
+
+    def put(self, accountNumber, item):
+        '''Stores every attribute of a freshly read item'''
+
+        key = self._key(accountNumber)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.setdefault(key, {})
+            for attribute, value in item.items():
+                entry[attribute] = (value, now + self._ttl(attribute))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, accountNumber):
+        '''Drops the account, must be called whenever this code writes to it'''
+
+        with self._lock:
+            self._entries.pop(self._key(accountNumber), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
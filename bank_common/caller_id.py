@@ -0,0 +1,88 @@
+'''
+Caller-ID lookup: fills the account number slot from the caller's phone number.
+
+Amazon Connect passes the caller's number (ANI, $.CustomerEndpoint.Address) to the bot as a
+session attribute set in the contact flow's Get customer input block. When exactly one account
+in the PhoneNumberIndex GSI has that number, the account number slot is filled before Lex
+would elicit it, saving a dialog turn (and a Lambda invocation) per call. The pin is still
+asked for and checked, caller ID only identifies the account.
+
+The lookup runs at most once per conversation, its outcome is kept in sessionAttributes.
+'''
+
+import os
+
+from bank_common import dynamo, metrics
+
+
+#Session attribute the contact flow stores the caller's number in (CALLER_ID_ATTRIBUTE overrides)
+DEFAULT_SESSION_ATTRIBUTE = 'CustomerNumber'
+
+#Session attribute recording the lookup outcome: matched, none, ambiguous or unavailable
+LOOKUP_ATTRIBUTE = 'callerIdLookup'
+
+#Withheld or unknown caller IDs as Connect and carriers report them
+_WITHHELD = frozenset({'anonymous', 'restricted', 'unavailable', 'unknown', 'private'})
+
+
+def normalize(number):
+    '''E.164 form of a phone number, None when it is withheld or not a number'''
+
+    if not number:
+        return None
+    number = str(number).strip()
+    if number.lower() in _WITHHELD:
+        return None
+
+    digits = ''.join(c for c in number if c.isdigit())
+    if number.startswith('+'):
+        return '+' + digits if 8 <= len(digits) <= 15 else None
+    #National US numbers, with or without the leading 1
+    if len(digits) == 10:
+        return '+1' + digits
+    if len(digits) == 11 and digits[0] == '1':
+        return '+' + digits
+    return None
+
+
+def caller_number(request):
+    '''The caller's number from the session attributes, normalized, or None'''
+
+    attribute = os.environ.get('CALLER_ID_ATTRIBUTE', DEFAULT_SESSION_ATTRIBUTE)
+    return normalize(request.session_attributes.get(attribute))
+
+
+def prefill_account(request, accounts, slot_name):
+    '''
+    Fills slot_name with the caller's account number when the slot is empty and exactly one
+    account of the accounts.AccountRepository matches the caller's number. Returns the account
+    number filled in, else None.
+    '''
+
+    if request.slot(slot_name) or LOOKUP_ATTRIBUTE in request.session_attributes:
+        return None
+
+    number = caller_number(request)
+    if number is None:
+        request.session_attributes[LOOKUP_ATTRIBUTE] = 'unavailable'
+        return None
+
+    try:
+        #At most two: only whether there is exactly one matters
+        matches = accounts.find_by_phone(number, limit=2)
+    except dynamo.ClientError:
+        #Best effort: the caller is simply asked for the account number
+        metrics.count('CallerIdErrors')
+        return None
+
+    metrics.count('CallerIdLookups')
+    if len(matches) != 1:
+        request.session_attributes[LOOKUP_ATTRIBUTE] = 'none' if not matches else 'ambiguous'
+        return None
+
+    accountNumber = str(matches[0])
+    request.set_slot(slot_name, accountNumber)
+    request.session_attributes[LOOKUP_ATTRIBUTE] = 'matched'
+    metrics.count('CallerIdMatches')
+
+    return accountNumber
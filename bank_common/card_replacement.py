@@ -0,0 +1,135 @@
+'''
+Debit card replacement shared by the Lex V1 and V2 bank bots.
+
+The identity check (pin, first and last name) and the card number rotation happen in a
+single conditional update_item, so there is no window between checking and updating and
+the fulfillment costs one DynamoDB call (two the first time for an account stored before
+normalized names were).
+'''
+
+import random
+
+from bank_common import dynamo
+
+
+class ReplacementResult:
+    '''
+    Outcome of replace_card: either the updated item or the first field that did not match.
+    account is the item as an accounts.Account when the replacement went through a repository.
+    '''
+
+    __slots__ = ('replaced', 'failed_field', 'item', 'account')
+
+    def __init__(self, replaced, failed_field=None, item=None):
+        self.replaced = replaced
+        self.failed_field = failed_field
+        self.item = item if item is not None else {}
+        self.account = None
+
+
+def normalize_name(name):
+    '''The form names are stored and compared in, DynamoDB conditions are case sensitive'''
+
+    return str(name).strip().lower()
+
+
+def new_card_number():
+    return random.randint(1000000000000000, 9999999999999999)
+
+
+def _first_mismatch(schema, item, pin, firstName, lastName):
+    '''
+    Works out which identity field made the condition fail. None when no field can be
+    named: the account does not exist, or every field matches (see replace_card).
+    '''
+
+    if not item:
+        return None
+    if item.get(schema['pin']) != int(pin):
+        return 'pin'
+    if normalize_name(item.get(schema['firstName'], '')) != normalize_name(firstName):
+        return 'firstName'
+    if normalize_name(item.get(schema['lastName'], '')) != normalize_name(lastName):
+        return 'lastName'
+
+    return None
+
+
+def _update(table, schema, accountNumber, pin, firstName, lastName, exact=False):
+    '''
+    Rotates the card when the pin and names match, and stores the normalized names the next
+    check compares against. Names are compared normalized, or as stored when exact.
+    '''
+
+    attribute_names = {
+        '#pin': schema['pin'],
+        '#card': schema['cardNumber'],
+        '#firstKey': schema['firstNameNormalized'],
+        '#lastKey': schema['lastNameNormalized'],
+    }
+    attribute_values = {
+        ':pin': int(pin),
+        ':card': new_card_number(),
+        ':firstKey': normalize_name(firstName),
+        ':lastKey': normalize_name(lastName),
+    }
+
+    if exact:
+        attribute_names.update({'#first': schema['firstName'], '#last': schema['lastName']})
+        attribute_values.update({':first': firstName, ':last': lastName})
+        names = '#first = :first AND #last = :last'
+    else:
+        names = '#firstKey = :firstKey AND #lastKey = :lastKey'
+
+    return table.update_item(
+        Key={'AccountNumber': int(accountNumber)},
+        UpdateExpression='SET #card = :card, #firstKey = :firstKey, #lastKey = :lastKey',
+        ConditionExpression=f'attribute_exists(AccountNumber) AND #pin = :pin AND {names}',
+        ExpressionAttributeNames=attribute_names,
+        ExpressionAttributeValues=attribute_values,
+        ReturnValues='ALL_NEW',
+        ReturnValuesOnConditionCheckFailure='ALL_OLD'
+    )
+
+
+def replace_card(table, schema, accountNumber, pin, firstName, lastName):
+    '''
+    Verifies pin and name and rotates the debit card number in one conditional update.
+    schema maps logical fields to the table's attribute names (accounts.V1 / V2 attributes).
+    Returns a ReplacementResult; item holds ALL_NEW attributes when replaced, failed_field is
+    None when the details do not match but no single field can be named.
+
+    A missing or non-numeric pin fails on 'pin' without a call, pins are stored as numbers.
+
+    Names are compared case-insensitively through the normalized name attributes. Accounts
+    written before those existed fail that condition; when their stored names match the
+    spoken ones case-insensitively the card is rotated by a second update conditioned on the
+    exact stored names, which also stores the normalized names.
+    '''
+
+    if not str(pin).strip().isdecimal():
+        return ReplacementResult(False, 'pin')
+
+    try:
+        response = _update(table, schema, accountNumber, pin, firstName, lastName)
+    except dynamo.ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise err
+
+        old_item = table.deserialize_item(err.response.get('Item', {}))
+        failed_field = _first_mismatch(schema, old_item, pin, firstName, lastName)
+        if failed_field is not None or not old_item:
+            return ReplacementResult(False, failed_field)
+
+        #Every field matches case-insensitively: an account without normalized names yet
+        try:
+            response = _update(
+                table, schema, accountNumber, pin, old_item[schema['firstName']], old_item[schema['lastName']], exact=True
+            )
+        except dynamo.ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise err
+            #Changed in between
+            return ReplacementResult(False)
+
+    return ReplacementResult(True, item=response['Attributes'])
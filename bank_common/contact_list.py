@@ -0,0 +1,183 @@
+'''
+Contact-list routing: the number Amazon Connect transfers a caller to, served from memory.
+
+The contact-list table (origin -> transferTo) is small and read on every transfer decision, so
+each warm container holds all of it in a dict: loaded with a parallel segmented scan on first
+use, then refreshed by the first lookup after CONTACT_LIST_REFRESH_SECONDS. The refresh runs
+inline, within that invocation's time budget and metrics: Lambda freezes the container between
+invocations, so a background refresh would stall. Lookups racing a refresh in other threads
+keep answering from the copy in memory.
+
+Refreshes are incremental: routes written through this module carry routeSet = 'routes' and an
+updatedAt timestamp (epoch seconds), the keys of the sparse UpdatedAtIndex (see
+bank_common.tables), and a refresh queries that index for the routes changed since the previous
+one. A Query only reads (and bills) the index entries it returns, where a Scan with a filter
+would read the whole table every refresh. All routes share one index partition, which is fine
+for a table written a few times a day.
+
+A full reload every CONTACT_LIST_RELOAD_SECONDS is still a full table scan, and picks up deleted
+routes and routes written by other tools without the index attributes. Each one costs about
+table size / 4 KB read units (half that eventually consistent) per container, so size the
+reload interval to the table: the default hourly reload keeps a table of a few thousand routes
+well under a read unit per second across a fleet of warm containers. A container's own writes
+go to DynamoDB and into its copy at once, other containers see them at their next refresh.
+
+    CONTACT_LIST_TABLE            - table name (default contact-list)
+    CONTACT_LIST_REFRESH_SECONDS  - seconds between incremental refreshes (default 60)
+    CONTACT_LIST_RELOAD_SECONDS   - seconds between full reloads (default 3600)
+    CONTACT_LIST_SCAN_SEGMENTS    - parallel scan segments (default 4)
+'''
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from bank_common import dynamo, metrics
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLE = 'contact-list'
+DEFAULT_REFRESH_SECONDS = 60
+DEFAULT_RELOAD_SECONDS = 3600
+DEFAULT_SEGMENTS = 4
+
+#Keys of the sparse index of changed routes, every route written here is in the one partition
+UPDATED_INDEX = 'UpdatedAtIndex'
+ROUTE_SET_ATTRIBUTE = 'routeSet'
+ROUTE_SET = 'routes'
+UPDATED_ATTRIBUTE = 'updatedAt'
+
+#Incremental refreshes reach back this far, for writes racing the previous refresh
+OVERLAP_SECONDS = 5
+
+
+class RouteTable:
+    '''The whole contact list of one table in memory; one instance per container, thread-safe'''
+
+    def __init__(self, table=None, region_name=None, segments=None, refresh_seconds=None,
+                 reload_seconds=None, clock=time.monotonic):
+        if table is None:
+            table = dynamo.get_table(os.environ.get('CONTACT_LIST_TABLE', DEFAULT_TABLE), region_name=region_name)
+        self.table = table
+        self.segments = segments or int(os.environ.get('CONTACT_LIST_SCAN_SEGMENTS', DEFAULT_SEGMENTS))
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else \
+            float(os.environ.get('CONTACT_LIST_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS))
+        self.reload_seconds = reload_seconds if reload_seconds is not None else \
+            float(os.environ.get('CONTACT_LIST_RELOAD_SECONDS', DEFAULT_RELOAD_SECONDS))
+        self.clock = clock
+
+        self._routes = None #origin -> transferTo
+        self._refreshed_at = None #monotonic time of the last refresh
+        self._reloaded_at = None #monotonic time of the last full reload
+        self._scanned_since = None #epoch seconds the last refresh started at
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock() #held by the one thread refreshing
+
+    @staticmethod
+    def _read_pages(read, request):
+        '''Routes in every page of a Scan or Query'''
+
+        routes = {}
+        while True:
+            response = read(**request)
+            for item in response.get('Items', []):
+                if 'origin' in item and item.get('transferTo'):
+                    routes[item['origin']] = item['transferTo']
+            if 'LastEvaluatedKey' not in response:
+                return routes
+            request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _changed_since(self, since):
+        '''Routes written since the epoch time since, from the index of changed routes'''
+
+        return self._read_pages(self.table.query, {
+            'IndexName': UPDATED_INDEX,
+            'KeyConditionExpression': '#set = :set AND #updated >= :since',
+            'ExpressionAttributeNames': {'#set': ROUTE_SET_ATTRIBUTE, '#updated': UPDATED_ATTRIBUTE},
+            'ExpressionAttributeValues': {':set': ROUTE_SET, ':since': int(since)},
+        })
+
+    def _scan_segment(self, segment):
+        return self._read_pages(self.table.scan, {'Segment': segment, 'TotalSegments': self.segments})
+
+    def _scan(self):
+        '''All routes, with a full table scan of parallel segments'''
+
+        routes = {}
+        with ThreadPoolExecutor(max_workers=self.segments) as pool:
+            #Each segment runs in a copy of the invocation's context, under its budget and metrics
+            futures = [
+                pool.submit(contextvars.copy_context().run, self._scan_segment, segment)
+                for segment in range(self.segments)
+            ]
+            for future in futures:
+                routes.update(future.result())
+        return routes
+
+    def _refresh(self, full):
+        started = time.time()
+        try:
+            routes = self._scan() if full else self._changed_since(self._scanned_since - OVERLAP_SECONDS)
+        except Exception:
+            #Keep serving the routes already in memory, try again after refresh_seconds
+            logger.warning('Could not refresh contact list %s', self.table.name, exc_info=True)
+            metrics.count('ContactListRefreshErrors')
+            with self._lock:
+                if self._routes is None:
+                    self._routes = {}
+                self._refreshed_at = self.clock()
+            return
+
+        with self._lock:
+            if full or self._routes is None:
+                self._routes = routes
+                self._reloaded_at = self.clock()
+            else:
+                self._routes.update(routes)
+            self._scanned_since = started
+            self._refreshed_at = self.clock()
+
+    def _due(self):
+        return self._routes is None or self.clock() - self._refreshed_at >= self.refresh_seconds
+
+    def _current(self):
+        if self._due():
+            #Without routes in memory wait for the thread loading them, otherwise serve the old copy
+            if self._refresh_lock.acquire(blocking=self._routes is None):
+                try:
+                    if self._due():
+                        full = self._reloaded_at is None or self.clock() - self._reloaded_at >= self.reload_seconds
+                        self._refresh(full)
+                finally:
+                    self._refresh_lock.release()
+        return self._routes
+
+    def __len__(self):
+        return len(self._current())
+
+    def get(self, origin):
+        '''The number calls from origin are transferred to, None when there is no route'''
+
+        routes = self._current()
+        if self._reloaded_at is None:
+            #Never loaded in full (the cold start scan failed): ask DynamoDB until a reload works
+            transferTo = self.table.get_item(Key={'origin': origin}).get('Item', {}).get('transferTo')
+        else:
+            transferTo = routes.get(origin)
+        metrics.count('ContactListHits' if transferTo else 'ContactListMisses')
+        return transferTo
+
+    def put(self, origin, transferTo):
+        '''Stores a route in DynamoDB and in this container's copy'''
+
+        self.table.put_item(Item={
+            'origin': origin, 'transferTo': transferTo,
+            ROUTE_SET_ATTRIBUTE: ROUTE_SET, UPDATED_ATTRIBUTE: int(time.time()),
+        })
+        with self._lock:
+            if self._routes is not None:
+                self._routes[origin] = transferTo
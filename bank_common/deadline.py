@@ -0,0 +1,146 @@
+'''
+Per-invocation time budget derived from the Lambda context.
+
+invocation(context) starts a budget of context.get_remaining_time_in_millis() minus a reserve
+kept back for building a fallback response and writing the log line and metrics. Every
+DynamoDB call made through bank_common.dynamo runs against that budget: it is not started once
+the budget is spent, and a read still in flight when the budget runs out is abandoned with
+DeadlineExceeded. The caller (IntentRouter, or the handler itself) then answers with its
+fallback response, which beats Lex or Amazon Connect timing the whole invocation out.
+
+    DEADLINE_RESERVE_MS    - milliseconds kept back from the remaining time (default 500)
+    DEADLINE_MIN_WRITE_MS  - a write is not started with less time left than this (default 100)
+
+The botocore client cannot take a timeout per request, so reads under a budget run on a small
+worker pool and are waited for with the remaining time; an abandoned read finishes (or times
+out on the client's own read timeout) in the background. Writes are never abandoned: a write
+that went on in the background could commit after the caller was told it failed (a card
+rotated while the caller holds for an agent, an account opened twice on a retry). write()
+runs them on the calling thread, bounded by the client's connect and read timeouts, so the
+caller always learns their outcome; a slow write eats into the reserve instead.
+
+The budget is a context variable, so invocations running concurrently in one process (the
+load test) each see their own.
+'''
+
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+DEFAULT_RESERVE_MS = 500
+DEFAULT_MIN_WRITE_MS = 100
+
+#Abandoned reads keep a worker busy until the client's own timeouts end them
+MAX_WORKERS = 8
+
+_current = contextvars.ContextVar('deadline', default=None)
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    '''The invocation's time budget ran out before or during a call'''
+
+
+class Deadline:
+    '''A point in time (monotonic clock) the invocation must have answered by'''
+
+    __slots__ = ('expires', 'clock')
+
+    def __init__(self, budget_ms, clock=time.monotonic):
+        self.clock = clock
+        self.expires = clock() + budget_ms / 1000
+
+    def remaining_ms(self):
+        return (self.expires - self.clock()) * 1000
+
+    def expired(self):
+        return self.remaining_ms() <= 0
+
+
+def current():
+    return _current.get()
+
+
+def remaining_ms():
+    '''Milliseconds left in the current budget, None outside a budgeted invocation'''
+
+    deadline = _current.get()
+    return deadline.remaining_ms() if deadline is not None else None
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='deadline')
+    return _executor
+
+
+def call(function, operation, **kwargs):
+    '''
+    Calls a read function(**kwargs) within the current budget, raising DeadlineExceeded when it
+    runs out. Only for calls without side effects, the abandoned call goes on in the background.
+    '''
+
+    deadline = _current.get()
+    if deadline is None:
+        return function(**kwargs)
+
+    remaining = deadline.remaining_ms()
+    if remaining <= 0:
+        raise DeadlineExceeded(f'{operation} not started, the time budget is spent')
+
+    future = _pool().submit(function, **kwargs)
+    try:
+        return future.result(timeout=remaining / 1000)
+    except FutureTimeoutError:
+        raise DeadlineExceeded(f'{operation} abandoned after {remaining:.0f} ms, the time budget ran out') from None
+
+
+def write(function, operation, **kwargs):
+    '''
+    Calls a write function(**kwargs) on the calling thread. Raises DeadlineExceeded without
+    starting it when less than DEADLINE_MIN_WRITE_MS is left; once started it runs to its
+    outcome, which is returned (or raised) even when it overran the budget.
+    '''
+
+    deadline = _current.get()
+    if deadline is not None:
+        remaining = deadline.remaining_ms()
+        if remaining < float(os.environ.get('DEADLINE_MIN_WRITE_MS', DEFAULT_MIN_WRITE_MS)):
+            raise DeadlineExceeded(f'{operation} not started, {remaining:.0f} ms left in the time budget')
+
+    return function(**kwargs)
+
+
+@contextmanager
+def invocation(context, reserve_ms=None, max_ms=None):
+    '''
+    Sets the budget of one Lambda invocation. max_ms caps it below the Lambda timeout, e.g.
+    8000 for Amazon Connect, which stops waiting for a function after 8 seconds. Without a
+    context (local scripts, tests) there is no budget.
+    '''
+
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining is None:
+        yield None
+        return
+
+    if reserve_ms is None:
+        reserve_ms = float(os.environ.get('DEADLINE_RESERVE_MS', DEFAULT_RESERVE_MS))
+    budget_ms = get_remaining() - reserve_ms
+    if max_ms is not None:
+        budget_ms = min(budget_ms, max_ms - reserve_ms)
+
+    deadline = Deadline(budget_ms)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
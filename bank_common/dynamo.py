@@ -0,0 +1,451 @@
+'''
+Lightweight DynamoDB access for the Lambda handlers.
+
+Uses a plain botocore client with an explicit type serializer instead of the boto3 resource
+layer, which loads resource models and builds Table classes at cold start. Table mirrors the
+subset of the resource Table API the handlers use, so call sites keep passing plain Python
+values for Key, Item and ExpressionAttributeValues. Every call is timed and reported to
+bank_common.metrics, and runs within the invocation's bank_common.deadline budget: reads can
+be abandoned when it runs out, writes are not started without time left but never abandoned.
+
+Unlike the resource layer, which turns every number into a Decimal, responses come back with
+integral numbers (account numbers, pins, card numbers) as int; only a table's
+decimal_attributes (money) and fractional values are Decimal. JSONEncoder / json_default
+serialize both, so items can go straight into json.dumps: whole Decimals as JSON numbers,
+fractional ones as strings of their exact digits ("0.30"), never through a rounding float.
+
+The client is created once per container and region with a tuned botocore Config, tight
+timeouts so a stalled connection fails inside the Lex / Connect time budget, TCP keepalive so
+warm containers reuse their TLS connections, and adaptive retries. Tunable from the environment:
+
+    DYNAMODB_CONNECT_TIMEOUT       - seconds (default 0.5)
+    DYNAMODB_READ_TIMEOUT          - seconds (default 1.5)
+    DYNAMODB_MAX_ATTEMPTS          - attempts per request including the first (default 3)
+    DYNAMODB_RETRY_MODE            - adaptive (default), standard or legacy
+    DYNAMODB_MAX_POOL_CONNECTIONS  - connections kept per client (default 25, one per fan-out thread)
+'''
+
+import os
+import json
+import time
+import base64
+import threading
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+from bank_common import deadline, metrics
+
+
+#BatchGetItem takes at most 100 keys per request, BatchWriteItem 25 requests
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+
+#Operations with side effects, run to their outcome instead of being abandoned (see deadline)
+WRITE_OPERATIONS = frozenset({'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem'})
+
+_clients = {} #region name (None = default) -> client
+_tables = {} #(table name, region name) -> Table
+_client_lock = threading.Lock()
+
+
+""" --- Type serialization --- """
+
+
+def serialize(value):
+    '''Python value -> DynamoDB AttributeValue'''
+
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (set, frozenset)):
+        if all(isinstance(v, str) for v in value):
+            return {'SS': list(value)}
+        if all(isinstance(v, (int, Decimal)) and not isinstance(v, bool) for v in value):
+            return {'NS': [str(v) for v in value]}
+        return {'BS': [bytes(v) for v in value]}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(v) for v in value]}
+    if isinstance(value, dict):
+        return {'M': {k: serialize(v) for k, v in value.items()}}
+
+    #Same rule as boto3: floats lose precision, callers must pass Decimal
+    raise TypeError(f'Unsupported type {type(value).__name__} for DynamoDB value {value!r}')
+
+
+def _number(text):
+    '''N value -> int when integral (account numbers, pins, card numbers), Decimal otherwise'''
+
+    if text.isdecimal() or (text[:1] == '-' and text[1:].isdecimal()):
+        return int(text)
+    return Decimal(text)
+
+
+def deserialize(attribute_value):
+    '''DynamoDB AttributeValue -> Python value (integral numbers as int, the others as Decimal)'''
+
+    for type_code, value in attribute_value.items():
+        break
+
+    if type_code == 'S':
+        return value
+    if type_code == 'N':
+        return _number(value)
+    if type_code == 'BOOL':
+        return value
+    if type_code == 'NULL':
+        return None
+    if type_code == 'M':
+        return deserialize_item(value)
+    if type_code == 'L':
+        return [deserialize(v) for v in value]
+    if type_code == 'SS':
+        return set(value)
+    if type_code == 'NS':
+        return {_number(v) for v in value}
+    if type_code == 'B':
+        return value
+    if type_code == 'BS':
+        return set(value)
+
+    raise TypeError(f'Unknown DynamoDB type {type_code}')
+
+
+def serialize_item(item):
+    return {k: serialize(v) for k, v in item.items()}
+
+
+def deserialize_item(item, decimal_attributes=frozenset()):
+    '''
+    Low-level item -> plain dict. Strings and integral numbers, nearly every attribute of an
+    account, are converted inline without a call per attribute; decimal_attributes (money) are
+    always Decimal, even when the stored value happens to be whole.
+    '''
+
+    result = {}
+    for name, attribute_value in item.items():
+        for type_code, value in attribute_value.items():
+            break
+        if type_code == 'S':
+            result[name] = value
+        elif type_code == 'N':
+            if name in decimal_attributes:
+                result[name] = Decimal(value)
+            elif value.isdecimal():
+                result[name] = int(value)
+            else:
+                result[name] = _number(value)
+        else:
+            result[name] = deserialize(attribute_value)
+    return result
+
+
+def json_default(value):
+    '''json.dumps default for deserialized items: Decimal, sets and binary values'''
+
+    if isinstance(value, Decimal):
+        #Money stays exact: a float drops the scale (0.30 -> 0.3) and digits past the 17th
+        return int(value) if value == value.to_integral_value() else str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class JSONEncoder(json.JSONEncoder):
+    '''json.dumps(item, cls=dynamo.JSONEncoder) for items with int and Decimal numbers alike'''
+
+    def default(self, value):
+        return json_default(value)
+
+
+""" --- Client --- """
+
+
+def projection(attribute_names):
+    '''
+    ProjectionExpression / ExpressionAttributeNames reading attribute_names and nothing else.
+    Every name gets a placeholder, so names with spaces or hyphens ('Account Balance',
+    'first-name') and reserved words need no special handling.
+    '''
+
+    names = {f'#p{i}': name for i, name in enumerate(dict.fromkeys(attribute_names))}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def client_config():
+    '''botocore Config of the per-container client'''
+
+    from botocore.config import Config
+    return Config(
+        connect_timeout=float(os.environ.get('DYNAMODB_CONNECT_TIMEOUT', 0.5)),
+        read_timeout=float(os.environ.get('DYNAMODB_READ_TIMEOUT', 1.5)),
+        retries={
+            'mode': os.environ.get('DYNAMODB_RETRY_MODE', 'adaptive'),
+            'total_max_attempts': int(os.environ.get('DYNAMODB_MAX_ATTEMPTS', 3)),
+        },
+        max_pool_connections=int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', 25)),
+        tcp_keepalive=True,
+    )
+
+
+def get_client(region_name=None):
+    '''
+    Returns the per-container DynamoDB client for a region, creating it on first use.
+    DYNAMODB_BACKEND=local swaps in the in-process emulator configured by DYNAMODB_LOCAL_CONFIG.
+    '''
+
+    client = _clients.get(region_name)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(region_name)
+            if client is None:
+                if os.environ.get('DYNAMODB_BACKEND') == 'local':
+                    #In-process emulator (see local_dynamodb), shared by every region
+                    from bank_common import local_dynamodb
+                    client = local_dynamodb.shared()
+                else:
+                    import botocore.session
+                    session = botocore.session.get_session()
+                    client = session.create_client(
+                        'dynamodb', region_name=region_name or os.environ.get('AWS_REGION'), config=client_config()
+                    )
+                _clients[region_name] = client
+
+    return client
+
+
+def set_client(client, region_name=None):
+    '''Points every Table of a region at another client, e.g. a local DynamoDB stand-in'''
+
+    _clients[region_name] = client
+
+
+def get_table(name, region_name=None, decimal_attributes=()):
+    '''
+    Shared Table handle, created once per container instead of in every helper call.
+    decimal_attributes name the table's money attributes, read as Decimal (see deserialize_item).
+    '''
+
+    key = (name, region_name)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables.setdefault(key, Table(name, region_name))
+    if decimal_attributes:
+        table.decimal_attributes = table.decimal_attributes.union(decimal_attributes)
+    return table
+
+
+class Table:
+    '''Resource-style Table on top of the low-level client'''
+
+    def __init__(self, name, region_name=None, decimal_attributes=()):
+        self.name = name
+        self.region_name = region_name
+        self.decimal_attributes = frozenset(decimal_attributes)
+
+    @property
+    def client(self):
+        return get_client(self.region_name)
+
+    @staticmethod
+    def _request(kwargs):
+        for field in ('Key', 'Item', 'ExclusiveStartKey'):
+            if field in kwargs:
+                kwargs[field] = serialize_item(kwargs[field])
+        if 'ExpressionAttributeValues' in kwargs:
+            kwargs['ExpressionAttributeValues'] = serialize_item(kwargs['ExpressionAttributeValues'])
+        return kwargs
+
+    def _response(self, response):
+        for field in ('Item', 'Attributes', 'LastEvaluatedKey'):
+            if field in response:
+                response[field] = deserialize_item(response[field], self.decimal_attributes)
+        if 'Items' in response:
+            decimal_attributes = self.decimal_attributes
+            response['Items'] = [deserialize_item(item, decimal_attributes) for item in response['Items']]
+        return response
+
+    def deserialize_item(self, item):
+        '''A low-level item of this table (e.g. from a ConditionalCheckFailed error) -> plain dict'''
+
+        return deserialize_item(item, self.decimal_attributes)
+
+    def _call(self, operation, method, kwargs):
+        start = time.perf_counter()
+        run = deadline.write if operation in WRITE_OPERATIONS else deadline.call
+        try:
+            response = run(getattr(self.client, method), operation, TableName=self.name, **self._request(kwargs))
+        except ClientError as err:
+            metrics.record_dynamodb(operation, (time.perf_counter() - start) * 1000, error_code=err.response['Error']['Code'])
+            raise
+        except deadline.DeadlineExceeded:
+            metrics.record_dynamodb(operation, (time.perf_counter() - start) * 1000, error_code='DeadlineExceeded')
+            raise
+
+        metrics.record_dynamodb(
+            operation, (time.perf_counter() - start) * 1000,
+            retries=response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        )
+        return self._response(response)
+
+    def get_item(self, **kwargs):
+        return self._call('GetItem', 'get_item', kwargs)
+
+    def put_item(self, **kwargs):
+        return self._call('PutItem', 'put_item', kwargs)
+
+    def update_item(self, **kwargs):
+        return self._call('UpdateItem', 'update_item', kwargs)
+
+    def delete_item(self, **kwargs):
+        return self._call('DeleteItem', 'delete_item', kwargs)
+
+    def query(self, **kwargs):
+        return self._call('Query', 'query', kwargs)
+
+    def scan(self, **kwargs):
+        return self._call('Scan', 'scan', kwargs)
+
+    def batch_writer(self, flush_amount=BATCH_WRITE_SIZE):
+        return BatchWriter(self, flush_amount)
+
+    def batch_get(self, keys, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False):
+        '''
+        Reads many keys with BatchGetItem (100 per request, UnprocessedKeys retried with
+        backoff). Returns one item per key in the order of keys, None where there is none.
+        '''
+
+        if not keys:
+            return []
+
+        key_names = list(keys[0])
+        request_item = {'ConsistentRead': ConsistentRead}
+        if ProjectionExpression:
+            #Items are matched back to their keys, the key attributes must come back too
+            names = dict(ExpressionAttributeNames or {})
+            for i, name in enumerate(key_names):
+                names[f'#key{i}'] = name
+            request_item['ProjectionExpression'] = ', '.join([ProjectionExpression] + [f'#key{i}' for i in range(len(key_names))])
+            request_item['ExpressionAttributeNames'] = names
+
+        #BatchGetItem rejects a request naming the same key twice
+        unique = list({self._key_values(key, key_names): key for key in keys}.values())
+
+        found = {}
+        for start in range(0, len(unique), BATCH_GET_SIZE):
+            pending = [serialize_item(key) for key in unique[start:start + BATCH_GET_SIZE]]
+            backoff = 0.0
+            while pending:
+                response = self._batch_get_call(dict(request_item, Keys=pending))
+                for item in response.get('Responses', {}).get(self.name, []):
+                    item = deserialize_item(item, self.decimal_attributes)
+                    found[tuple(item.get(name) for name in key_names)] = item
+                pending = response.get('UnprocessedKeys', {}).get(self.name, {}).get('Keys', [])
+                if pending:
+                    backoff = min(max(backoff * 2, 0.05), BatchWriter.MAX_BACKOFF)
+                    time.sleep(backoff)
+
+        return [found.get(self._key_values(key, key_names)) for key in keys]
+
+    def _key_values(self, key, key_names):
+        '''Key values as they come back from DynamoDB, so requested and returned keys compare equal'''
+
+        key = deserialize_item(serialize_item(key), self.decimal_attributes)
+        return tuple(key[name] for name in key_names)
+
+    def batch_write(self, requests):
+        '''
+        One BatchWriteItem of at most 25 serialized requests ({'PutRequest': {'Item': ...}} or
+        {'DeleteRequest': {'Key': ...}}). Returns the requests DynamoDB left unprocessed.
+        '''
+
+        start = time.perf_counter()
+        try:
+            response = deadline.write(self.client.batch_write_item, 'BatchWriteItem', RequestItems={self.name: requests})
+        except ClientError as err:
+            metrics.record_dynamodb('BatchWriteItem', (time.perf_counter() - start) * 1000, error_code=err.response['Error']['Code'])
+            raise
+        except deadline.DeadlineExceeded:
+            metrics.record_dynamodb('BatchWriteItem', (time.perf_counter() - start) * 1000, error_code='DeadlineExceeded')
+            raise
+
+        unprocessed = response.get('UnprocessedItems', {}).get(self.name, [])
+        metrics.record_dynamodb(
+            'BatchWriteItem', (time.perf_counter() - start) * 1000,
+            retries=response.get('ResponseMetadata', {}).get('RetryAttempts', 0), unprocessed=len(unprocessed)
+        )
+        return unprocessed
+
+    def _batch_get_call(self, request_item):
+        start = time.perf_counter()
+        try:
+            response = deadline.call(self.client.batch_get_item, 'BatchGetItem', RequestItems={self.name: request_item})
+        except ClientError as err:
+            metrics.record_dynamodb('BatchGetItem', (time.perf_counter() - start) * 1000, error_code=err.response['Error']['Code'])
+            raise
+        except deadline.DeadlineExceeded:
+            metrics.record_dynamodb('BatchGetItem', (time.perf_counter() - start) * 1000, error_code='DeadlineExceeded')
+            raise
+
+        metrics.record_dynamodb(
+            'BatchGetItem', (time.perf_counter() - start) * 1000,
+            retries=response.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+            unprocessed=len(response.get('UnprocessedKeys', {}).get(self.name, {}).get('Keys', []))
+        )
+        return response
+
+
+class BatchWriter:
+    '''
+    Resource-style batch_writer: buffers put/delete requests, sends them 25 at a time with
+    BatchWriteItem and re-queues UnprocessedItems with exponential backoff.
+    '''
+
+    MAX_BACKOFF = 5.0
+
+    def __init__(self, table, flush_amount=BATCH_WRITE_SIZE):
+        self.table = table
+        self.flush_amount = flush_amount
+        self._buffer = []
+        self._backoff = 0.0
+
+    def put_item(self, Item):
+        self._buffer.append({'PutRequest': {'Item': serialize_item(Item)}})
+        if len(self._buffer) >= self.flush_amount:
+            self._flush()
+
+    def delete_item(self, Key):
+        self._buffer.append({'DeleteRequest': {'Key': serialize_item(Key)}})
+        if len(self._buffer) >= self.flush_amount:
+            self._flush()
+
+    def _flush(self):
+        batch, self._buffer = self._buffer[:self.flush_amount], self._buffer[self.flush_amount:]
+
+        unprocessed = self.table.batch_write(batch)
+        if unprocessed:
+            #Partially throttled batch: back off before the requests are sent again
+            self._buffer.extend(unprocessed)
+            self._backoff = min(max(self._backoff * 2, 0.05), self.MAX_BACKOFF)
+            time.sleep(self._backoff)
+        else:
+            self._backoff = 0.0
+
+    def flush(self):
+        while self._buffer:
+            self._flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
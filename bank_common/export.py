@@ -0,0 +1,379 @@
+'''
+Parallel, resumable exporter for DynamoDB tables.
+
+Runs a parallel Scan with `segments` segments, one thread each, and streams every segment to its
+own gzip-compressed NDJSON file as pages arrive, so the table is never held in memory. Each
+page is written as a complete gzip member; the files are ordinary .ndjson.gz files to any
+reader (zcat, gzip.open, bank_common.bloom).
+
+Reads stay within a read-capacity budget: every Scan asks for its ConsumedCapacity and all
+segments draw from one token bucket of `rcu` units per second, so an export of a provisioned
+table leaves capacity for the handlers.
+
+Progress is checkpointed per segment after every page: the LastEvaluatedKey the segment
+continues from and the length of its file up to that page. An interrupted export restarted
+with the same output directory truncates each file to its checkpoint and carries on from the
+saved key, without duplicate or missing items.
+
+    python -m bank_common.export BankAccountsNew exports/ --segments 8 --rcu 50
+
+Output formats: `plain` items, one JSON object per line with numbers as JSON numbers written
+digit for digit as DynamoDB stores them, so balances keep every decimal place (what
+bank_common.bulk_load reads back, as Decimal, once decompressed), or `dynamodb` lines of {"Item": {...}}
+in DynamoDB JSON, like a DynamoDB export to S3, which keeps sets and binary values exact.
+'''
+
+import os
+import sys
+import json
+import time
+import gzip
+import base64
+import argparse
+import threading
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+from bank_common import dynamo
+
+
+FORMATS = ('plain', 'dynamodb')
+
+MAX_BACKOFF = 5.0
+
+
+""" --- Encoding --- """
+
+
+def _dynamodb_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _plain(value):
+    '''
+    Plain JSON text of a low-level AttributeValue. Numbers are copied from their N string
+    instead of going through float; sets become sorted lists and binary values base64.
+    '''
+
+    (kind, content), = value.items()
+    if kind == 'S':
+        return json.dumps(content)
+    if kind == 'N':
+        return content
+    if kind == 'M':
+        return '{' + ','.join(json.dumps(name) + ':' + _plain(member) for name, member in content.items()) + '}'
+    if kind == 'L':
+        return '[' + ','.join(_plain(member) for member in content) + ']'
+    if kind == 'BOOL':
+        return 'true' if content else 'false'
+    if kind == 'NULL':
+        return 'null'
+    if kind == 'NS':
+        return '[' + ','.join(sorted(content, key=Decimal)) + ']'
+    if kind == 'SS':
+        return json.dumps(sorted(content), separators=(',', ':'))
+    if kind == 'B':
+        return json.dumps(base64.b64encode(content).decode())
+    if kind == 'BS':
+        return json.dumps(sorted(base64.b64encode(member).decode() for member in content), separators=(',', ':'))
+    raise TypeError(f'Unknown DynamoDB type {kind}')
+
+
+def encode_line(item, format='plain'):
+    '''One NDJSON line of a low-level (DynamoDB JSON) item'''
+
+    if format == 'dynamodb':
+        return json.dumps({'Item': item}, separators=(',', ':'), default=_dynamodb_default) + '\n'
+    return _plain({'M': item}) + '\n'
+
+
+def _encode_key(key):
+    '''LastEvaluatedKey -> JSON-safe form for the checkpoint (binary keys as base64)'''
+
+    return {name: {'B': base64.b64encode(value['B']).decode()} if 'B' in value else value for name, value in key.items()}
+
+
+def _decode_key(key):
+    return {name: {'B': base64.b64decode(value['B'])} if 'B' in value else value for name, value in key.items()}
+
+
+""" --- Checkpoint --- """
+
+
+class Checkpoint:
+    '''Per-segment resume state of one export, rewritten atomically'''
+
+    def __init__(self, path, table_name, segments, format):
+        self.path = path
+        self.header = {'table': table_name, 'segments': segments, 'format': format}
+        self.state = {} #segment -> {'key', 'offset', 'items', 'done'}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            saved = json.load(f)
+        for name, value in self.header.items():
+            if saved.get(name) != value:
+                raise ValueError(f'Checkpoint {self.path} has {name} {saved.get(name)!r}, not {value!r}')
+        self.state = {int(segment): state for segment, state in saved['state'].items()}
+        return self.state
+
+    def save(self, segment, state):
+        with self._lock:
+            self.state[segment] = state
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(dict(self.header, state=self.state, updated=time.time()), f)
+            os.replace(temporary, self.path)
+
+
+""" --- Exporter --- """
+
+
+class CapacityBudget:
+    '''
+    Token bucket of read capacity units shared by every segment. A Scan's units are only known
+    afterwards, so each request reserves what the segment's previous page cost and settles the
+    difference once the response says what it really cost. A rate of 0 means unlimited.
+    '''
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(rate)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, units):
+        '''Waits until units (at most one second's worth) are available and takes them'''
+
+        if not self.rate:
+            return
+        needed = min(units, self.rate)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= units
+                    return
+                delay = (needed - self._tokens) / self.rate
+            self.sleep(delay)
+
+    def settle(self, reserved, consumed):
+        '''Books the difference between what a request reserved and what it consumed'''
+
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens += reserved - consumed
+
+
+class ExportStats:
+
+    def __init__(self):
+        self.items = 0
+        self.pages = 0
+        self.bytes = 0
+        self.consumed_rcu = 0.0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'items': self.items,
+            'pages': self.pages,
+            'compressed_bytes': self.bytes,
+            'consumed_rcu': self.consumed_rcu,
+            'elapsed_s': round(elapsed, 3),
+            'items_per_s': round(self.items / elapsed, 1) if elapsed else 0.0,
+            'rcu_per_s': round(self.consumed_rcu / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+class TableExporter:
+    '''
+    Exports one table to output_dir/<table>.<segment>-of-<segments>.ndjson.gz with a parallel
+    Scan, checkpointing to output_dir/<table>.checkpoint.json.
+    '''
+
+    def __init__(self, table_name, output_dir, segments=4, region_name=None, rcu=0, page_size=None,
+                 format='plain', consistent_read=False, progress_interval=2.0, out=sys.stderr):
+        if format not in FORMATS:
+            raise ValueError(f'Unknown format {format}, expected one of {", ".join(FORMATS)}')
+        self.table_name = table_name
+        self.output_dir = output_dir
+        self.segments = segments
+        self.region_name = region_name
+        self.page_size = page_size
+        self.format = format
+        self.consistent_read = consistent_read
+        self.progress_interval = progress_interval
+        self.out = out
+        self.budget = CapacityBudget(rcu)
+        self.stats = ExportStats()
+        self._failed = threading.Event() #set when a segment fails, the others stop at their next page
+        self.checkpoint = Checkpoint(
+            os.path.join(output_dir, f'{table_name}.checkpoint.json'), table_name, segments, format
+        )
+
+    @property
+    def client(self):
+        return dynamo.get_client(self.region_name)
+
+    def segment_path(self, segment):
+        return os.path.join(self.output_dir, f'{self.table_name}.{segment:04d}-of-{self.segments:04d}.ndjson.gz')
+
+    def export_segment(self, segment, state):
+        '''Scans one segment to its file, continuing from state (a checkpoint entry or None)'''
+
+        state = dict(state or {'key': None, 'offset': 0, 'items': 0, 'done': False})
+        if state['done']:
+            return
+
+        request = {
+            'TableName': self.table_name, 'Segment': segment, 'TotalSegments': self.segments,
+            'ConsistentRead': self.consistent_read, 'ReturnConsumedCapacity': 'TOTAL'
+        }
+        if self.page_size:
+            request['Limit'] = self.page_size
+        if state['key']:
+            request['ExclusiveStartKey'] = _decode_key(state['key'])
+
+        path = self.segment_path(segment)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            #Drop whatever was written after the last checkpoint, it is read again
+            f.truncate(state['offset'])
+            f.seek(state['offset'])
+
+            backoff = 0.0
+            expected = 1.0 #RCU of the segment's previous page, what the next one is likely to cost
+            while not self._failed.is_set():
+                self.budget.reserve(expected)
+                try:
+                    response = self.client.scan(**request)
+                except dynamo.ClientError as err:
+                    self.budget.settle(expected, 0)
+                    if err.response['Error']['Code'] not in ('ProvisionedThroughputExceededException', 'ThrottlingException'):
+                        raise
+                    #Over the table's own capacity despite the budget: back off and read the page again
+                    backoff = min(max(backoff * 2, 0.05), MAX_BACKOFF)
+                    time.sleep(backoff)
+                    continue
+                backoff = 0.0
+                consumed = (response.get('ConsumedCapacity') or {}).get('CapacityUnits', 0)
+                self.budget.settle(expected, consumed)
+                expected = max(consumed, 1.0)
+
+                items = response.get('Items', [])
+                if items:
+                    data = ''.join(encode_line(item, self.format) for item in items).encode()
+                    #One gzip member per page, so the file is valid at every checkpoint
+                    f.write(gzip.compress(data, compresslevel=6))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                last_key = response.get('LastEvaluatedKey')
+                state = {
+                    'key': _encode_key(last_key) if last_key else None, 'offset': f.tell(),
+                    'items': state['items'] + len(items), 'done': not last_key
+                }
+                self.checkpoint.save(segment, state)
+
+                with self.stats.lock:
+                    self.stats.items += len(items)
+                    self.stats.pages += 1
+                    self.stats.consumed_rcu += consumed
+
+                if not last_key:
+                    return
+                request['ExclusiveStartKey'] = last_key
+
+    def _export_segment(self, segment, state):
+        try:
+            self.export_segment(segment, state)
+        except Exception:
+            self._failed.set()
+            raise
+
+    def _report(self, stop):
+        last_items, last_rcu, last_time = 0, 0.0, time.monotonic()
+        while not stop.wait(self.progress_interval):
+            now = time.monotonic()
+            with self.stats.lock:
+                items, rcu = self.stats.items, self.stats.consumed_rcu
+            interval = now - last_time
+            done = sum(1 for state in self.checkpoint.state.values() if state['done'])
+            self.out.write(
+                f'{items} items  {(items - last_items) / interval:,.0f} items/s  '
+                f'{(rcu - last_rcu) / interval:,.1f} RCU/s  segments done {done}/{self.segments}\n'
+            )
+            self.out.flush()
+            last_items, last_rcu, last_time = items, rcu, now
+
+    def export(self):
+        '''Exports every segment, resuming from the checkpoint; returns ExportStats'''
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        saved = self.checkpoint.load()
+
+        stop = threading.Event()
+        reporter = None
+        if self.progress_interval:
+            reporter = threading.Thread(target=self._report, args=(stop,), daemon=True)
+            reporter.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.segments) as pool:
+                futures = [pool.submit(self._export_segment, segment, saved.get(segment)) for segment in range(self.segments)]
+                for future in futures:
+                    future.result()
+        finally:
+            stop.set()
+            if reporter is not None:
+                reporter.join()
+
+        self.stats.bytes = sum(os.path.getsize(self.segment_path(segment)) for segment in range(self.segments))
+        return self.stats
+
+
+def export_table(table_name, output_dir, **options):
+    '''Exports table_name into output_dir; options are passed to TableExporter'''
+
+    return TableExporter(table_name, output_dir, **options).export()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('table', help='DynamoDB table name')
+    parser.add_argument('output_dir', help='directory of the segment files and the checkpoint; rerun with it to resume')
+    parser.add_argument('--segments', type=int, default=4, help='parallel Scan segments (TotalSegments), one thread each')
+    parser.add_argument('--rcu', type=float, default=0, help='read capacity units per second for the whole export, 0 for no limit')
+    parser.add_argument('--page-size', type=int, help='items per Scan page (Limit), smaller pages spread reads more evenly')
+    parser.add_argument('--format', choices=FORMATS, default='plain', help='plain items or DynamoDB JSON')
+    parser.add_argument('--consistent-read', action='store_true', help='strongly consistent Scan (twice the RCU)')
+    parser.add_argument('--region', help='AWS region (default: AWS_REGION)')
+    parser.add_argument('--progress-interval', type=float, default=2.0, help='seconds between progress lines, 0 for none')
+    args = parser.parse_args(argv)
+
+    stats = export_table(
+        args.table, args.output_dir, segments=args.segments, region_name=args.region, rcu=args.rcu,
+        page_size=args.page_size, format=args.format, consistent_read=args.consistent_read,
+        progress_interval=args.progress_interval
+    )
+    print(json.dumps(stats.as_dict()))
+
+
+if __name__ == '__main__':
+    main()
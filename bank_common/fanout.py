@@ -0,0 +1,152 @@
+'''
+Runs the independent DynamoDB calls of one invocation concurrently.
+
+A handler that needs several reads (or writes) that do not depend on each other queues them
+on a Fanout and runs them together, so the wall-clock time is that of the slowest call rather
+than the sum of all of them. Reads of several keys from the same table (with the same options)
+are merged into one BatchGetItem instead of one GetItem each.
+
+    with fanout.Fanout() as calls:
+        greeting = calls.get_item(table, Key={'phone-number': number})
+        route = calls.get_item(contacts, Key={'origin': number})
+    greeting.result(), route.result()
+
+The first queued call runs on the calling thread, the others on a thread pool created once per
+container and kept warm across invocations. Pool threads run each call in a copy of the caller's
+context, and every call still goes through bank_common.dynamo, so it is timed, reported to the
+invocation's bank_common.metrics and bounded by its bank_common.deadline budget.
+
+    FANOUT_WORKERS  - threads kept warm per container (default 8)
+'''
+
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+DEFAULT_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(os.environ.get('FANOUT_WORKERS', DEFAULT_WORKERS))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fanout')
+    return _executor
+
+
+class Pending:
+    '''Result of a queued call, available once the Fanout has run'''
+
+    __slots__ = ('_value', '_error', '_done')
+
+    def __init__(self):
+        self._value = None
+        self._error = None
+        self._done = False
+
+    def _set(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self._done = True
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        '''The call's response, or the exception it raised'''
+
+        if not self._done:
+            raise RuntimeError('Fanout has not run yet')
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class Fanout:
+    '''A set of independent calls, run together by run() or on leaving the with block'''
+
+    def __init__(self):
+        self._gets = {} #(table name, region, options) -> [table, options, [(Key, Pending)]]
+        self._calls = [] #(function, args, kwargs, Pending)
+
+    def get_item(self, table, Key, **options):
+        '''Queues a GetItem, the result is a get_item response ({'Item': ...} or {})'''
+
+        pending = Pending()
+        group = (table.name, table.region_name, repr(sorted(options.items())))
+        self._gets.setdefault(group, [table, options, []])[2].append((Key, pending))
+        return pending
+
+    def call(self, function, *args, **kwargs):
+        '''Queues any other call, e.g. a put_item or a query'''
+
+        pending = Pending()
+        self._calls.append((function, args, kwargs, pending))
+        return pending
+
+    def _tasks(self):
+        for table, options, requests in self._gets.values():
+            if len(requests) == 1:
+                (Key, pending), = requests
+                yield pending, table.get_item, (), dict(options, Key=Key)
+            else:
+                yield None, _batch_task, (table, options, requests), {}
+        for function, args, kwargs, pending in self._calls:
+            yield pending, function, args, kwargs
+
+        self._gets = {}
+        self._calls = []
+
+    def run(self):
+        '''Runs every queued call and waits for all of them; errors are kept per call'''
+
+        tasks = list(self._tasks())
+        if not tasks:
+            return
+
+        #Each pool thread runs in a copy of the invocation's context, under its budget and metrics
+        futures = [_pool().submit(contextvars.copy_context().run, _run, *task) for task in tasks[1:]]
+        _run(*tasks[0])
+        wait(futures)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.run()
+
+
+def _run(pending, function, args, kwargs):
+    if pending is None:
+        #Batch tasks hand out their results themselves
+        function(*args, **kwargs)
+        return
+
+    try:
+        value = function(*args, **kwargs)
+    except Exception as err:
+        pending._set(error=err)
+    else:
+        pending._set(value)
+
+
+def _batch_task(table, options, requests):
+    '''One BatchGetItem for every key queued on the same table, results handed out per key'''
+
+    try:
+        items = table.batch_get([Key for Key, _ in requests], **options)
+    except Exception as err:
+        for _, pending in requests:
+            pending._set(error=err)
+        return
+
+    for (_, pending), item in zip(requests, items):
+        pending._set({'Item': item} if item is not None else {})
@@ -0,0 +1,257 @@
+'''
+Lex V1 / V2 event parsing and response builders shared by every bot handler.
+
+parse() turns a raw code hook event into a LexRequest once per invocation, so handlers read
+interpreted slot values directly instead of walking slot['value']['interpretedValue'] chains
+or guarding lookups with try/except. The response builders emit the shape matching the
+version of the request they answer.
+'''
+
+
+V1 = 1
+V2 = 2
+
+
+class LexRequest:
+    '''Normalized view of a Lex code hook event'''
+
+    __slots__ = (
+        'version', 'intent_name', 'source', 'confirmation_state', 'slots', 'raw_slots',
+        'session_attributes', 'user_id', 'bot_name', 'input_transcript', 'input_mode', 'event'
+    )
+
+    def slot(self, name):
+        '''Interpreted value of a slot, None when it is not filled'''
+
+        return self.slots.get(name)
+
+    def set_slot(self, name, value):
+        '''Fills a slot, the raw slots echoed back to Lex are updated in the version's shape'''
+
+        self.slots[name] = value
+        if self.version == V1:
+            self.raw_slots[name] = value
+        else:
+            self.raw_slots[name] = {
+                'shape': 'Scalar',
+                'value': {'originalValue': value, 'interpretedValue': value, 'resolvedValues': [value]}
+            }
+
+    def clear_slot(self, name):
+        '''Empties a slot so Lex elicits it again'''
+
+        self.slots[name] = None
+        self.raw_slots[name] = None
+
+
+def _parse_v1(event):
+
+    intent = event['currentIntent']
+    raw_slots = intent.get('slots')
+    if raw_slots is None:
+        raw_slots = intent['slots'] = {}
+
+    request = LexRequest()
+    request.version = V1
+    request.intent_name = intent['name']
+    request.confirmation_state = intent.get('confirmationStatus')
+    request.raw_slots = raw_slots
+    request.slots = dict(raw_slots)
+    request.session_attributes = event.get('sessionAttributes')
+    if request.session_attributes is None:
+        request.session_attributes = {}
+    request.user_id = event.get('userId')
+    request.input_mode = None
+
+    return request
+
+
+def _parse_v2(event):
+
+    session_state = event['sessionState']
+    intent = session_state['intent']
+    raw_slots = intent.get('slots')
+    if raw_slots is None:
+        raw_slots = intent['slots'] = {}
+
+    slots = {}
+    for name, slot in raw_slots.items():
+        value = slot.get('value') if slot else None
+        slots[name] = value.get('interpretedValue') if value else None
+
+    request = LexRequest()
+    request.version = V2
+    request.intent_name = intent['name']
+    request.confirmation_state = intent.get('confirmationState')
+    request.raw_slots = raw_slots
+    request.slots = slots
+    request.session_attributes = session_state.get('sessionAttributes')
+    if request.session_attributes is None:
+        request.session_attributes = {}
+    request.user_id = event.get('sessionId')
+    request.input_mode = event.get('inputMode')
+
+    return request
+
+
+def parse(event):
+    '''Builds a LexRequest from a Lex V1 (currentIntent) or V2 (sessionState) event'''
+
+    request = _parse_v2(event) if 'sessionState' in event else _parse_v1(event)
+    request.source = event.get('invocationSource')
+    request.bot_name = event.get('bot', {}).get('name')
+    request.input_transcript = event.get('inputTranscript')
+    request.event = event
+
+    return request
+
+
+""" --- Response builders --- """
+
+
+def message(content):
+    return {'contentType': 'PlainText', 'content': content}
+
+
+def _message(msg):
+    return message(msg) if isinstance(msg, str) else msg
+
+
+def elicit_slot(request, slot_to_elicit, msg):
+    '''Re-prompts the user to provide a slot value in the response'''
+
+    if request.version == V1:
+        return {
+            'sessionAttributes': request.session_attributes,
+            'dialogAction': {
+                'type': 'ElicitSlot',
+                'intentName': request.intent_name,
+                'slots': request.raw_slots,
+                'slotToElicit': slot_to_elicit,
+                'message': _message(msg)
+            }
+        }
+
+    return {
+        'sessionState': {
+            'sessionAttributes': request.session_attributes,
+            'dialogAction': {
+                'slotToElicit': slot_to_elicit,
+                'type': 'ElicitSlot'
+            },
+            'intent': {
+                'confirmationState': 'Denied',
+                'name': request.intent_name,
+                'slots': request.raw_slots,
+                'state': 'InProgress'
+            }
+        },
+        'messages': [_message(msg)] if msg is not None else None
+    }
+
+
+def confirm_intent(request, msg):
+    '''Informs Amazon Lex that the user is expected to give a yes or no answer to confirm or deny the current intent'''
+
+    if request.version == V1:
+        return {
+            'sessionAttributes': request.session_attributes,
+            'dialogAction': {
+                'type': 'ConfirmIntent',
+                'intentName': request.intent_name,
+                'slots': request.raw_slots,
+                'message': _message(msg)
+            }
+        }
+
+    return {
+        'messages': [_message(msg)],
+        'sessionState': {
+            'sessionAttributes': request.session_attributes,
+            'dialogAction': {
+                'type': 'ConfirmIntent'
+            },
+            'intent': {
+                'name': request.intent_name,
+                'slots': request.raw_slots
+            }
+        }
+    }
+
+
+def delegate(request):
+    '''Directs Amazon Lex to choose the next course of action based on the bot configuration'''
+
+    if request.version == V1:
+        return {
+            'sessionAttributes': request.session_attributes,
+            'dialogAction': {
+                'type': 'Delegate',
+                'slots': request.raw_slots
+            }
+        }
+
+    return {
+        'sessionState': {
+            'sessionAttributes': request.session_attributes,
+            'dialogAction': {
+                'type': 'Delegate'
+            },
+            'intent': {
+                'name': request.intent_name,
+                'slots': request.raw_slots
+            }
+        }
+    }
+
+
+def elicit_intent(request, msg):
+    '''Informs Amazon Lex that the user is expected to respond with an utterance that includes an intent'''
+
+    if request.version == V1:
+        return {
+            'sessionAttributes': request.session_attributes,
+            'dialogAction': {
+                'type': 'ElicitIntent',
+                'message': _message(msg)
+            }
+        }
+
+    return {
+        'sessionState': {
+            'dialogAction': {
+                'type': 'ElicitIntent'
+            },
+            'sessionAttributes': request.session_attributes
+        },
+        'messages': [_message(msg)] if msg is not None else None
+    }
+
+
+def close(request, fulfillment_state, msg):
+    '''Informs Amazon Lex not to expect a response from the user'''
+
+    if request.version == V1:
+        return {
+            'sessionAttributes': request.session_attributes,
+            'dialogAction': {
+                'type': 'Close',
+                'fulfillmentState': fulfillment_state,
+                'message': _message(msg)
+            }
+        }
+
+    return {
+        'messages': [_message(msg)],
+        'sessionState': {
+            'dialogAction': {
+                'type': 'Close'
+            },
+            'sessionAttributes': request.session_attributes,
+            'intent': {
+                'confirmationState': 'Confirmed',
+                'name': request.intent_name,
+                'state': fulfillment_state
+            }
+        }
+    }
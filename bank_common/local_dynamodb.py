@@ -0,0 +1,1031 @@
+'''
+In-process DynamoDB emulator for benchmarks, load tests and offline runs.
+
+LocalDynamoDB answers the low-level client calls dynamo.Table makes (get_item, put_item,
+update_item, delete_item, query, scan, batch_write_item, batch_get_item) on in-memory tables,
+with the same wire format (AttributeValue dicts), condition / update / key condition / filter
+expressions, ProjectionExpression, pagination and ClientError codes as the service.
+
+Provisioned tables get a token bucket per capacity type: reads and writes are charged in
+capacity units computed from item sizes the way DynamoDB does, and a request arriving with an
+empty bucket fails with ProvisionedThroughputExceededException (batch calls return the excess
+as UnprocessedItems / UnprocessedKeys instead). A LatencyModel adds a sampled delay to every
+request, and max_attempts > 1 replays throttled requests with backoff like the SDK retry modes.
+
+Point the handlers at it with dynamo.set_client(), or for a whole process with
+
+    DYNAMODB_BACKEND=local DYNAMODB_LOCAL_CONFIG=benchmarks/local_dynamodb.json
+
+where the config file describes tables, capacity, seed data and latency (see from_config).
+'''
+
+import os
+import re
+import copy
+import json
+import math
+import time
+import zlib
+import random
+import threading
+from decimal import Decimal
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+from bank_common import dynamo
+
+
+def _error(code, message, operation, **extra):
+    return ClientError(dict({'Error': {'Code': code, 'Message': message}}, **extra), operation)
+
+
+def _validation(message, operation='Expression'):
+    return _error('ValidationException', message, operation)
+
+
+""" --- Expressions --- """
+
+
+_TOKEN_PATTERN = re.compile(r'''
+    \s*(?:
+        (?P<number>\d+)
+      | (?P<name>\#[A-Za-z0-9_]+)
+      | (?P<value>:[A-Za-z0-9_]+)
+      | (?P<op><>|<=|>=|=|<|>|\(|\)|\[|\]|,|\.|\+|-)
+      | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )''', re.VERBOSE)
+
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if match is None or match.end() == position:
+            raise _validation(f'Invalid expression near: {expression[position:]!r}')
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'word' and text.upper() in _KEYWORDS:
+            kind, text = 'keyword', text.upper()
+        tokens.append((kind, text))
+        position = match.end()
+
+    return tokens
+
+
+class _Parser:
+    '''Recursive descent parser shared by condition, update and projection expressions'''
+
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, text):
+        kind, found = self.next()
+        if found != text:
+            raise _validation(f'Expected {text!r}, found {found!r}')
+
+    def at_end(self):
+        return self.position >= len(self.tokens)
+
+    #path := name ('.' name | '[' number ']')*
+    def path(self):
+        kind, text = self.next()
+        if kind == 'name':
+            if text not in self.names:
+                raise _validation(f'An expression attribute name used in the document path is not defined: {text}')
+            text = self.names[text]
+        elif kind != 'word':
+            raise _validation(f'Expected an attribute name, found {text!r}')
+
+        elements = [text]
+        while self.peek()[1] in ('.', '['):
+            if self.next()[1] == '.':
+                kind, text = self.next()
+                elements.append(self.names[text] if kind == 'name' else text)
+            else:
+                elements.append(int(self.next()[1]))
+                self.expect(']')
+
+        return tuple(elements)
+
+    #operand := :value | size(path) | if_not_exists(...) | list_append(...) | path
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.next()
+            if text not in self.values:
+                raise _validation(f'An expression attribute value used in expression is not defined: {text}')
+            return ('value', self.values[text])
+        if kind == 'word' and self.peek(1)[1] == '(':
+            return self.function()
+
+        return ('path', self.path())
+
+    def function(self):
+        name = self.next()[1]
+        self.expect('(')
+        arguments = [self.operand()]
+        while self.peek()[1] == ',':
+            self.next()
+            arguments.append(self.operand())
+        self.expect(')')
+        return ('function', name, arguments)
+
+    #condition := and_condition ('OR' and_condition)*
+    def condition(self):
+        node = self.and_condition()
+        while self.peek()[1] == 'OR':
+            self.next()
+            node = ('or', node, self.and_condition())
+        return node
+
+    def and_condition(self):
+        node = self.not_condition()
+        while self.peek()[1] == 'AND':
+            self.next()
+            node = ('and', node, self.not_condition())
+        return node
+
+    def not_condition(self):
+        if self.peek()[1] == 'NOT':
+            self.next()
+            return ('not', self.not_condition())
+        return self.comparison()
+
+    def comparison(self):
+        if self.peek()[1] == '(':
+            self.next()
+            node = self.condition()
+            self.expect(')')
+            return node
+
+        left = self.operand()
+        if left[0] == 'function' and left[1] != 'size':
+            return left
+
+        kind, text = self.peek()
+        if text in ('=', '<>', '<', '<=', '>', '>='):
+            self.next()
+            return ('compare', text, left, self.operand())
+        if text == 'BETWEEN':
+            self.next()
+            low = self.operand()
+            self.expect('AND')
+            return ('between', left, low, self.operand())
+        if text == 'IN':
+            self.next()
+            self.expect('(')
+            options = [self.operand()]
+            while self.peek()[1] == ',':
+                self.next()
+                options.append(self.operand())
+            self.expect(')')
+            return ('in', left, options)
+
+        raise _validation(f'Invalid condition near {text!r}')
+
+    #update := (SET action, ... | REMOVE path, ... | ADD path value, ... | DELETE path value, ...)+
+    def update(self):
+        actions = []
+        while not self.at_end():
+            clause = self.next()[1]
+            if clause not in ('SET', 'REMOVE', 'ADD', 'DELETE'):
+                raise _validation(f'Invalid UpdateExpression near {clause!r}')
+            while True:
+                target = self.path()
+                if clause == 'SET':
+                    self.expect('=')
+                    value = self.operand()
+                    if self.peek()[1] in ('+', '-'):
+                        value = ('arithmetic', self.next()[1], value, self.operand())
+                    actions.append((clause, target, value))
+                elif clause == 'REMOVE':
+                    actions.append((clause, target, None))
+                else:
+                    actions.append((clause, target, self.operand()))
+                if self.peek()[1] != ',':
+                    break
+                self.next()
+
+        return actions
+
+    def projection(self):
+        paths = [self.path()]
+        while self.peek()[1] == ',':
+            self.next()
+            paths.append(self.path())
+        return paths
+
+
+def _resolve(item, path):
+    value = {'M': item}
+    for element in path:
+        if isinstance(element, int):
+            container = value.get('L')
+            if container is None or element >= len(container):
+                return None
+            value = container[element]
+        else:
+            container = value.get('M')
+            if container is None or element not in container:
+                return None
+            value = container[element]
+
+    return value
+
+
+def _number(attribute_value):
+    return Decimal(attribute_value['N'])
+
+
+def _comparable(attribute_value):
+    '''(type, python value) so only values of the same type compare'''
+
+    (type_code, value), = attribute_value.items()
+    if type_code == 'N':
+        return type_code, Decimal(value)
+    if type_code in ('SS', 'BS'):
+        return type_code, frozenset(value)
+    if type_code == 'NS':
+        return type_code, frozenset(Decimal(v) for v in value)
+    return type_code, value
+
+
+def _size(attribute_value):
+    (type_code, value), = attribute_value.items()
+    if type_code == 'S':
+        return len(value)
+    if type_code == 'B':
+        return len(value)
+    if type_code in ('L', 'M', 'SS', 'NS', 'BS'):
+        return len(value)
+    return None
+
+
+class Expression:
+    '''Evaluates a parsed expression against an item in wire format'''
+
+    def __init__(self, item):
+        self.item = item or {}
+
+    def operand(self, node):
+        kind = node[0]
+        if kind == 'value':
+            return node[1]
+        if kind == 'path':
+            return _resolve(self.item, node[1])
+        if kind == 'arithmetic':
+            left, right = self.operand(node[2]), self.operand(node[3])
+            if left is None or right is None or 'N' not in left or 'N' not in right:
+                raise _validation('An operand in the update expression has an incorrect data type')
+            result = _number(left) + _number(right) if node[1] == '+' else _number(left) - _number(right)
+            return {'N': str(result)}
+        if kind == 'function':
+            return self.function(node[1], node[2])
+
+        raise _validation(f'Unsupported operand {kind}')
+
+    def function(self, name, arguments):
+        if name == 'size':
+            value = self.operand(arguments[0])
+            size = _size(value) if value is not None else None
+            return {'N': str(size)} if size is not None else None
+        if name == 'if_not_exists':
+            value = self.operand(arguments[0])
+            return value if value is not None else self.operand(arguments[1])
+        if name == 'list_append':
+            first, second = self.operand(arguments[0]), self.operand(arguments[1])
+            return {'L': (first or {'L': []})['L'] + (second or {'L': []})['L']}
+        if name == 'attribute_exists':
+            return self.operand(arguments[0]) is not None
+        if name == 'attribute_not_exists':
+            return self.operand(arguments[0]) is None
+        if name == 'attribute_type':
+            value = self.operand(arguments[0])
+            return value is not None and next(iter(value)) == self.operand(arguments[1])['S']
+        if name == 'begins_with':
+            value, prefix = self.operand(arguments[0]), self.operand(arguments[1])
+            if value is None:
+                return False
+            (type_code, text), = value.items()
+            return type_code in ('S', 'B') and type_code in prefix and text.startswith(prefix[type_code])
+        if name == 'contains':
+            value, member = self.operand(arguments[0]), self.operand(arguments[1])
+            if value is None:
+                return False
+            (type_code, container), = value.items()
+            (member_type, member_value), = member.items()
+            if type_code == 'S':
+                return member_type == 'S' and member_value in container
+            if type_code in ('SS', 'NS', 'BS'):
+                return _comparable(member)[1] in _comparable(value)[1]
+            if type_code == 'L':
+                return member in container
+            return False
+
+        raise _validation(f'Invalid function name; function: {name}')
+
+    def evaluate(self, node):
+        kind = node[0]
+        if kind == 'and':
+            return self.evaluate(node[1]) and self.evaluate(node[2])
+        if kind == 'or':
+            return self.evaluate(node[1]) or self.evaluate(node[2])
+        if kind == 'not':
+            return not self.evaluate(node[1])
+        if kind == 'function':
+            return bool(self.function(node[1], node[2]))
+        if kind == 'compare':
+            return self.compare(node[1], self.operand(node[2]), self.operand(node[3]))
+        if kind == 'between':
+            value = self.operand(node[1])
+            return self.compare('>=', value, self.operand(node[2])) and self.compare('<=', value, self.operand(node[3]))
+        if kind == 'in':
+            value = self.operand(node[1])
+            return any(self.compare('=', value, self.operand(option)) for option in node[2])
+
+        raise _validation(f'Invalid condition {kind}')
+
+    @staticmethod
+    def compare(operator, left, right):
+        if left is None or right is None:
+            return operator == '<>' and (left is None) != (right is None)
+
+        left_type, left_value = _comparable(left)
+        right_type, right_value = _comparable(right)
+        if operator == '=':
+            return left_type == right_type and left_value == right_value
+        if operator == '<>':
+            return left_type != right_type or left_value != right_value
+        if left_type != right_type or left_type not in ('N', 'S', 'B'):
+            return False
+        if operator == '<':
+            return left_value < right_value
+        if operator == '<=':
+            return left_value <= right_value
+        if operator == '>':
+            return left_value > right_value
+        return left_value >= right_value
+
+
+def evaluate_condition(expression, item, names=None, values=None):
+    parser = _Parser(expression, names, values)
+    node = parser.condition()
+    if not parser.at_end():
+        raise _validation(f'Invalid ConditionExpression: unexpected {parser.peek()[1]!r}')
+    return Expression(item).evaluate(node)
+
+
+def _set_path(item, path, value):
+    container = {'M': item}
+    for element in path[:-1]:
+        container = container['M'][element] if isinstance(element, str) else container['L'][element]
+
+    last = path[-1]
+    if isinstance(last, int):
+        elements = container['L']
+        if last < len(elements):
+            elements[last] = value
+        else:
+            elements.append(value)
+    else:
+        container['M'][last] = value
+
+
+def _remove_path(item, path):
+    parent = _resolve(item, path[:-1]) if len(path) > 1 else {'M': item}
+    if parent is None:
+        return
+    last = path[-1]
+    if isinstance(last, int):
+        if 'L' in parent and last < len(parent['L']):
+            del parent['L'][last]
+    else:
+        parent.get('M', {}).pop(last, None)
+
+
+def apply_update(expression, item, names=None, values=None):
+    '''Applies an UpdateExpression to item (wire format) in place'''
+
+    evaluator = Expression(item)
+    for clause, path, operand in _Parser(expression, names, values).update():
+        if clause == 'SET':
+            _set_path(item, path, evaluator.operand(operand))
+        elif clause == 'REMOVE':
+            _remove_path(item, path)
+        elif clause == 'ADD':
+            current, value = _resolve(item, path), evaluator.operand(operand)
+            if 'N' in value:
+                total = (_number(current) if current else Decimal(0)) + _number(value)
+                _set_path(item, path, {'N': str(total)})
+            else:
+                (type_code, members), = value.items()
+                existing = current[type_code] if current else []
+                _set_path(item, path, {type_code: existing + [m for m in members if m not in existing]})
+        elif clause == 'DELETE':
+            current, value = _resolve(item, path), evaluator.operand(operand)
+            if current:
+                (type_code, members), = value.items()
+                remaining = [m for m in current[type_code] if m not in members]
+                if remaining:
+                    _set_path(item, path, {type_code: remaining})
+                else:
+                    _remove_path(item, path)
+
+
+def project(item, expression, names=None):
+    '''Applies a ProjectionExpression; a nested path returns its whole top level attribute'''
+
+    projected = {}
+    for path in _Parser(expression, names, None).projection():
+        if _resolve(item, path) is not None:
+            projected[path[0]] = item[path[0]]
+
+    return projected
+
+
+""" --- Capacity and latency --- """
+
+
+THROUGHPUT_EXCEEDED = (
+    'The level of configured provisioned throughput for the table was exceeded. '
+    'Consider increasing your provisioning level with the UpdateTable API.'
+)
+
+#DynamoDB caps a Query/Scan page at 1 MB of items read
+PAGE_BYTES = 1024 * 1024
+
+
+def _value_size(attribute_value):
+    (type_code, value), = attribute_value.items()
+    if type_code == 'S':
+        return len(value.encode())
+    if type_code == 'N':
+        return (len(value.lstrip('-').replace('.', '')) + 1) // 2 + 1
+    if type_code == 'B':
+        return len(value)
+    if type_code in ('BOOL', 'NULL'):
+        return 1
+    if type_code == 'SS':
+        return sum(len(v.encode()) for v in value)
+    if type_code == 'NS':
+        return sum((len(v.lstrip('-').replace('.', '')) + 1) // 2 + 1 for v in value)
+    if type_code == 'BS':
+        return sum(len(v) for v in value)
+    if type_code == 'L':
+        return 3 + sum(_value_size(v) + 1 for v in value)
+    return 3 + sum(len(k.encode()) + _value_size(v) + 1 for k, v in value.items())
+
+
+def item_size(item):
+    '''Approximate stored size of an item in bytes (attribute names plus values)'''
+
+    return sum(len(name.encode()) + _value_size(value) for name, value in (item or {}).items())
+
+
+def read_units(size, consistent):
+    units = max(math.ceil(size / 4096), 1)
+    return units if consistent else units / 2
+
+
+def write_units(size):
+    return max(math.ceil(size / 1024), 1)
+
+
+class TokenBucket:
+    '''
+    Provisioned capacity of one table: refills at rate units per second and holds up to
+    burst_seconds of unused capacity. A request is admitted while the bucket is not empty and
+    is then charged in full, so the bucket can briefly go negative like the service's.
+    '''
+
+    def __init__(self, rate, burst_seconds=300, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = rate * max(burst_seconds, 1)
+        self.tokens = self.capacity
+        self.clock = clock
+        self._updated = clock()
+        self.consumed = 0.0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self):
+        self._refill()
+        return self.tokens
+
+    def consume(self, units):
+        '''Charges units and returns True, or False when the bucket is empty'''
+
+        self._refill()
+        if self.tokens <= 0:
+            return False
+        self.tokens -= units
+        self.consumed += units
+        return True
+
+
+class LatencyModel:
+    '''
+    Request latency distribution, in milliseconds:
+
+        fixed      value_ms
+        uniform    low_ms .. high_ms
+        lognormal  median_ms, sigma (long tail, closest to real DynamoDB latency)
+        normal     mean_ms, stddev_ms (clipped at 0)
+
+    operations maps an operation name (GetItem, Query, ...) to its own LatencyModel.
+    '''
+
+    def __init__(self, distribution='fixed', value_ms=0.0, low_ms=0.0, high_ms=0.0, median_ms=0.0,
+                 sigma=0.5, mean_ms=0.0, stddev_ms=0.0, operations=None, seed=None):
+        if distribution not in ('fixed', 'uniform', 'lognormal', 'normal'):
+            raise ValueError(f'Unknown latency distribution {distribution}')
+        self.distribution = distribution
+        self.value_ms = value_ms
+        self.low_ms = low_ms
+        self.high_ms = high_ms
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.mean_ms = mean_ms
+        self.stddev_ms = stddev_ms
+        self.operations = operations or {}
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_config(cls, config, seed=None):
+        config = dict(config)
+        operations = {name: cls.from_config(spec, seed) for name, spec in config.pop('operations', {}).items()}
+        return cls(operations=operations, seed=seed, **config)
+
+    def sample_ms(self, operation=None):
+        if operation in self.operations:
+            return self.operations[operation].sample_ms()
+        if self.distribution == 'uniform':
+            return self._random.uniform(self.low_ms, self.high_ms)
+        if self.distribution == 'lognormal':
+            return self.median_ms * math.exp(self._random.gauss(0, self.sigma)) if self.median_ms else 0.0
+        if self.distribution == 'normal':
+            return max(self._random.gauss(self.mean_ms, self.stddev_ms), 0.0)
+        return self.value_ms
+
+
+""" --- Client --- """
+
+
+class LocalTable:
+    '''Items of one table keyed by their (hash, range) key values, plus its capacity buckets'''
+
+    def __init__(self, name, hash_key, range_key=None, indexes=None, read_bucket=None, write_bucket=None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {} #index name -> (hash key, range key or None)
+        self.read_bucket = read_bucket
+        self.write_bucket = write_bucket
+        self.items = {}
+
+    @property
+    def key_names(self):
+        return (self.hash_key,) if self.range_key is None else (self.hash_key, self.range_key)
+
+    def key_of(self, item, operation):
+        key = []
+        for name in self.key_names:
+            if name not in item:
+                raise _validation(f'One of the required keys was not given a value: {name}', operation)
+            key.append(_comparable(item[name]))
+        return tuple(key)
+
+    def key_item(self, item):
+        return {name: item[name] for name in self.key_names}
+
+    def charge_read(self, units, operation):
+        if self.read_bucket is not None and not self.read_bucket.consume(units):
+            raise _error('ProvisionedThroughputExceededException', THROUGHPUT_EXCEEDED, operation)
+
+    def charge_write(self, units, operation):
+        if self.write_bucket is not None and not self.write_bucket.consume(units):
+            raise _error('ProvisionedThroughputExceededException', THROUGHPUT_EXCEEDED, operation)
+
+    def consumed_capacity(self, units, kwargs):
+        if kwargs.get('ReturnConsumedCapacity', 'NONE') == 'NONE':
+            return {}
+        return {'ConsumedCapacity': {'TableName': self.name, 'CapacityUnits': units}}
+
+
+class LocalDynamoDB:
+    '''
+    Low-level DynamoDB client stand-in. self.calls counts client calls per operation (what the
+    handlers asked for) and self.attempts counts requests including simulated SDK retries.
+    '''
+
+    def __init__(self, latency=None, max_attempts=1, clock=time.monotonic, sleep=time.sleep, seed=None):
+        self.tables = {}
+        self.latency = latency
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.sleep = sleep
+        self.calls = Counter()
+        self.attempts = Counter()
+        self.throttles = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_config(cls, config, base_dir='.'):
+        '''
+        Builds an emulator from a dict (or a JSON file path):
+
+            {
+              "max_attempts": 3,
+              "seed": 1,
+              "latency": {"distribution": "lognormal", "median_ms": 4, "sigma": 0.4,
+                          "operations": {"Scan": {"distribution": "fixed", "value_ms": 20}}},
+              "tables": {
+                "BankAccounts": {"hash_key": "AccountNumber", "read_capacity": 5, "write_capacity": 5,
+                                 "burst_seconds": 300, "items": "Bank_Contact_Flow/finalbankdata.json",
+                                 "indexes": {"PhoneNumberIndex": {"hash_key": "PhoneNumber"}}}
+              }
+            }
+
+        Tables without read_capacity / write_capacity are on-demand (never throttled). Seed
+        item files are resolved relative to base_dir.
+        '''
+
+        if isinstance(config, str):
+            base_dir = os.path.dirname(os.path.abspath(config))
+            with open(config) as f:
+                config = json.load(f)
+
+        seed = config.get('seed')
+        latency = config.get('latency')
+        if isinstance(latency, dict):
+            latency = LatencyModel.from_config(latency, seed)
+        emulator = cls(latency=latency, max_attempts=config.get('max_attempts', 1), seed=seed)
+
+        for name, spec in config.get('tables', {}).items():
+            emulator.create_table(
+                name, spec['hash_key'], spec.get('range_key'),
+                read_capacity=spec.get('read_capacity'), write_capacity=spec.get('write_capacity'),
+                burst_seconds=spec.get('burst_seconds', 300),
+                indexes={index: (index_spec['hash_key'], index_spec.get('range_key')) for index, index_spec in spec.get('indexes', {}).items()}
+            )
+            if spec.get('items'):
+                with open(os.path.join(base_dir, spec['items'])) as f:
+                    emulator.load(name, json.load(f))
+
+        return emulator
+
+    def create_table(self, name, hash_key, range_key=None, read_capacity=None, write_capacity=None,
+                     burst_seconds=300, indexes=None):
+        read_bucket = TokenBucket(read_capacity, burst_seconds, self.clock) if read_capacity else None
+        write_bucket = TokenBucket(write_capacity, burst_seconds, self.clock) if write_capacity else None
+        self.tables[name] = LocalTable(name, hash_key, range_key, indexes, read_bucket, write_bucket)
+        return self.tables[name]
+
+    def load(self, name, items):
+        '''Seeds a table with plain Python items (floats converted to Decimal), free of charge'''
+
+        table = self.tables[name]
+        for item in items:
+            item = {k: Decimal(str(v)) if isinstance(v, float) else v for k, v in item.items()}
+            wire = dynamo.serialize_item(item)
+            table.items[table.key_of(wire, 'Load')] = wire
+
+    def reset_calls(self):
+        self.calls.clear()
+        self.attempts.clear()
+        self.throttles.clear()
+
+    def consumed(self):
+        '''Capacity units consumed so far per table, {"table": {"read": .., "write": ..}}'''
+
+        return {
+            name: {
+                'read': table.read_bucket.consumed if table.read_bucket else None,
+                'write': table.write_bucket.consumed if table.write_bucket else None,
+            }
+            for name, table in self.tables.items()
+        }
+
+    def _table(self, name, operation):
+        table = self.tables.get(name)
+        if table is None:
+            raise _error('ResourceNotFoundException', 'Requested resource not found', operation)
+        return table
+
+    def _invoke(self, operation, request):
+        '''
+        Runs one client call: injected latency per attempt (outside the lock, so concurrent
+        callers overlap like real network calls) and SDK-style retries of throttled attempts.
+        '''
+
+        self.calls[operation] += 1
+        for attempt in range(self.max_attempts):
+            self.attempts[operation] += 1
+            if self.latency is not None:
+                self.sleep(self.latency.sample_ms(operation) / 1000)
+            try:
+                with self._lock:
+                    response = request()
+            except ClientError as err:
+                if err.response['Error']['Code'] != 'ProvisionedThroughputExceededException':
+                    raise
+                self.throttles[operation] += 1
+                if attempt + 1 >= self.max_attempts:
+                    err.response.setdefault('ResponseMetadata', {})['RetryAttempts'] = attempt
+                    raise
+                #Full jitter exponential backoff, as in the SDK standard retry mode
+                self.sleep(self._random.uniform(0, min(0.025 * 2 ** attempt, 20)))
+                continue
+
+            response['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': attempt}
+            return response
+
+    @staticmethod
+    def _check(kwargs, item, operation):
+        condition = kwargs.get('ConditionExpression')
+        if condition and not evaluate_condition(
+            condition, item, kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')
+        ):
+            extra = {}
+            if kwargs.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and item:
+                extra['Item'] = copy.deepcopy(item)
+            raise _error('ConditionalCheckFailedException', 'The conditional request failed', operation, **extra)
+
+    @staticmethod
+    def _return_values(kwargs, old, new):
+        return_values = kwargs.get('ReturnValues', 'NONE')
+        if return_values == 'ALL_OLD' and old:
+            return {'Attributes': copy.deepcopy(old)}
+        if return_values == 'ALL_NEW' and new:
+            return {'Attributes': copy.deepcopy(new)}
+        if return_values in ('UPDATED_OLD', 'UPDATED_NEW'):
+            source, other = (old, new) if return_values == 'UPDATED_OLD' else (new, old)
+            changed = {k: v for k, v in (source or {}).items() if (other or {}).get(k) != v}
+            return {'Attributes': copy.deepcopy(changed)} if changed else {}
+        return {}
+
+    """ --- Single item operations --- """
+
+    def get_item(self, TableName, Key, **kwargs):
+
+        def request():
+            table = self._table(TableName, 'GetItem')
+            item = table.items.get(table.key_of(Key, 'GetItem'))
+            units = read_units(item_size(item), kwargs.get('ConsistentRead', False))
+            table.charge_read(units, 'GetItem')
+
+            response = table.consumed_capacity(units, kwargs)
+            if item is not None:
+                if kwargs.get('ProjectionExpression'):
+                    item = project(item, kwargs['ProjectionExpression'], kwargs.get('ExpressionAttributeNames'))
+                response['Item'] = copy.deepcopy(item)
+            return response
+
+        return self._invoke('GetItem', request)
+
+    def put_item(self, TableName, Item, **kwargs):
+
+        def request():
+            table = self._table(TableName, 'PutItem')
+            key = table.key_of(Item, 'PutItem')
+            old = table.items.get(key)
+            units = write_units(max(item_size(old), item_size(Item)))
+            table.charge_write(units, 'PutItem')
+
+            self._check(kwargs, old, 'PutItem')
+            table.items[key] = copy.deepcopy(Item)
+            return dict(self._return_values(kwargs, old, None), **table.consumed_capacity(units, kwargs))
+
+        return self._invoke('PutItem', request)
+
+    def update_item(self, TableName, Key, **kwargs):
+
+        def request():
+            table = self._table(TableName, 'UpdateItem')
+            key = table.key_of(Key, 'UpdateItem')
+            old = table.items.get(key)
+
+            new = copy.deepcopy(old) if old is not None else copy.deepcopy(Key)
+            if kwargs.get('UpdateExpression'):
+                apply_update(
+                    kwargs['UpdateExpression'], new,
+                    kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')
+                )
+            units = write_units(max(item_size(old), item_size(new)))
+            table.charge_write(units, 'UpdateItem')
+
+            self._check(kwargs, old, 'UpdateItem')
+            table.items[key] = new
+            return dict(self._return_values(kwargs, old, new), **table.consumed_capacity(units, kwargs))
+
+        return self._invoke('UpdateItem', request)
+
+    def delete_item(self, TableName, Key, **kwargs):
+
+        def request():
+            table = self._table(TableName, 'DeleteItem')
+            key = table.key_of(Key, 'DeleteItem')
+            old = table.items.get(key)
+            units = write_units(item_size(old))
+            table.charge_write(units, 'DeleteItem')
+
+            self._check(kwargs, old, 'DeleteItem')
+            table.items.pop(key, None)
+            return dict(self._return_values(kwargs, old, None), **table.consumed_capacity(units, kwargs))
+
+        return self._invoke('DeleteItem', request)
+
+    """ --- Query and scan --- """
+
+    @staticmethod
+    def _page(table, candidates, kwargs, operation, key_names):
+        '''Shared Query/Scan paging: ExclusiveStartKey, Limit, 1 MB pages, filter, projection, COUNT'''
+
+        if kwargs.get('ExclusiveStartKey'):
+            start = tuple(_comparable(kwargs['ExclusiveStartKey'][name]) for name in key_names)
+            positions = [tuple(_comparable(item[name]) for name in key_names) for item in candidates]
+            candidates = candidates[positions.index(start) + 1:] if start in positions else []
+
+        limit = kwargs.get('Limit')
+        evaluated, read_bytes, last_key = [], 0, None
+        for item in candidates:
+            if limit is not None and len(evaluated) >= limit or read_bytes >= PAGE_BYTES:
+                last_key = evaluated[-1]
+                break
+            evaluated.append(item)
+            read_bytes += item_size(item)
+        if last_key is not None:
+            last_key = {name: last_key[name] for name in dict.fromkeys(key_names + table.key_names)}
+
+        units = read_units(read_bytes, kwargs.get('ConsistentRead', False))
+        table.charge_read(units, operation)
+
+        names, values = kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')
+        matched = evaluated
+        if kwargs.get('FilterExpression'):
+            matched = [item for item in evaluated if evaluate_condition(kwargs['FilterExpression'], item, names, values)]
+
+        response = dict(Count=len(matched), ScannedCount=len(evaluated), **table.consumed_capacity(units, kwargs))
+        if kwargs.get('Select') != 'COUNT':
+            if kwargs.get('ProjectionExpression'):
+                matched = [project(item, kwargs['ProjectionExpression'], names) for item in matched]
+            response['Items'] = copy.deepcopy(matched)
+        if last_key is not None:
+            response['LastEvaluatedKey'] = copy.deepcopy(last_key)
+        return response
+
+    def query(self, TableName, KeyConditionExpression, **kwargs):
+
+        def request():
+            table = self._table(TableName, 'Query')
+            index = kwargs.get('IndexName')
+            if index is not None and index not in table.indexes:
+                raise _validation(f'The table does not have the specified index: {index}', 'Query')
+            hash_key, range_key = table.indexes[index] if index else (table.hash_key, table.range_key)
+            key_names = tuple(name for name in (hash_key, range_key) if name) + (table.key_names if index else ())
+
+            names, values = kwargs.get('ExpressionAttributeNames'), kwargs.get('ExpressionAttributeValues')
+            candidates = [
+                item for item in table.items.values()
+                if hash_key in item and evaluate_condition(KeyConditionExpression, item, names, values)
+            ]
+            if range_key:
+                candidates.sort(key=lambda item: _comparable(item[range_key]) if range_key in item else ('', ''))
+            if not kwargs.get('ScanIndexForward', True):
+                candidates.reverse()
+
+            return self._page(table, candidates, kwargs, 'Query', key_names)
+
+        return self._invoke('Query', request)
+
+    def scan(self, TableName, **kwargs):
+
+        def request():
+            table = self._table(TableName, 'Scan')
+            index = kwargs.get('IndexName')
+            candidates = list(table.items.values())
+            if index is not None:
+                candidates = [item for item in candidates if table.indexes[index][0] in item]
+
+            #Parallel scan: every item belongs to one segment, chosen by its partition key
+            total_segments = kwargs.get('TotalSegments')
+            if total_segments:
+                segment = kwargs['Segment']
+                candidates = [
+                    item for item in candidates
+                    if zlib.crc32(json.dumps(item[table.hash_key], sort_keys=True).encode()) % total_segments == segment
+                ]
+
+            key_names = table.key_names if index is None else tuple(n for n in table.indexes[index] if n) + table.key_names
+            return self._page(table, candidates, kwargs, 'Scan', key_names)
+
+        return self._invoke('Scan', request)
+
+    """ --- Batch operations --- """
+
+    def batch_write_item(self, RequestItems, **kwargs):
+
+        def request():
+            if sum(len(requests) for requests in RequestItems.values()) > 25:
+                raise _validation('Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+
+            unprocessed, written, consumed = {}, 0, {}
+            for name, requests in RequestItems.items():
+                table = self._table(name, 'BatchWriteItem')
+                for request_item in requests:
+                    if 'PutRequest' in request_item:
+                        item = request_item['PutRequest']['Item']
+                        key = table.key_of(item, 'BatchWriteItem')
+                        units = write_units(max(item_size(item), item_size(table.items.get(key))))
+                    else:
+                        key = table.key_of(request_item['DeleteRequest']['Key'], 'BatchWriteItem')
+                        units = write_units(item_size(table.items.get(key)))
+
+                    #Items over the table's budget come back unprocessed instead of failing the call
+                    if table.write_bucket is not None and not table.write_bucket.consume(units):
+                        unprocessed.setdefault(name, []).append(request_item)
+                        continue
+                    written += 1
+                    consumed[name] = consumed.get(name, 0) + units
+                    if 'PutRequest' in request_item:
+                        table.items[key] = copy.deepcopy(request_item['PutRequest']['Item'])
+                    else:
+                        table.items.pop(key, None)
+
+            if unprocessed and not written:
+                raise _error('ProvisionedThroughputExceededException', THROUGHPUT_EXCEEDED, 'BatchWriteItem')
+            response = {'UnprocessedItems': unprocessed}
+            if kwargs.get('ReturnConsumedCapacity', 'NONE') != 'NONE':
+                response['ConsumedCapacity'] = [{'TableName': name, 'CapacityUnits': units} for name, units in consumed.items()]
+            return response
+
+        return self._invoke('BatchWriteItem', request)
+
+    def batch_get_item(self, RequestItems, **kwargs):
+
+        def request():
+            if sum(len(request_item['Keys']) for request_item in RequestItems.values()) > 100:
+                raise _validation('Too many items requested for the BatchGetItem call', 'BatchGetItem')
+
+            responses, unprocessed, read = {}, {}, 0
+            for name, request_item in RequestItems.items():
+                table = self._table(name, 'BatchGetItem')
+                found = responses[name] = []
+                for key in request_item['Keys']:
+                    item = table.items.get(table.key_of(key, 'BatchGetItem'))
+                    units = read_units(item_size(item), request_item.get('ConsistentRead', False))
+                    if table.read_bucket is not None and not table.read_bucket.consume(units):
+                        pending = unprocessed.setdefault(name, dict(request_item, Keys=[]))
+                        pending['Keys'].append(key)
+                        continue
+                    read += 1
+                    if item is None:
+                        continue
+                    if request_item.get('ProjectionExpression'):
+                        item = project(item, request_item['ProjectionExpression'], request_item.get('ExpressionAttributeNames'))
+                    found.append(copy.deepcopy(item))
+
+            if unprocessed and not read:
+                raise _error('ProvisionedThroughputExceededException', THROUGHPUT_EXCEEDED, 'BatchGetItem')
+            return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+        return self._invoke('BatchGetItem', request)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared(config_path=None):
+    '''
+    The process-wide emulator used when DYNAMODB_BACKEND=local, built once from
+    DYNAMODB_LOCAL_CONFIG (or config_path); every region shares its tables.
+    '''
+
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            config_path = config_path or os.environ.get('DYNAMODB_LOCAL_CONFIG')
+            _shared = LocalDynamoDB.from_config(config_path) if config_path else LocalDynamoDB()
+    return _shared
@@ -0,0 +1,202 @@
+'''
+Level-gated, structured and PII-redacting logging for the Lambda handlers.
+
+Configured from the environment:
+
+    LOG_LEVEL              - level outside sampled conversations (default INFO)
+    LOG_FORMAT             - 'json' (default) for one JSON object per line, 'text' for plain lines
+    LOG_DEBUG_SAMPLE_RATE  - N > 0 turns on DEBUG detail for 1 in N conversations (default 0, never)
+
+Handlers log with lazy %-style arguments so nothing is formatted unless the record is emitted,
+and wrap each call in invocation() which writes a single summary line per invocation. Pins,
+SSNs, account and card numbers are redacted from structured fields and messages.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import logging
+import contextvars
+from contextlib import contextmanager
+
+
+#Keys whose values are never logged; account/card numbers keep their last four digits
+SECRET_KEYS = frozenset({'pin', 'ssn'})
+MASKED_KEYS = frozenset({
+    'accountnumber', 'checkingaccountnumber', 'checking account number', 'cardnumber', 'card number',
+    'phone-number', 'phonenumber', 'phone number', 'customernumber'
+})
+
+_PIN_PATTERN = re.compile(r"(?i)((?:'|\")?\b(?:pin|ssn)\b(?:'|\")?(?:\s*[=:]\s*|\s+(?:number\s+|is\s+)?)(?:'|\")?)(\d+)")
+_LONG_NUMBER_PATTERN = re.compile(r'\b\d{6,}(\d{4})\b')
+
+_configured = False
+_base_level = logging.INFO
+_sample_rate = 0
+#Summary of the invocation running in this thread / context
+_current = contextvars.ContextVar('log_summary', default=None)
+
+
+def _mask(value):
+    text = str(value)
+    return '*' * max(len(text) - 4, 0) + text[-4:]
+
+
+def redact(value):
+    '''Returns a copy of value with PII removed from dict keys listed above'''
+
+    if isinstance(value, dict):
+        redacted = {}
+        for key, item in value.items():
+            normalized = str(key).lower()
+            if normalized in SECRET_KEYS and item is not None:
+                redacted[key] = '****'
+            elif normalized in MASKED_KEYS and item is not None and not isinstance(item, dict):
+                redacted[key] = _mask(item)
+            elif normalized in MASKED_KEYS and isinstance(item, dict):
+                redacted[key] = redact_slot(item)
+            else:
+                redacted[key] = redact(item)
+        return redacted
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+
+    return value
+
+
+def redact_slot(slot):
+    '''Lex V2 slot structures carry the value in several places, mask all of them'''
+
+    value = slot.get('value') or {}
+    masked = {k: _mask(v) if isinstance(v, str) else ['****' for _ in v] for k, v in value.items()}
+    return dict(slot, value=masked)
+
+
+def redact_text(text):
+    '''Masks pins/SSNs written as key=value or in prose ('the pin 1234') and any long digit run in free text'''
+
+    text = _PIN_PATTERN.sub(lambda match: match.group(1) + '****', text)
+    return _LONG_NUMBER_PATTERN.sub(lambda match: '*' * (len(match.group(0)) - 4) + match.group(1), text)
+
+
+class RedactingFilter(logging.Filter):
+    '''Redacts dict arguments before they are formatted into the message'''
+
+    def filter(self, record):
+        if isinstance(record.args, dict):
+            record.args = redact(record.args)
+        elif record.args:
+            record.args = tuple(redact(arg) if isinstance(arg, (dict, list, tuple)) else arg for arg in record.args)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    '''One JSON object per record; structured fields travel in record.fields'''
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact_text(record.getMessage()),
+        }
+        request_id = getattr(record, 'aws_request_id', None)
+        if request_id:
+            entry['requestId'] = request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    def format(self, record):
+        text = redact_text(super().format(record))
+        fields = getattr(record, 'fields', None)
+        return f'{text} {json.dumps(redact(fields), default=str)}' if fields else text
+
+
+def configure():
+    '''Configures the root logger once per container and returns it'''
+
+    global _configured, _base_level, _sample_rate
+
+    root = logging.getLogger()
+    if _configured:
+        return root
+
+    level_name = os.environ.get('LOG_LEVEL') or os.environ.get('AWS_LAMBDA_LOG_LEVEL') or 'INFO'
+    _base_level = logging.getLevelName(level_name.upper())
+    if not isinstance(_base_level, int):
+        _base_level = logging.INFO
+    _sample_rate = int(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0))
+
+    if os.environ.get('LOG_FORMAT', 'json').lower() == 'text':
+        formatter = TextFormatter('[%(levelname)s] %(name)s %(message)s')
+    else:
+        formatter = JsonFormatter()
+
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler(sys.stdout))
+    for handler in root.handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(RedactingFilter())
+
+    #SDK debug output includes request bodies (keys, phone numbers), keep it out of sampled DEBUG
+    for name in ('botocore', 'boto3', 'urllib3'):
+        logging.getLogger(name).setLevel(max(_base_level, logging.WARNING))
+
+    root.setLevel(_base_level)
+    _configured = True
+
+    return root
+
+
+def is_sampled(conversation_id):
+    '''Deterministic 1-in-N choice so every turn of a sampled conversation logs DEBUG detail'''
+
+    if _sample_rate <= 0 or conversation_id is None:
+        return False
+    return zlib.crc32(str(conversation_id).encode()) % _sample_rate == 0
+
+
+def annotate(**fields):
+    '''Adds fields to the summary line of the current invocation'''
+
+    summary = _current.get()
+    if summary is not None:
+        summary.update(fields)
+
+
+@contextmanager
+def invocation(conversation_id=None, **fields):
+    '''
+    Wraps one Lambda invocation: raises the level to DEBUG for sampled conversations and
+    writes a single summary line (fields, outcome annotations, duration) when it ends.
+    '''
+
+    root = configure()
+    sampled = is_sampled(conversation_id)
+    if sampled:
+        root.setLevel(logging.DEBUG)
+
+    summary = dict(fields, sampled=sampled)
+    token = _current.set(summary)
+    start = time.perf_counter()
+    try:
+        yield summary
+    except Exception:
+        summary['error'] = True
+        raise
+    finally:
+        summary['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        _current.reset(token)
+        root.setLevel(_base_level)
+        root.info('invocation', extra={'fields': summary})
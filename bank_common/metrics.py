@@ -0,0 +1,207 @@
+'''
+CloudWatch Embedded Metric Format (EMF) metrics for the Lambda handlers.
+
+Every invocation collects its metrics in memory and writes a single EMF JSON blob when it
+ends, dimensioned by intent name, code hook source and cold-start flag. CloudWatch Logs turns
+the blob into metrics without any PutMetricData calls on the request path.
+
+Configured from the environment:
+
+    METRICS_NAMESPACE  - CloudWatch namespace (default BankBot)
+    METRICS_OUTPUT     - 'stdout' (default), 'off', or a file path the blobs are appended to
+
+dynamo.Table reports every DynamoDB call here: per-operation call counts and latencies,
+retries, throttles and unprocessed batch items.
+'''
+
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+DEFAULT_NAMESPACE = 'BankBot'
+
+#EMF accepts at most 100 values per metric in one blob
+MAX_VALUES = 100
+
+THROTTLE_CODES = frozenset({
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'
+})
+
+_cold_start = True
+#Per thread / context, several invocations may run at once in one process (tests, load tests)
+_current = contextvars.ContextVar('metrics', default=None)
+_output = None
+_output_lock = threading.Lock()
+
+
+class InvocationMetrics:
+    '''Counters, timings and dimensions collected during one invocation'''
+
+    def __init__(self, namespace, dimensions):
+        self.namespace = namespace
+        self.dimensions = dimensions
+        self.properties = {}
+        self._counters = {} #name -> total
+        self._timings = {} #name -> [milliseconds]
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def timing(self, name, elapsed_ms):
+        with self._lock:
+            self._timings.setdefault(name, []).append(round(elapsed_ms, 3))
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def to_emf(self, timestamp_ms=None):
+        '''The EMF document: metric values and dimensions are top level members'''
+
+        with self._lock:
+            definitions = [{'Name': name, 'Unit': 'Count'} for name in self._counters]
+            definitions += [{'Name': name, 'Unit': 'Milliseconds'} for name in self._timings]
+
+            document = {
+                '_aws': {
+                    'Timestamp': int(timestamp_ms if timestamp_ms is not None else time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [list(self.dimensions)],
+                        'Metrics': definitions
+                    }]
+                }
+            }
+            document.update(self.properties)
+            document.update(self.dimensions)
+            document.update(self._counters)
+            #One value per call so CloudWatch can compute percentiles; the count metric stays exact
+            document.update({name: values[:MAX_VALUES] for name, values in self._timings.items()})
+
+        return document
+
+
+""" --- Output --- """
+
+
+def set_output(output):
+    '''
+    Redirects the blobs: a writable stream, a file path, or None to go back to METRICS_OUTPUT.
+    Useful for tests and local replays.
+    '''
+
+    global _output
+    _output = output
+
+
+def _write(document):
+
+    line = json.dumps(document, separators=(',', ':'), default=str) + '\n'
+    output = _output if _output is not None else os.environ.get('METRICS_OUTPUT', 'stdout')
+
+    with _output_lock:
+        if hasattr(output, 'write'):
+            output.write(line)
+        elif output == 'stdout':
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        elif output != 'off':
+            with open(output, 'a') as f:
+                f.write(line)
+
+
+""" --- Recording --- """
+
+
+def is_cold_start():
+    '''True until the first invocation of this container has started'''
+
+    return _cold_start
+
+
+def current():
+    return _current.get()
+
+
+def set_dimensions(**dimensions):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.dimensions.update({k: str(v) for k, v in dimensions.items()})
+
+
+def set_property(**properties):
+    '''Adds searchable, non-metric fields (e.g. outcome) to the blob'''
+
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.properties.update(properties)
+
+
+def count(name, value=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def timing(name, elapsed_ms):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.timing(name, elapsed_ms)
+
+
+def record_dynamodb(operation, elapsed_ms, error_code=None, retries=0, unprocessed=0):
+    '''One DynamoDB request, called by dynamo.Table around every client call'''
+
+    #Threads started outside the invocation have no metrics to record into
+    metrics = _current.get()
+    if metrics is None:
+        return
+
+    metrics.count('DynamoDBCalls')
+    metrics.count(f'DynamoDB.{operation}.Calls')
+    metrics.timing(f'DynamoDB.{operation}.Latency', elapsed_ms)
+    if retries:
+        metrics.count('DynamoDBRetries', retries)
+    if unprocessed:
+        metrics.count('DynamoDBUnprocessedItems', unprocessed)
+    if error_code in THROTTLE_CODES:
+        metrics.count('DynamoDBThrottles')
+    elif error_code is not None:
+        metrics.count('DynamoDBErrors')
+
+
+@contextmanager
+def invocation(namespace=None, **dimensions):
+    '''
+    Wraps one Lambda invocation and writes its EMF blob when it ends. Dimensions given here
+    (e.g. Intent, Source) can be refined later with set_dimensions(); ColdStart is added.
+    '''
+
+    global _cold_start
+
+    cold_start = _cold_start
+    _cold_start = False
+
+    dimensions = {k: str(v) for k, v in dimensions.items()}
+    dimensions['ColdStart'] = 'true' if cold_start else 'false'
+    metrics = InvocationMetrics(namespace or os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE), dimensions)
+    metrics.count('Invocations')
+    metrics.count('ColdStarts', int(cold_start))
+
+    token = _current.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    except Exception:
+        metrics.count('Errors')
+        raise
+    finally:
+        metrics.timing('InvocationLatency', (time.perf_counter() - start) * 1000)
+        _current.reset(token)
+        _write(metrics.to_emf())
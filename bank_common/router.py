@@ -0,0 +1,161 @@
+'''
+Table-driven intent router for the Lex code hooks.
+
+Handlers register per intent and per invocation source (DialogCodeHook / FulfillmentCodeHook).
+Every dispatch is timed and counted per intent, source and outcome, and the outcome is added to
+the invocation's summary log line and EMF metrics, so the intent and hook that dominate Lambda duration are
+visible. Unregistered intents get a fast Failed response instead of raising or returning None,
+and a handler that runs out of its time budget (bank_common.deadline) gets the router's
+fallback response instead of letting Lex time the invocation out.
+'''
+
+import time
+import logging
+import threading
+
+from bank_common import deadline, lex, log, metrics
+
+
+logger = logging.getLogger(__name__)
+
+DIALOG = 'DialogCodeHook'
+FULFILLMENT = 'FulfillmentCodeHook'
+
+UNSUPPORTED_MESSAGE = 'Sorry, I cannot help with that request. Please ask for something else.'
+
+FALLBACK_MESSAGE = 'Sorry, this is taking longer than usual. Please hold while I transfer you to an agent.'
+
+
+def outcome(response):
+    '''ElicitSlot / Delegate / Close-Fulfilled / Close-Failed / ... for a Lex V1 or V2 response'''
+
+    if not response:
+        return 'None'
+
+    if 'dialogAction' in response:
+        action = response['dialogAction']
+        state = action.get('fulfillmentState')
+    else:
+        session_state = response.get('sessionState', {})
+        action = session_state.get('dialogAction', {})
+        state = session_state.get('intent', {}).get('state')
+
+    action_type = action.get('type', 'None')
+    if action_type == 'Close':
+        return f'Close-{state}'
+
+    return action_type
+
+
+class IntentStats:
+    '''Count and latency of one (intent, source, outcome) combination'''
+
+    __slots__ = ('count', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, elapsed_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3)
+        }
+
+
+class IntentRouter:
+    '''Routes a LexRequest to the handler registered for its intent and source'''
+
+    def __init__(self, default=None, fallback=None):
+        self._handlers = {} #(intent name, source) -> handler
+        self._default = default or self.unsupported
+        self._fallback = fallback or self.out_of_time
+        self._stats = {} #(intent name, source, outcome) -> IntentStats
+        self._lock = threading.Lock()
+
+    def register(self, intent_name, source, handler):
+        self._handlers[(intent_name, source)] = handler
+        return handler
+
+    def dialog(self, intent_name):
+        '''Decorator registering the DialogCodeHook handler of an intent'''
+
+        return lambda handler: self.register(intent_name, DIALOG, handler)
+
+    def fulfillment(self, intent_name):
+        '''Decorator registering the FulfillmentCodeHook handler of an intent'''
+
+        return lambda handler: self.register(intent_name, FULFILLMENT, handler)
+
+    def intent(self, intent_name):
+        '''Decorator registering one handler for both code hooks of an intent'''
+
+        def decorator(handler):
+            self.register(intent_name, DIALOG, handler)
+            self.register(intent_name, FULFILLMENT, handler)
+            return handler
+
+        return decorator
+
+    @staticmethod
+    def unsupported(request):
+        return lex.close(request, 'Failed', UNSUPPORTED_MESSAGE)
+
+    @staticmethod
+    def out_of_time(request):
+        return lex.close(request, 'Failed', FALLBACK_MESSAGE)
+
+    def dispatch(self, request):
+        '''Calls the registered handler, recording latency and outcome'''
+
+        handler = self._handlers.get((request.intent_name, request.source))
+        intent_name = request.intent_name if handler is not None else 'Unsupported'
+        handler = handler or self._default
+        metrics.set_dimensions(Intent=intent_name, Source=request.source)
+
+        start = time.perf_counter()
+        result = 'Error'
+        try:
+            try:
+                response = handler(request)
+                result = outcome(response)
+            except deadline.DeadlineExceeded as exc:
+                logger.warning('%s, answering with the fallback response', exc)
+                metrics.count('DeadlineFallbacks')
+                response = self._fallback(request)
+                result = 'Fallback'
+            return response
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._record(intent_name, request.source, result, elapsed_ms)
+            log.annotate(intent=intent_name, outcome=result, dispatch_ms=round(elapsed_ms, 3))
+            metrics.timing('DispatchLatency', elapsed_ms)
+            metrics.set_property(outcome=result)
+            logger.debug('dispatch intent=%s source=%s outcome=%s duration_ms=%.3f', intent_name, request.source, result, elapsed_ms)
+
+    def _record(self, intent_name, source, result, elapsed_ms):
+        key = (intent_name, source, result)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = IntentStats()
+            stats.add(elapsed_ms)
+
+    def stats(self):
+        '''Cumulative metrics for this container, keyed "intent/source/outcome"'''
+
+        with self._lock:
+            return {'/'.join(key): stats.as_dict() for key, stats in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
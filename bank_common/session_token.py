@@ -0,0 +1,113 @@
+'''
+Tamper-evident verification token carried in Lex sessionAttributes between dialog turns.
+
+The token records which account was verified, which slots were checked against DynamoDB,
+the Lex session it was issued in and when that verification expires, signed with an HMAC so
+callers cannot forge it. A token copied into another session does not verify there.
+Slot values (e.g. the pin) never appear in the token, only a keyed digest of them.
+Tokens are disabled unless SESSION_TOKEN_SECRET is set.
+'''
+
+import os
+import json
+import time
+import hmac
+import base64
+import hashlib
+
+
+#Session attribute that holds the token
+SESSION_ATTRIBUTE = 'verifiedAccount'
+
+DEFAULT_TTL = 300 #seconds
+
+
+def _secret():
+    secret = os.environ.get('SESSION_TOKEN_SECRET')
+    return secret.encode() if secret else None
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _digest(secret, slot_name, value):
+    return hmac.new(secret, f'{slot_name}={value}'.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+class VerifiedAccount:
+    '''Decoded, signature-checked token'''
+
+    __slots__ = ('accountNumber', 'expires', '_digests', '_secret')
+
+    def __init__(self, accountNumber, expires, digests, secret):
+        self.accountNumber = accountNumber
+        self.expires = expires
+        self._digests = digests
+        self._secret = secret
+
+    def has(self, slot_name):
+        '''True if slot_name was verified, whatever its value'''
+
+        return slot_name in self._digests
+
+    def covers(self, slot_name, value):
+        '''True if slot_name was verified with exactly this value'''
+
+        digest = self._digests.get(slot_name)
+        return digest is not None and hmac.compare_digest(digest, _digest(self._secret, slot_name, value))
+
+    def matches(self, accountNumber):
+        return accountNumber is not None and str(accountNumber) == self.accountNumber
+
+
+def issue(accountNumber, verified_slots, session_id, ttl=None):
+    '''
+    Returns a signed token for accountNumber, or None when tokens are disabled.
+    verified_slots maps slot name -> the value that passed verification, session_id is the
+    Lex sessionId / userId the token is valid in.
+    '''
+
+    secret = _secret()
+    if secret is None or accountNumber is None or not session_id:
+        return None
+
+    ttl = ttl if ttl is not None else int(os.environ.get('SESSION_TOKEN_TTL', DEFAULT_TTL))
+    payload = {
+        'a': str(accountNumber),
+        'e': int(time.time()) + ttl,
+        'i': str(session_id),
+        's': {name: _digest(secret, name, value) for name, value in verified_slots.items()}
+    }
+    body = _b64encode(json.dumps(payload, separators=(',', ':'), sort_keys=True).encode())
+    signature = _b64encode(hmac.new(secret, body.encode(), hashlib.sha256).digest()[:16])
+
+    return f'{body}.{signature}'
+
+
+def verify(token, session_id):
+    '''Returns a VerifiedAccount for a valid, unexpired token issued in session_id and None otherwise'''
+
+    secret = _secret()
+    if secret is None or not token or not session_id:
+        return None
+
+    try:
+        body, signature = token.split('.')
+        expected = _b64encode(hmac.new(secret, body.encode(), hashlib.sha256).digest()[:16])
+        if not hmac.compare_digest(signature, expected):
+            return None
+        payload = json.loads(_b64decode(body))
+    except (ValueError, TypeError):
+        return None
+
+    if payload['e'] <= time.time():
+        return None
+    if not hmac.compare_digest(payload.get('i', ''), str(session_id)):
+        return None
+
+    return VerifiedAccount(payload['a'], payload['e'], payload['s'], secret)
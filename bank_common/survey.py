@@ -0,0 +1,201 @@
+'''
+Buffered survey answer ingestion.
+
+Survey answers are not needed by the conversation that records them, so they are not written
+on the caller's critical path one put_item at a time. AnswerBuffer keeps them in the warm
+container and writes them in BatchWriteItem calls of up to 25 answers, gathered across callers.
+The buffer is flushed at the end of an invocation when it holds batch_size answers, when its
+oldest answer has waited max_age seconds, or when the invocation has less than flush_margin_ms
+left (Lambda may freeze or recycle the container once it answers).
+
+Answers are keyed by respondent (the Lex session) and question, so a second answer to the
+same question replaces the first, in the buffer and in the table, and writing an answer twice
+is harmless. Throttled (unprocessed) answers stay in the buffer for the next flush instead of
+being retried with backoff on the caller's time. When a flush fails (an error, or the time
+budget running out) the unsent answers are appended to a local spool file and sent again by
+a flush max_age seconds later, so a failing table does not slow every invocation. The spool
+survives failed flushes, not the container: Lambda gives no warning before a container is
+recycled, so at most max_age seconds of answers (plus the spool of a failing container) can
+be lost.
+
+    SURVEY_TABLE            - table name (default survey-responses)
+    SURVEY_BATCH_SIZE       - answers buffered before a flush (default 25)
+    SURVEY_MAX_AGE_SECONDS  - oldest buffered answer before a flush (default 30)
+    SURVEY_FLUSH_MARGIN_MS  - flush when the invocation has less time left than this (default 1000)
+    SURVEY_SPOOL_PATH       - spool file for answers a flush could not send (default /tmp/survey-spool.ndjson)
+'''
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from bank_common import deadline, dynamo, metrics
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLE = 'survey-responses'
+DEFAULT_BATCH_SIZE = dynamo.BATCH_WRITE_SIZE
+DEFAULT_MAX_AGE_SECONDS = 30
+DEFAULT_FLUSH_MARGIN_MS = 1000
+DEFAULT_SPOOL_PATH = '/tmp/survey-spool.ndjson'
+
+#Key schema of the survey table, see bank_common.tables
+RESPONDENT_ATTRIBUTE = 'respondentId'
+QUESTION_ATTRIBUTE = 'question'
+
+
+class AnswerBuffer:
+    '''Survey answers waiting to be written; one instance per container, thread-safe'''
+
+    def __init__(self, table=None, region_name=None, batch_size=None, max_age_seconds=None,
+                 flush_margin_ms=None, spool_path=None, clock=time.monotonic):
+        if table is None:
+            table = dynamo.get_table(os.environ.get('SURVEY_TABLE', DEFAULT_TABLE), region_name=region_name)
+        self.table = table
+        self.batch_size = batch_size or int(os.environ.get('SURVEY_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+        self.max_age_seconds = max_age_seconds if max_age_seconds is not None else \
+            float(os.environ.get('SURVEY_MAX_AGE_SECONDS', DEFAULT_MAX_AGE_SECONDS))
+        self.flush_margin_ms = flush_margin_ms if flush_margin_ms is not None else \
+            float(os.environ.get('SURVEY_FLUSH_MARGIN_MS', DEFAULT_FLUSH_MARGIN_MS))
+        self.spool_path = spool_path or os.environ.get('SURVEY_SPOOL_PATH', DEFAULT_SPOOL_PATH)
+        self.clock = clock
+
+        self._pending = OrderedDict() #(respondent, question) -> serialized item
+        self._oldest = None #monotonic time the oldest pending answer was recorded
+        self._spooled_at = self.clock() if self._spooled() else None #monotonic time of the last spooling
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, respondentId, question, answer, **attributes):
+        '''Buffers one answer; attributes are stored with it (e.g. the bot name)'''
+
+        item = dict(attributes)
+        item.update({
+            RESPONDENT_ATTRIBUTE: respondentId,
+            QUESTION_ATTRIBUTE: question,
+            'answer': answer,
+            'answeredAt': int(time.time()),
+        })
+
+        with self._lock:
+            self._pending[(respondentId, question)] = dynamo.serialize_item(item)
+            self._pending.move_to_end((respondentId, question))
+            if self._oldest is None:
+                self._oldest = self.clock()
+        metrics.count('SurveyAnswers')
+
+    def due(self):
+        '''Whether the buffer should be flushed before the invocation answers'''
+
+        #Spooled answers are retried max_age after the failure, not on every invocation
+        if self._spooled_at is not None and self.clock() - self._spooled_at >= self.max_age_seconds:
+            return True
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.batch_size:
+            return True
+        if self.clock() - self._oldest >= self.max_age_seconds:
+            return True
+
+        remaining = deadline.remaining_ms()
+        return remaining is not None and remaining < self.flush_margin_ms
+
+    def flush_if_due(self):
+        if self.due():
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the buffered and spooled answers. Returns the number written; throttled answers
+        stay buffered, answers a failed flush could not send go to the spool file.
+        '''
+
+        with self._lock:
+            pending = self._drain_spool()
+            pending.update(self._pending)
+            self._pending = OrderedDict()
+            self._oldest = None
+
+        requests = [{'PutRequest': {'Item': item}} for item in pending.values()]
+        written = 0
+        try:
+            while requests:
+                batch = requests[:dynamo.BATCH_WRITE_SIZE]
+                unprocessed = self.table.batch_write(batch)
+                written += len(batch) - len(unprocessed)
+                requests = requests[dynamo.BATCH_WRITE_SIZE:]
+                if unprocessed:
+                    #Throttled: the rest waits for the next flush rather than the caller
+                    metrics.count('SurveyThrottled', len(unprocessed))
+                    self._requeue(unprocessed + requests)
+                    break
+        except Exception:
+            logger.warning('Could not write %d survey answers to %s, spooling them', len(requests), self.table.name, exc_info=True)
+            metrics.count('SurveySpooled', len(requests))
+            self._spool(requests)
+
+        metrics.count('SurveyAnswersWritten', written)
+        return written
+
+    def _requeue(self, requests):
+        with self._lock:
+            requeued = OrderedDict((self._key(request['PutRequest']['Item']), request['PutRequest']['Item']) for request in requests)
+            #Answers recorded meanwhile are newer
+            requeued.update(self._pending)
+            self._pending = requeued
+            self._oldest = self.clock()
+
+    @staticmethod
+    def _key(item):
+        return item[RESPONDENT_ATTRIBUTE]['S'], item[QUESTION_ATTRIBUTE]['S']
+
+    def _spooled(self):
+        try:
+            return os.path.getsize(self.spool_path) > 0
+        except OSError:
+            return False
+
+    def _spool(self, requests):
+        '''Appends unsent answers (DynamoDB JSON, one per line), synced before returning'''
+
+        try:
+            with open(self.spool_path, 'a') as f:
+                for request in requests:
+                    f.write(json.dumps(request['PutRequest']['Item'], separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._spooled_at = self.clock()
+        except OSError:
+            #Nowhere left to put them, keep them in memory for the next flush
+            logger.exception('Could not spool survey answers to %s', self.spool_path)
+            self._requeue(requests)
+
+    def _drain_spool(self):
+        '''Takes the spooled answers out of the spool file'''
+
+        spooled = OrderedDict()
+        if self._spooled_at is None:
+            return spooled
+        self._spooled_at = None
+
+        try:
+            with open(self.spool_path) as f:
+                for line in f:
+                    #A line cut short by a crash mid-write is dropped
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue
+                    spooled[self._key(item)] = item
+            os.remove(self.spool_path)
+        except OSError:
+            logger.exception('Could not read survey spool %s', self.spool_path)
+            return OrderedDict()
+
+        return spooled
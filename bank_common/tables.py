@@ -0,0 +1,499 @@
+'''
+Declarative specs for the bank DynamoDB tables, and a bootstrap that creates or updates them.
+
+Each TableSpec states the region, key schema, billing mode (PAY_PER_REQUEST or PROVISIONED
+with optional target-tracking autoscaling), global secondary indexes and TTL attribute of one
+table. ensure_tables() works on all tables concurrently: missing tables are created and waited
+for, existing ones are diffed against their spec. The diff is only reported unless apply is
+set; then the tables are brought in line with UpdateTable calls, one change at a time as
+DynamoDB requires, waiting for the table and its indexes to be ACTIVE between calls.
+
+A spec without a billing mode (or TTL attribute) leaves that setting of an existing table as
+it is, and Application Auto Scaling is only touched for a billing mode the spec (or
+--billing-mode) states, so a rerun does not switch provisioned tables to on-demand.
+
+    python -m bank_common.tables [--apply] [--billing-mode PROVISIONED] [--tables BankAccounts] [--dry-run]
+
+After the tables are in place, an account number counter that earlier versions kept in an
+accounts table is moved to the account-counters table (move_legacy_counters()).
+
+Capacity mode is the main throttling lever: on-demand tables never return
+ProvisionedThroughputExceededException below their account limits, provisioned tables are
+cheaper under steady load and scale between min and max capacity at the target utilization.
+'''
+
+import copy
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bank_common import dynamo
+
+
+PAY_PER_REQUEST = 'PAY_PER_REQUEST'
+PROVISIONED = 'PROVISIONED'
+
+#Target-tracking metric per capacity dimension
+_SCALING_METRICS = {
+    'ReadCapacityUnits': 'DynamoDBReadCapacityUtilization',
+    'WriteCapacityUnits': 'DynamoDBWriteCapacityUtilization',
+}
+
+
+class AutoScaling:
+    '''Target-tracking autoscaling of one capacity dimension'''
+
+    def __init__(self, min_capacity, max_capacity, target_utilization=70.0):
+        self.min_capacity = min_capacity
+        self.max_capacity = max_capacity
+        self.target_utilization = target_utilization
+
+
+class IndexSpec:
+    '''
+    A global secondary index. read/write capacity are used in PROVISIONED mode and default to
+    the table's; autoscaling follows the table's limits.
+    '''
+
+    def __init__(self, name, hash_key, range_key=None, projection='ALL', non_key_attributes=None,
+                 read_capacity=None, write_capacity=None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.projection = projection
+        self.non_key_attributes = non_key_attributes
+        self.read_capacity = read_capacity
+        self.write_capacity = write_capacity
+
+    def key_schema(self):
+        return _key_schema(self.hash_key, self.range_key)
+
+    def projection_request(self):
+        projection = {'ProjectionType': self.projection}
+        if self.projection == 'INCLUDE':
+            projection['NonKeyAttributes'] = list(self.non_key_attributes)
+        return projection
+
+
+class TableSpec:
+    '''
+    Desired state of one table. attributes maps every key attribute (table and index keys) to
+    its DynamoDB type, 'S', 'N' or 'B'. read_capacity / write_capacity are the provisioned
+    units, and the starting point of autoscaling, when billing_mode is PROVISIONED.
+    billing_mode None keeps the mode of an existing table and creates a new one on-demand.
+    '''
+
+    def __init__(self, name, hash_key, attributes, range_key=None, billing_mode=None,
+                 read_capacity=5, write_capacity=5, read_scaling=None, write_scaling=None,
+                 indexes=(), ttl_attribute=None, region_name=None):
+        self.name = name
+        self.region_name = region_name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.attributes = attributes
+        self.billing_mode = billing_mode
+        self.read_capacity = read_capacity
+        self.write_capacity = write_capacity
+        self.read_scaling = read_scaling
+        self.write_scaling = write_scaling
+        self.indexes = list(indexes)
+        self.ttl_attribute = ttl_attribute
+
+    def replace(self, **changes):
+        spec = copy.copy(self)
+        spec.__dict__.update(changes)
+        return spec
+
+    @property
+    def provisioned(self):
+        return self.billing_mode == PROVISIONED
+
+    @property
+    def create_billing_mode(self):
+        return self.billing_mode or PAY_PER_REQUEST
+
+    def key_schema(self):
+        return _key_schema(self.hash_key, self.range_key)
+
+    def attribute_definitions(self):
+        names = [self.hash_key] + ([self.range_key] if self.range_key else [])
+        for index in self.indexes:
+            names += [name for name in (index.hash_key, index.range_key) if name and name not in names]
+        return [{'AttributeName': name, 'AttributeType': self.attributes[name]} for name in names]
+
+    def throughput(self, index=None):
+        read = index.read_capacity if index is not None and index.read_capacity else self.read_capacity
+        write = index.write_capacity if index is not None and index.write_capacity else self.write_capacity
+        return {'ReadCapacityUnits': read, 'WriteCapacityUnits': write}
+
+    def index_request(self, index):
+        request = {'IndexName': index.name, 'KeySchema': index.key_schema(), 'Projection': index.projection_request()}
+        if self.provisioned:
+            request['ProvisionedThroughput'] = self.throughput(index)
+        return request
+
+    def create_request(self):
+        request = {
+            'TableName': self.name,
+            'KeySchema': self.key_schema(),
+            'AttributeDefinitions': self.attribute_definitions(),
+            'BillingMode': self.create_billing_mode,
+        }
+        if self.provisioned:
+            request['ProvisionedThroughput'] = self.throughput()
+        if self.indexes:
+            request['GlobalSecondaryIndexes'] = [self.index_request(index) for index in self.indexes]
+        return request
+
+    def update_requests(self, description, prune_indexes=False):
+        '''
+        UpdateTable requests that bring a described table to this spec, in order. DynamoDB takes
+        one billing mode / throughput change or one index creation or deletion per call.
+        '''
+
+        current_keys = {(key['AttributeName'], key['KeyType']) for key in description['KeySchema']}
+        if current_keys != {(key['AttributeName'], key['KeyType']) for key in self.key_schema()}:
+            raise ValueError(f'{self.name}: the key schema of an existing table cannot be changed')
+
+        requests = []
+        existing = {index['IndexName']: index for index in description.get('GlobalSecondaryIndexes', [])}
+        current_mode = description.get('BillingModeSummary', {}).get('BillingMode', PROVISIONED)
+
+        if self.billing_mode is not None and current_mode != self.billing_mode:
+            request = {'TableName': self.name, 'BillingMode': self.billing_mode}
+            if self.provisioned:
+                #Switching to provisioned needs throughput for the table and every existing index
+                request['ProvisionedThroughput'] = self.throughput()
+                by_name = {index.name: index for index in self.indexes}
+                updates = [
+                    {'Update': {'IndexName': name, 'ProvisionedThroughput': self.throughput(by_name.get(name))}}
+                    for name in existing
+                ]
+                if updates:
+                    request['GlobalSecondaryIndexUpdates'] = updates
+            requests.append(request)
+        elif self.provisioned and self.read_scaling is None and self.write_scaling is None:
+            #With autoscaling the current capacity belongs to the scaling policy, leave it alone
+            current = description.get('ProvisionedThroughput', {})
+            desired = self.throughput()
+            if any(current.get(name) != units for name, units in desired.items()):
+                requests.append({'TableName': self.name, 'ProvisionedThroughput': desired})
+
+        for index in self.indexes:
+            if index.name not in existing:
+                requests.append({
+                    'TableName': self.name,
+                    'AttributeDefinitions': self.attribute_definitions(),
+                    'GlobalSecondaryIndexUpdates': [{'Create': self.index_request(index)}],
+                })
+            elif {(key['AttributeName'], key['KeyType']) for key in existing[index.name]['KeySchema']} != \
+                    {(key['AttributeName'], key['KeyType']) for key in index.key_schema()}:
+                raise ValueError(f'{self.name}: index {index.name} has a different key schema, delete it first')
+
+        if prune_indexes:
+            wanted = {index.name for index in self.indexes}
+            for name in existing:
+                if name not in wanted:
+                    requests.append({'TableName': self.name, 'GlobalSecondaryIndexUpdates': [{'Delete': {'IndexName': name}}]})
+
+        return requests
+
+    def scalable_targets(self):
+        '''(resource id, scalable dimension, capacity unit, AutoScaling) for the table and its indexes'''
+
+        targets = []
+        for unit, scaling in (('ReadCapacityUnits', self.read_scaling), ('WriteCapacityUnits', self.write_scaling)):
+            if scaling is None:
+                continue
+            targets.append((f'table/{self.name}', f'dynamodb:table:{unit}', unit, scaling))
+            for index in self.indexes:
+                targets.append((f'table/{self.name}/index/{index.name}', f'dynamodb:index:{unit}', unit, scaling))
+        return targets
+
+
+def _key_schema(hash_key, range_key):
+    schema = [{'AttributeName': hash_key, 'KeyType': 'HASH'}]
+    if range_key:
+        schema.append({'AttributeName': range_key, 'KeyType': 'RANGE'})
+    return schema
+
+
+""" --- Tables --- """
+
+
+#Region of the bank tables, where the bots run
+BANK_REGION = 'us-east-1'
+
+#Region of the tables Lambda_Call_DB reads
+CONTACT_REGION = 'ap-southeast-2'
+
+#Created on-demand, existing tables keep their mode; PROVISIONED uses the capacity and scaling limits below
+TABLES = {
+    spec.name: spec for spec in (
+        TableSpec(
+            'BankAccounts', 'AccountNumber', {'AccountNumber': 'N', 'PhoneNumber': 'S'}, region_name=BANK_REGION,
+            read_scaling=AutoScaling(5, 500), write_scaling=AutoScaling(5, 100),
+            #Caller-ID lookups (bank_common.caller_id) only need the account number back
+            indexes=[IndexSpec('PhoneNumberIndex', 'PhoneNumber', projection='KEYS_ONLY')],
+        ),
+        TableSpec(
+            'BankAccountsNew', 'AccountNumber', {'AccountNumber': 'N', 'Phone Number': 'S'}, region_name=BANK_REGION,
+            read_scaling=AutoScaling(5, 500), write_scaling=AutoScaling(5, 100),
+            indexes=[IndexSpec('PhoneNumberIndex', 'Phone Number', projection='KEYS_ONLY')],
+        ),
+        TableSpec(
+            'data_dip_table', 'phone-number', {'phone-number': 'S'}, region_name=CONTACT_REGION,
+            read_scaling=AutoScaling(5, 200), write_scaling=AutoScaling(1, 20),
+        ),
+        TableSpec(
+            'contact-list', 'origin', {'origin': 'S', 'routeSet': 'S', 'updatedAt': 'N'}, region_name=CONTACT_REGION,
+            read_scaling=AutoScaling(5, 200), write_scaling=AutoScaling(1, 20),
+            #Sparse index of the routes written through bank_common.contact_list, for incremental refreshes
+            indexes=[IndexSpec(
+                'UpdatedAtIndex', 'routeSet', range_key='updatedAt', projection='INCLUDE',
+                non_key_attributes=['transferTo']
+            )],
+        ),
+        #Account number counters, one item per accounts table (see bank_common.account_numbers)
+        TableSpec('account-counters', 'counter', {'counter': 'S'}, region_name=BANK_REGION),
+        #Survey answers arrive in BatchWriteItem calls from bank_common.survey, rarely read
+        TableSpec(
+            'survey-responses', 'respondentId', {'respondentId': 'S', 'question': 'S'}, range_key='question',
+            region_name=BANK_REGION,
+            read_scaling=AutoScaling(1, 20), write_scaling=AutoScaling(5, 100),
+        ),
+    )
+}
+
+
+""" --- Bootstrap --- """
+
+
+def describe(client, name):
+    '''The table description, or None when it does not exist'''
+
+    try:
+        return client.describe_table(TableName=name)['Table']
+    except dynamo.ClientError as err:
+        if err.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise
+
+
+def wait_until_active(client, name, delay=5, timeout=1800):
+    '''Waits for the table and all of its indexes to be ACTIVE (index backfills can take a while)'''
+
+    deadline = time.monotonic() + timeout
+    while True:
+        table = client.describe_table(TableName=name)['Table']
+        if table['TableStatus'] == 'ACTIVE' and all(
+            index.get('IndexStatus') == 'ACTIVE' for index in table.get('GlobalSecondaryIndexes', [])
+        ):
+            return table
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{name} is still {table["TableStatus"]} after {timeout} seconds')
+        time.sleep(delay)
+
+
+def _autoscaling_client(region_name):
+    import botocore.session
+    return botocore.session.get_session().create_client('application-autoscaling', region_name=region_name)
+
+
+def apply_autoscaling(spec, autoscaling, actions):
+    '''Registers the scalable targets and target-tracking policies of a provisioned table'''
+
+    for resource_id, dimension, unit, scaling in spec.scalable_targets():
+        autoscaling.register_scalable_target(
+            ServiceNamespace='dynamodb', ResourceId=resource_id, ScalableDimension=dimension,
+            MinCapacity=scaling.min_capacity, MaxCapacity=scaling.max_capacity,
+        )
+        autoscaling.put_scaling_policy(
+            PolicyName=f'{resource_id.replace("/", "-")}-{unit}', ServiceNamespace='dynamodb',
+            ResourceId=resource_id, ScalableDimension=dimension, PolicyType='TargetTrackingScaling',
+            TargetTrackingScalingPolicyConfiguration={
+                'TargetValue': float(scaling.target_utilization),
+                'PredefinedMetricSpecification': {'PredefinedMetricType': _SCALING_METRICS[unit]},
+            },
+        )
+        actions.append(f'autoscaling {dimension} {resource_id} {scaling.min_capacity}-{scaling.max_capacity}')
+
+
+def remove_autoscaling(spec, autoscaling, actions):
+    '''Deregisters the scalable targets of a table that went on-demand'''
+
+    registered = autoscaling.describe_scalable_targets(
+        ServiceNamespace='dynamodb',
+        ResourceIds=[f'table/{spec.name}'] + [f'table/{spec.name}/index/{index.name}' for index in spec.indexes],
+    )['ScalableTargets']
+    for target in registered:
+        autoscaling.deregister_scalable_target(
+            ServiceNamespace='dynamodb', ResourceId=target['ResourceId'], ScalableDimension=target['ScalableDimension']
+        )
+        actions.append(f'removed autoscaling {target["ScalableDimension"]} {target["ResourceId"]}')
+
+
+def apply_ttl(client, spec, actions, apply=True):
+    '''Enables TTL on the spec's attribute; a spec without one leaves TTL as it is'''
+
+    if not spec.ttl_attribute:
+        return
+    current = client.describe_time_to_live(TableName=spec.name)['TimeToLiveDescription']
+    enabled = current.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING')
+    if enabled and current.get('AttributeName') == spec.ttl_attribute:
+        return
+    if not apply:
+        actions.append(f'would turn ttl on {spec.ttl_attribute}')
+        return
+    client.update_time_to_live(
+        TableName=spec.name, TimeToLiveSpecification={'Enabled': True, 'AttributeName': spec.ttl_attribute}
+    )
+    actions.append(f'ttl on {spec.ttl_attribute}')
+
+
+def _summary(request):
+    parts = []
+    if 'BillingMode' in request:
+        parts.append(f'billing mode {request["BillingMode"]}')
+    if 'ProvisionedThroughput' in request:
+        throughput = request['ProvisionedThroughput']
+        parts.append(f'capacity {throughput["ReadCapacityUnits"]}/{throughput["WriteCapacityUnits"]}')
+    for update in request.get('GlobalSecondaryIndexUpdates', []):
+        for change, body in update.items():
+            if change != 'Update':
+                parts.append(f'{change.lower()} index {body["IndexName"]}')
+    return 'update ' + ', '.join(parts)
+
+
+def ensure_table(spec, client, autoscaling=None, prune_indexes=False, apply=False, dry_run=False, delay=5):
+    '''
+    Creates one table when it is missing. An existing table is diffed against spec and only
+    updated when apply is set. autoscaling returns the Application Auto Scaling client and is
+    only called when the spec states a billing mode. Returns the actions taken, or planned
+    ("would ...") when they were not carried out.
+    '''
+
+    actions = []
+    description = describe(client, spec.name)
+
+    if description is None:
+        if dry_run:
+            return [f'would create ({spec.create_billing_mode})']
+        actions.append(f'create ({spec.create_billing_mode})')
+        client.create_table(**spec.create_request())
+        client.get_waiter('table_exists').wait(TableName=spec.name, WaiterConfig={'Delay': delay})
+        was_provisioned = False
+    else:
+        requests = spec.update_requests(description, prune_indexes)
+        if dry_run or not apply:
+            actions += [f'would {_summary(request)}' for request in requests]
+            apply_ttl(client, spec, actions, apply=False)
+            return actions
+        actions += [_summary(request) for request in requests]
+        for request in requests:
+            #Only one update may be in progress per table
+            wait_until_active(client, spec.name, delay)
+            client.update_table(**request)
+        if requests:
+            wait_until_active(client, spec.name, delay)
+        was_provisioned = description.get('BillingModeSummary', {}).get('BillingMode', PROVISIONED) == PROVISIONED
+
+    apply_ttl(client, spec, actions)
+    if autoscaling is not None:
+        if spec.provisioned:
+            apply_autoscaling(spec, autoscaling(), actions)
+        elif spec.billing_mode == PAY_PER_REQUEST and was_provisioned:
+            remove_autoscaling(spec, autoscaling(), actions)
+
+    return actions
+
+
+def ensure_tables(specs=None, region_name=None, prune_indexes=False, apply=False, dry_run=False,
+                  manage_autoscaling=True, delay=5):
+    '''
+    Brings every spec (default: all of TABLES) in line concurrently, each in its own region
+    unless region_name overrides it. Returns {table name: [actions]} or raises the first
+    failure once every table has finished.
+    '''
+
+    specs = list(TABLES.values() if specs is None else specs)
+    autoscaling_clients = {}
+    lock = threading.Lock()
+
+    def autoscaling_in(region):
+        #Created on first use, on-demand tables never need Application Auto Scaling permissions
+        def autoscaling():
+            with lock:
+                if region not in autoscaling_clients:
+                    autoscaling_clients[region] = _autoscaling_client(region)
+                return autoscaling_clients[region]
+        return autoscaling if manage_autoscaling else None
+
+    with ThreadPoolExecutor(max_workers=max(len(specs), 1)) as pool:
+        futures = {}
+        for spec in specs:
+            region = region_name or spec.region_name
+            futures[spec.name] = pool.submit(
+                ensure_table, spec, dynamo.get_client(region), autoscaling_in(region),
+                prune_indexes, apply, dry_run, delay
+            )
+
+    #Every table has finished (or failed) here, result() re-raises the first failure
+    return {name: future.result() for name, future in futures.items()}
+
+
+#Accounts tables whose counter earlier versions kept under AccountNumber = 0
+ACCOUNT_TABLES = ('BankAccounts', 'BankAccountsNew')
+
+
+def move_legacy_counters(names=ACCOUNT_TABLES, region_name=None, dry_run=False):
+    '''
+    Moves the account number counters left in the accounts tables to the counter table (see
+    account_numbers.move_legacy_counter), once per bootstrap instead of once per container.
+    Returns {table name: [actions]} like ensure_tables().
+    '''
+
+    from bank_common import account_numbers
+
+    results = {}
+    for name in names:
+        table = dynamo.get_table(name, region_name=region_name or TABLES[name].region_name)
+        next_sequence = account_numbers.move_legacy_counter(table, dry_run=dry_run)
+        if next_sequence is not None:
+            verb = 'would move' if dry_run else 'moved'
+            results[name] = [f'{verb} legacy account number counter (NextSequence {next_sequence})']
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tables', nargs='+', choices=sorted(TABLES), help='tables to ensure (default: all)')
+    parser.add_argument('--apply', action='store_true', help='update existing tables (default: print their diff)')
+    parser.add_argument('--billing-mode', choices=(PAY_PER_REQUEST, PROVISIONED), help='override every spec')
+    parser.add_argument('--region', help='AWS region of every table (default: the region of each spec)')
+    parser.add_argument('--prune-indexes', action='store_true', help='delete indexes that are not in the spec')
+    parser.add_argument('--no-autoscaling', action='store_true', help='leave Application Auto Scaling untouched')
+    parser.add_argument('--dry-run', action='store_true', help='do not create missing tables either')
+    args = parser.parse_args(argv)
+
+    specs = [TABLES[name] for name in args.tables or TABLES]
+    if args.billing_mode:
+        specs = [spec.replace(billing_mode=args.billing_mode) for spec in specs]
+
+    results = ensure_tables(
+        specs, region_name=args.region, prune_indexes=args.prune_indexes, apply=args.apply,
+        dry_run=args.dry_run, manage_autoscaling=not args.no_autoscaling
+    )
+    for name, actions in results.items():
+        print(f'{name}: {"; ".join(actions) or "up to date"}')
+
+    #Only once the counter table exists, and not for tables that were left out
+    names = [spec.name for spec in specs if spec.name in ACCOUNT_TABLES]
+    if 'account-counters' in results and not args.dry_run:
+        for name, actions in move_legacy_counters(names, region_name=args.region).items():
+            print(f'{name}: {"; ".join(actions)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+'''
+Cold-start benchmark for the Lambda handlers.
+
+Every handler is loaded in a fresh interpreter started with `-X importtime`, the same way
+the Lambda runtime does on a cold container, and the script reports:
+
+    import_ms - time spent importing the handler's dependencies
+    init_ms   - time spent executing the handler module body (client creation etc.)
+    first_ms  - latency of the first lambda_handler call with a sample event
+    top       - slowest imports (cumulative) from the -X importtime breakdown
+
+Usage:
+    python benchmarks/cold_start.py [--runs 5] [--endpoint-url http://localhost:8000] [--json out.json]
+
+Without --endpoint-url the first invocation talks to real DynamoDB in AWS_REGION; errors are
+reported but the timings are still recorded.
+'''
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _lex_v1_event(intent_name, slots):
+    return {
+        'bot': {'name': 'BankBot'},
+        'userId': 'cold-start',
+        'inputTranscript': '',
+        'invocationSource': 'DialogCodeHook',
+        'sessionAttributes': {},
+        'currentIntent': {'name': intent_name, 'slots': slots, 'confirmationStatus': 'None'}
+    }
+
+
+def _lex_v2_event(intent_name, slots):
+    return {
+        'bot': {'name': 'BankBotV2'},
+        'inputTranscript': '',
+        'inputMode': 'Text',
+        'invocationSource': 'DialogCodeHook',
+        'sessionState': {
+            'sessionAttributes': {},
+            'intent': {'name': intent_name, 'slots': slots, 'confirmationState': 'None'}
+        }
+    }
+
+
+def _v2_slot(value):
+    return {'value': {'originalValue': value, 'interpretedValue': value, 'resolvedValues': [value]}}
+
+
+#module path relative to ROOT -> sample event for the first invocation
+HANDLERS = {
+    'Bank_Contact_Flow/bank_lambda.py': _lex_v1_event(
+        'AccountLookUp', {'AccountNumber': '189714330257', 'Pin': '1534'}
+    ),
+    'Bank_Contact_Flow_V2/Bank_Balance_Replace_V2.py': _lex_v2_event(
+        'CheckBalance', {'accountType': _v2_slot('checking'), 'accountNumber': _v2_slot('330256762208'), 'pin': None}
+    ),
+    'Bank_Contact_Flow_V2/Bank_OpenAccount_V2.py': _lex_v2_event(
+        'OpenAccount', {'accountType': _v2_slot('checking')}
+    ),
+    'Bank_Contact_Flow_V2/Bank_Survery_V2.py': _lex_v2_event(
+        'Survey', {'satisfaction': _v2_slot('4'), 'resolved': None, 'recommend': None}
+    ),
+    'Lambda_Call_DB.py': {
+        'Details': {
+            'ContactData': {'CustomerEndpoint': {'Address': '+15555550100', 'Type': 'TELEPHONE_NUMBER'}},
+            'Parameters': {}
+        },
+        'Name': 'ContactFlowEvent'
+    },
+}
+
+
+#Runs inside the child interpreter: loads the handler like the Lambda runtime and calls it once
+CHILD = r'''
+import sys, json, time, importlib.util
+path, module_name, event = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+
+sys.stderr.write('--- handler load ---\n')
+sys.stderr.flush()
+t0 = time.perf_counter()
+spec = importlib.util.spec_from_file_location(module_name, path)
+module = importlib.util.module_from_spec(spec)
+sys.modules[module_name] = module
+spec.loader.exec_module(module)
+t1 = time.perf_counter()
+
+error = None
+try:
+    module.lambda_handler(event, None)
+except Exception as exc:
+    error = f'{type(exc).__name__}: {exc}'
+t2 = time.perf_counter()
+
+print(json.dumps({'load_ms': (t1 - t0) * 1000, 'first_ms': (t2 - t1) * 1000, 'error': error}))
+'''
+
+
+def parse_importtime(stderr):
+    '''Returns [(module, depth, cumulative_us)] for everything imported while loading the handler'''
+
+    _, _, stderr = stderr.partition('--- handler load ---\n')
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(cumulative_us)))
+
+    return imports
+
+
+def run_once(path, event, env):
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD, os.path.join(ROOT, path), module_name, json.dumps(event)],
+        capture_output=True, text=True, env=env, cwd=ROOT, timeout=120
+    )
+    lines = [line for line in completed.stdout.splitlines() if line.startswith('{')]
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f'{path} failed to load:\n{completed.stderr[-2000:]}')
+
+    result = json.loads(lines[-1])
+    imports = parse_importtime(completed.stderr)
+
+    #exec_module is not an import statement, so the handler itself is not in the importtime log:
+    #top level entries are the imports made by the handler module body, the rest of the load is init
+    result['import_ms'] = sum(cumulative for _, depth, cumulative in imports if depth == 0) / 1000
+    result['init_ms'] = max(result['load_ms'] - result['import_ms'], 0.0)
+    result['top'] = sorted(
+        ((name, cumulative / 1000) for name, depth, cumulative in imports if depth <= 1),
+        key=lambda entry: entry[1], reverse=True
+    )[:10]
+
+    return result
+
+
+def summarize(samples):
+    summary = {}
+    for field in ('import_ms', 'init_ms', 'first_ms'):
+        values = [sample[field] for sample in samples]
+        summary[field] = {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+    summary['top_imports_ms'] = samples[-1]['top']
+    summary['errors'] = sorted({sample['error'] for sample in samples if sample['error']})
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per handler')
+    parser.add_argument('--endpoint-url', help='DynamoDB endpoint for the first invocation, e.g. DynamoDB Local')
+    parser.add_argument('--handler', action='append', choices=sorted(HANDLERS), help='limit to these handlers')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    env.setdefault('AWS_REGION', 'us-east-1')
+    env.setdefault('AWS_DEFAULT_REGION', env['AWS_REGION'])
+    if args.endpoint_url:
+        env['AWS_ENDPOINT_URL_DYNAMODB'] = args.endpoint_url
+
+    results = {}
+    for path in args.handler or HANDLERS:
+        samples = [run_once(path, HANDLERS[path], env) for _ in range(args.runs)]
+        results[path] = summary = summarize(samples)
+
+        print(f'\n{path}')
+        for field in ('import_ms', 'init_ms', 'first_ms'):
+            stats = summary[field]
+            print(f'  {field:<10} median {stats["median"]:8.1f}  min {stats["min"]:8.1f}  max {stats["max"]:8.1f}')
+        print('  slowest imports (cumulative ms):')
+        for name, cumulative_ms in summary['top_imports_ms']:
+            print(f'    {cumulative_ms:8.1f}  {name}')
+        for error in summary['errors']:
+            print(f'  first invocation error: {error}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
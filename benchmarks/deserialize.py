@@ -0,0 +1,125 @@
+'''
+Micro-benchmark of DynamoDB item deserialization.
+
+Every read turns low-level items ({"Pin": {"N": "5101"}, ...}) into plain Python values. The
+boto3 resource layer does it with TypeDeserializer, one method call per attribute and a Decimal
+for every number; bank_common.dynamo.deserialize_item converts strings and integral numbers
+inline and keeps Decimal only for the table's money attributes. The benchmark times both on
+the seed accounts of the V1 and V2 tables (benchmarks/local_dynamodb.json), plus json.dumps of
+the result, and reports per-item cost:
+
+    deserialize_us  - microseconds to deserialize one item (median of --repeats runs)
+    json_us         - microseconds to json.dumps one deserialized item
+    decimals        - Decimal objects created per item
+
+Usage:
+    python benchmarks/deserialize.py [--items 20000] [--repeats 7] [--json out.json]
+
+Needs boto3 for the resource-layer baseline, which the Lambda functions themselves do not.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from boto3.dynamodb.types import TypeDeserializer
+
+from bank_common import accounts, dynamo
+
+
+#seed file relative to ROOT -> account schema of its table
+SEEDS = {
+    'Bank_Contact_Flow/finalbankdata.json': accounts.V1,
+    'Bank_Contact_Flow_V2/bankdata.json': accounts.V2,
+}
+
+
+def _load(path, count):
+    '''count low-level items, cycling through the seed accounts of one table'''
+
+    with open(os.path.join(ROOT, path)) as f:
+        seed = json.load(f, parse_float=Decimal)
+    items = [dynamo.serialize_item(item) for item in seed]
+    return [items[i % len(items)] for i in range(count)]
+
+
+def _resource_layer(items):
+    #What boto3's resource Table does to every item of a response
+    deserializer = TypeDeserializer()
+    return [{name: deserializer.deserialize(value) for name, value in item.items()} for item in items]
+
+
+def _client_layer(decimal_attributes):
+    def run(items):
+        return [dynamo.deserialize_item(item, decimal_attributes) for item in items]
+    return run
+
+
+def _resource_json(item):
+    #Without an encoder json.dumps rejects Decimal, so resource-layer callers pass one in
+    return json.dumps(item, default=dynamo.json_default)
+
+
+def _client_json(item):
+    return json.dumps(item, cls=dynamo.JSONEncoder)
+
+
+def _time(function, argument, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(argument)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def measure(items, decimal_attributes, repeats):
+    results = {}
+    for name, deserialize, encode in (
+        ('resource', _resource_layer, _resource_json),
+        ('dynamo', _client_layer(decimal_attributes), _client_json),
+    ):
+        plain = deserialize(items)
+        seconds = _time(deserialize, items, repeats)
+        json_seconds = _time(lambda plain: [encode(item) for item in plain], plain, repeats)
+        results[name] = {
+            'deserialize_us': seconds / len(items) * 1e6,
+            'json_us': json_seconds / len(items) * 1e6,
+            'decimals': sum(isinstance(v, Decimal) for v in plain[0].values()),
+        }
+    results['speedup'] = results['resource']['deserialize_us'] / results['dynamo']['deserialize_us']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=20000, help='items deserialized per run')
+    parser.add_argument('--repeats', type=int, default=7, help='runs per measurement, the median is reported')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    report = {}
+    print(f'{"table":<40} {"layer":<9} {"deser us/item":>14} {"json us/item":>12} {"decimals":>9}')
+    for path, schema in SEEDS.items():
+        items = _load(path, args.items)
+        decimal_attributes = frozenset(schema.attribute(field) for field in accounts.MONEY_FIELDS)
+        results = report[path] = measure(items, decimal_attributes, args.repeats)
+        for layer in ('resource', 'dynamo'):
+            row = results[layer]
+            print(f'{path:<40} {layer:<9} {row["deserialize_us"]:>14.2f} {row["json_us"]:>12.2f} {row["decimals"]:>9}')
+        print(f'{path:<40} {"speedup":<9} {results["speedup"]:>13.1f}x')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
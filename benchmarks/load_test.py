@@ -0,0 +1,174 @@
+'''
+Capacity load test: how the handlers behave at 5, 50 or 500 RCU without an AWS account.
+
+For every capacity level the recorded conversations of benchmarks/events/ are replayed
+concurrently (open loop, --rate conversations per second for --duration seconds) against the
+in-process emulator with provisioned read/write capacity, injected DynamoDB latency and
+SDK-style retries. Reported per level:
+
+    turns / errors         - lambda_handler calls and the ones that raised
+    throttled_turns        - turns that failed with ProvisionedThroughputExceededException
+    throttled_requests     - DynamoDB attempts rejected by the token bucket (retried or not)
+    latency_ms             - p50 / p95 / p99 of lambda_handler calls
+    consumed_rcu_per_s     - read capacity actually consumed, per table (same for WCU)
+
+Usage:
+    python benchmarks/load_test.py [--capacity 5 50 500] [--rate 50] [--duration 10]
+                                   [--latency-median-ms 4] [--max-attempts 3] [--json out.json]
+
+--burst-seconds defaults to 0 so the steady-state limit shows up in a short run; DynamoDB
+itself banks up to 300 seconds of unused capacity.
+'''
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import replay
+from bank_common import dynamo, metrics
+from bank_common.local_dynamodb import LatencyModel
+
+
+def run_conversation(module, conversation, samples, lock):
+    session_attributes = None
+    for recorded in conversation:
+        event = replay._with_session(recorded, session_attributes)
+        error = None
+        start = time.perf_counter()
+        try:
+            response = module.lambda_handler(event, replay.LambdaContext())
+        except Exception as exc:
+            response = None
+            error = exc.response['Error']['Code'] if isinstance(exc, dynamo.ClientError) else type(exc).__name__
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with lock:
+            samples.append((elapsed_ms, error))
+        if error:
+            return
+        session_attributes = replay._session_attributes(response) or session_attributes
+
+
+def run_level(corpus, modules, backend, rate, duration, workers):
+    '''Open loop: a conversation starts every 1/rate seconds whether or not earlier ones finished'''
+
+    for region in replay.REGIONS:
+        dynamo.set_client(backend, region)
+    for module in modules.values():
+        cache = getattr(module, 'account_cache', None)
+        if cache is not None:
+            cache.clear()
+
+    conversations = [
+        (modules[entry['handler']], conversation) for entry in corpus for conversation in entry['conversations']
+    ]
+    samples, lock = [], threading.Lock()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(int(rate * duration)):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            module, conversation = conversations[i % len(conversations)]
+            pool.submit(run_conversation, module, conversation, samples, lock)
+    elapsed = time.perf_counter() - start
+
+    latencies = [elapsed_ms for elapsed_ms, _ in samples]
+    errors = [error for _, error in samples if error]
+    consumed = {
+        name: {
+            'rcu_per_s': units['read'] / elapsed if units['read'] is not None else None,
+            'wcu_per_s': units['write'] / elapsed if units['write'] is not None else None,
+        }
+        for name, units in backend.consumed().items()
+        if units['read'] or units['write']
+    }
+
+    return {
+        'turns': len(samples),
+        'errors': len(errors),
+        'throttled_turns': errors.count('ProvisionedThroughputExceededException'),
+        'error_codes': sorted(set(errors)),
+        'dynamodb_calls': sum(backend.calls.values()),
+        'dynamodb_attempts': sum(backend.attempts.values()),
+        'throttled_requests': sum(backend.throttles.values()),
+        'latency_ms': {
+            'p50': replay.percentile(latencies, 0.50),
+            'p95': replay.percentile(latencies, 0.95),
+            'p99': replay.percentile(latencies, 0.99),
+        } if latencies else {},
+        'consumed': consumed,
+        'elapsed_s': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--capacity', type=int, nargs='+', default=[5, 50, 500], help='RCU per table, one run each')
+    parser.add_argument('--wcu', type=int, help='WCU per table (default: same as the RCU level)')
+    parser.add_argument('--rate', type=float, default=50, help='conversations started per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per capacity level')
+    parser.add_argument('--workers', type=int, default=64, help='concurrent invocations')
+    parser.add_argument('--burst-seconds', type=float, default=0, help='unused capacity a table can bank')
+    parser.add_argument('--latency-median-ms', type=float, default=4.0)
+    parser.add_argument('--latency-sigma', type=float, default=0.4)
+    parser.add_argument('--max-attempts', type=int, default=3, help='SDK attempts per request, 1 disables retries')
+    parser.add_argument('--events', nargs='+', help='corpus files (default: benchmarks/events/*.json)')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SESSION_TOKEN_SECRET', 'replay-benchmark-secret')
+    devnull = open(os.devnull, 'w')
+    logging.getLogger().addHandler(logging.StreamHandler(devnull))
+    metrics.set_output(devnull)
+
+    paths = args.events or sorted(
+        os.path.join(replay.EVENTS_DIR, name) for name in os.listdir(replay.EVENTS_DIR) if name.endswith('.json')
+    )
+    corpus = replay.load_corpus(paths)
+
+    #Handlers bind their client at import time, load them against an on-demand emulator first
+    for region in replay.REGIONS:
+        dynamo.set_client(replay.build_backend(), region)
+    modules = {entry['handler']: replay.load_handler(entry['handler']) for entry in corpus}
+
+    results = {}
+    for capacity in args.capacity:
+        backend = replay.build_backend(
+            read_capacity=capacity,
+            write_capacity=args.wcu or capacity,
+            burst_seconds=args.burst_seconds,
+            max_attempts=args.max_attempts,
+            latency=LatencyModel('lognormal', median_ms=args.latency_median_ms, sigma=args.latency_sigma, seed=1)
+        )
+        results[capacity] = result = run_level(corpus, modules, backend, args.rate, args.duration, args.workers)
+
+        latency = result['latency_ms']
+        print(f'\n{capacity} RCU / {args.wcu or capacity} WCU')
+        print(f'  turns {result["turns"]}  errors {result["errors"]}  throttled turns {result["throttled_turns"]}')
+        print(
+            f'  dynamodb calls {result["dynamodb_calls"]}  attempts {result["dynamodb_attempts"]}'
+            f'  throttled requests {result["throttled_requests"]}'
+        )
+        if latency:
+            print(f'  p50 {latency["p50"]:.1f}  p95 {latency["p95"]:.1f}  p99 {latency["p99"]:.1f} ms')
+        for name, units in result['consumed'].items():
+            print(f'  {name}: {units["rcu_per_s"] or 0:.1f} RCU/s  {units["wcu_per_s"] or 0:.1f} WCU/s')
+        for code in result['error_codes']:
+            print(f'  error: {code}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
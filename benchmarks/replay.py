@@ -0,0 +1,320 @@
+'''
+Recorded-event replay benchmark for every lambda_handler.
+
+Replays the conversations in benchmarks/events/*.json through their handler against the
+in-process DynamoDB emulator (bank_common.local_dynamodb) with the tables and seed data of
+benchmarks/local_dynamodb.json, on-demand and without injected latency. Session attributes
+returned by one turn are fed into the next turn of the same conversation, as Lex does.
+Reported per handler and per intent/hook:
+
+    latency_ms               - p50 / p95 / p99 / mean / max of lambda_handler calls
+    dynamodb_calls_per_turn  - DynamoDB round trips made by one invocation
+    alloc_kib_per_turn       - peak memory allocated during one invocation (tracemalloc pass)
+    retained_kib_per_turn    - memory still held after the invocation (cache growth, leaks)
+
+Usage:
+    python benchmarks/replay.py [--iterations 200] [--warmup 5] [--events FILE ...]
+                                [--json after.json] [--compare before.json]
+
+Corpus files hold {"handler": "<module path>", "conversations": [[event, ...], ...]}.
+'''
+
+import os
+import sys
+import json
+import copy
+import time
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bank_common import dynamo, metrics
+from bank_common.local_dynamodb import LocalDynamoDB
+
+
+EVENTS_DIR = os.path.join(ROOT, 'benchmarks', 'events')
+
+#Same tables and seed data as the emulator config, on-demand and without injected latency
+CONFIG = os.path.join(ROOT, 'benchmarks', 'local_dynamodb.json')
+
+#Lambda_Call_DB uses its own region, every region gets the same stand-in
+REGIONS = (None, 'ap-southeast-2')
+
+COMPARED = (
+    ('latency_ms', 'p50'), ('latency_ms', 'p95'), ('latency_ms', 'p99'),
+    ('dynamodb_calls_per_turn', 'mean'), ('alloc_kib_per_turn', 'mean')
+)
+
+
+class LambdaContext:
+    '''Minimal Lambda context object for handlers that read the remaining time'''
+
+    function_name = 'replay'
+    memory_limit_in_mb = 128
+    aws_request_id = 'replay'
+
+    def __init__(self, timeout_ms=3000):
+        self._deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self._deadline - time.monotonic()) * 1000), 0)
+
+
+def build_backend(config_path=CONFIG, read_capacity=None, write_capacity=None, **options):
+    '''
+    Emulator with the tables of config_path. Capacity is on-demand unless read_capacity /
+    write_capacity are given; options (latency, max_attempts, burst_seconds) override the rest.
+    '''
+
+    with open(config_path) as f:
+        config = json.load(f)
+
+    config['latency'] = options.get('latency')
+    config['max_attempts'] = options.get('max_attempts', 1)
+    for spec in config['tables'].values():
+        spec['read_capacity'] = read_capacity
+        spec['write_capacity'] = write_capacity
+        spec['burst_seconds'] = options.get('burst_seconds', 300)
+
+    return LocalDynamoDB.from_config(config, base_dir=os.path.dirname(config_path))
+
+
+def load_handler(path):
+    module_name = 'replay_' + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_corpus(paths):
+    corpus = []
+    for path in paths:
+        with open(path) as f:
+            entry = json.load(f)
+        entry['name'] = os.path.basename(path)
+        corpus.append(entry)
+    return corpus
+
+
+def _session_attributes(response):
+    if not isinstance(response, dict):
+        return None
+    if 'sessionState' in response:
+        return response['sessionState'].get('sessionAttributes')
+    return response.get('sessionAttributes')
+
+
+def _with_session(event, session_attributes):
+    event = copy.deepcopy(event)
+    if session_attributes is not None:
+        if 'sessionState' in event:
+            event['sessionState']['sessionAttributes'] = dict(session_attributes)
+        elif 'currentIntent' in event:
+            event['sessionAttributes'] = dict(session_attributes)
+    return event
+
+
+def _label(entry, event):
+    if 'sessionState' in event:
+        intent = event['sessionState']['intent']['name']
+    elif 'currentIntent' in event:
+        intent = event['currentIntent']['name']
+    else:
+        intent = event.get('Name', 'event')
+    return f'{entry["handler"]} {intent}/{event.get("invocationSource", "-")}'
+
+
+def replay(corpus, modules, backend, iterations, trace_memory=False):
+    '''Returns [(handler, label, latency_ms, dynamodb_calls, alloc_bytes, retained_bytes, error)]'''
+
+    samples = []
+    for _ in range(iterations):
+        for entry in corpus:
+            module = modules[entry['handler']]
+            for conversation in entry['conversations']:
+                session_attributes = None
+                for recorded in conversation:
+                    event = _with_session(recorded, session_attributes)
+                    context = LambdaContext()
+                    backend.reset_calls()
+
+                    if trace_memory:
+                        tracemalloc.reset_peak()
+                        before = tracemalloc.get_traced_memory()[0]
+
+                    error = None
+                    start = time.perf_counter()
+                    try:
+                        response = module.lambda_handler(event, context)
+                    except Exception as exc:
+                        response, error = None, f'{type(exc).__name__}: {exc}'
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+
+                    alloc = retained = 0
+                    if trace_memory:
+                        current, peak = tracemalloc.get_traced_memory()
+                        alloc, retained = peak - before, current - before
+
+                    session_attributes = _session_attributes(response) or session_attributes
+                    samples.append((
+                        entry['handler'], _label(entry, recorded), elapsed_ms,
+                        sum(backend.calls.values()), alloc, retained, error
+                    ))
+
+    return samples
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def _summary(latencies, calls, allocs, retained, errors):
+    summary = {
+        'turns': len(latencies),
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': statistics.fmean(latencies),
+            'max': max(latencies),
+        },
+        'dynamodb_calls_per_turn': {'mean': statistics.fmean(calls), 'max': max(calls), 'total': sum(calls)},
+        'errors': sorted(set(errors)),
+    }
+    if allocs:
+        summary['alloc_kib_per_turn'] = {
+            'mean': statistics.fmean(allocs) / 1024,
+            'p95': percentile(allocs, 0.95) / 1024,
+            'max': max(allocs) / 1024,
+        }
+        summary['retained_kib_per_turn'] = {'mean': statistics.fmean(retained) / 1024}
+    return summary
+
+
+def summarize(timed, traced):
+    '''Groups samples per handler and per "handler intent/source"'''
+
+    groups = {}
+    for handler, label, elapsed_ms, calls, _, _, error in timed:
+        for key in (('handlers', handler), ('intents', label)):
+            group = groups.setdefault(key, {'latencies': [], 'calls': [], 'allocs': [], 'retained': [], 'errors': []})
+            group['latencies'].append(elapsed_ms)
+            group['calls'].append(calls)
+            if error:
+                group['errors'].append(error)
+    for handler, label, _, _, alloc, retained, _ in traced:
+        for key in (('handlers', handler), ('intents', label)):
+            groups[key]['allocs'].append(alloc)
+            groups[key]['retained'].append(retained)
+
+    results = {'handlers': {}, 'intents': {}}
+    for (section, name), group in sorted(groups.items()):
+        results[section][name] = _summary(
+            group['latencies'], group['calls'], group['allocs'], group['retained'], group['errors']
+        )
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    for section in ('handlers', 'intents'):
+        print(f'\n{section}')
+        for name, summary in results[section].items():
+            latency = summary['latency_ms']
+            calls = summary['dynamodb_calls_per_turn']
+            alloc = summary.get('alloc_kib_per_turn', {}).get('mean', 0.0)
+            print(
+                f'  {name}\n'
+                f'    p50 {latency["p50"]:7.3f}  p95 {latency["p95"]:7.3f}  p99 {latency["p99"]:7.3f} ms'
+                f'  ddb/turn {calls["mean"]:5.2f}  alloc {alloc:8.1f} KiB  turns {summary["turns"]}'
+            )
+            for error in summary['errors']:
+                print(f'    error: {error}')
+
+            previous = (baseline or {}).get(section, {}).get(name)
+            if previous:
+                deltas = []
+                for field, stat in COMPARED:
+                    before = previous.get(field, {}).get(stat)
+                    after = summary.get(field, {}).get(stat)
+                    if before and after is not None:
+                        deltas.append(f'{field.split("_")[0]}.{stat} {100 * (after - before) / before:+.1f}%')
+                print(f'    vs baseline: {", ".join(deltas)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200, help='times the whole corpus is replayed')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed replays after loading the handlers')
+    parser.add_argument('--events', nargs='+', help='corpus files (default: benchmarks/events/*.json)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    #Verification tokens are enabled in production, replay the same code path
+    os.environ.setdefault('SESSION_TOKEN_SECRET', 'replay-benchmark-secret')
+
+    #Handlers still format their log lines and metric blobs, the output is discarded
+    devnull = open(os.devnull, 'w')
+    logging.getLogger().addHandler(logging.StreamHandler(devnull))
+    metrics.set_output(devnull)
+
+    backend = build_backend()
+    for region in REGIONS:
+        dynamo.set_client(backend, region)
+
+    paths = args.events or sorted(
+        os.path.join(EVENTS_DIR, name) for name in os.listdir(EVENTS_DIR) if name.endswith('.json')
+    )
+    corpus = load_corpus(paths)
+    modules = {entry['handler']: load_handler(entry['handler']) for entry in corpus}
+
+    replay(corpus, modules, backend, args.warmup)
+    timed = replay(corpus, modules, backend, args.iterations)
+
+    tracemalloc.start()
+    traced = replay(corpus, modules, backend, max(args.iterations // 10, 1), trace_memory=True)
+    tracemalloc.stop()
+
+    results = summarize(timed, traced)
+    results['meta'] = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git': _git_revision(),
+        'python': platform.python_version(),
+        'iterations': args.iterations,
+        'warmup': args.warmup,
+        'events': [os.path.relpath(path, ROOT) for path in paths],
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from bank_common import dynamo  # noqa: E402
+
+
+#Regions the handlers and bootstrap use, see bank_common.tables
+REGIONS = (None, 'us-east-1', 'ap-southeast-2')
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    '''Fresh in-process DynamoDB emulator with the seed tables of benchmarks/local_dynamodb.json'''
+
+    import replay
+
+    client = replay.build_backend()
+    monkeypatch.setattr(dynamo, '_clients', {})
+    monkeypatch.setattr(dynamo, '_tables', {})
+    for region_name in REGIONS:
+        dynamo.set_client(client, region_name)
+    return client
@@ -0,0 +1,79 @@
+from bank_common import account_numbers, dynamo
+from bank_common.account_numbers import AccountNumberAllocator, number_for, sequence_of
+
+
+def counter(name='BankAccounts'):
+    item = dynamo.get_table('account-counters').get_item(Key={'counter': name}).get('Item')
+    return item and item['NextSequence']
+
+
+def test_sequence_of_inverts_number_for():
+    for sequence in (0, 1, 99, 10 ** 6, account_numbers.ACCOUNT_SPACE - 1):
+        number = number_for(sequence)
+        assert len(str(number)) == 12
+        assert sequence_of(number) == sequence
+
+
+def test_numbers_come_from_leased_blocks(backend):
+    allocator = AccountNumberAllocator(dynamo.get_table('BankAccounts'), block_size=2)
+
+    numbers = [allocator.create({'AccountType': 'Checking'}) for _ in range(3)]
+
+    assert numbers == [number_for(0), number_for(1), number_for(2)]
+    #Two blocks of two: the third account rolled over into the second lease
+    assert counter() == 4
+    assert backend.calls['UpdateItem'] == 2
+    assert backend.calls['PutItem'] == 3
+
+
+def test_taken_number_is_skipped(backend):
+    table = dynamo.get_table('BankAccounts')
+    table.put_item(Item={'AccountNumber': number_for(0), 'AccountType': 'Savings'})
+    allocator = AccountNumberAllocator(table, block_size=10)
+
+    number = allocator.create({'AccountType': 'Checking'})
+
+    assert number == number_for(1)
+    assert table.get_item(Key={'AccountNumber': number_for(0)})['Item']['AccountType'] == 'Savings'
+
+
+def test_gives_up_after_max_attempts(backend):
+    table = dynamo.get_table('BankAccounts')
+    for sequence in range(2):
+        table.put_item(Item={'AccountNumber': number_for(sequence)})
+    allocator = AccountNumberAllocator(table, block_size=10, max_attempts=2)
+
+    try:
+        allocator.create({})
+    except account_numbers.AllocationError:
+        pass
+    else:
+        raise AssertionError('expected AllocationError')
+
+
+def test_might_have_issued(backend):
+    allocator = AccountNumberAllocator(dynamo.get_table('BankAccounts'), block_size=10)
+    allocator.create({})
+
+    assert allocator.might_have_issued(number_for(0))
+    assert not allocator.might_have_issued(number_for(account_numbers.ISSUED_MARGIN + 100))
+    assert not allocator.might_have_issued(12345)
+    assert not allocator.might_have_issued('not a number')
+
+
+def test_move_legacy_counter_keeps_the_higher_counter(backend):
+    table = dynamo.get_table('BankAccounts')
+    table.put_item(Item={'AccountNumber': 0, 'NextSequence': 42})
+
+    assert account_numbers.move_legacy_counter(table, dry_run=True) == 42
+    assert counter() is None
+
+    assert account_numbers.move_legacy_counter(table) == 42
+    assert counter() == 42
+    assert 'Item' not in table.get_item(Key={'AccountNumber': 0})
+    assert account_numbers.move_legacy_counter(table) is None
+
+    #A stale legacy counter does not move the counter back
+    table.put_item(Item={'AccountNumber': 0, 'NextSequence': 10})
+    account_numbers.move_legacy_counter(table)
+    assert counter() == 42
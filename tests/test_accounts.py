@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from bank_common import accounts, dynamo
+
+
+def test_schemas_map_the_same_fields():
+    assert set(accounts.V1.attributes) == set(accounts.V2.attributes)
+    assert accounts.V1.attribute('balance') == 'AccountBalance'
+    assert accounts.V2.attribute('balance') == 'Account Balance'
+    assert accounts.V2.field('First Name') == 'firstName'
+    assert accounts.V2.field('Unrelated') is None
+
+
+def test_to_account_ignores_attributes_outside_the_schema():
+    account = accounts.V2.to_account({'AccountNumber': 1, 'Account Balance': Decimal('5.25'), 'Extra': 'x'})
+
+    assert account.accountNumber == 1
+    assert account.balance == Decimal('5.25')
+    assert account.as_dict() == {'accountNumber': 1, 'balance': Decimal('5.25')}
+
+
+def test_to_item_adds_normalized_names():
+    item = accounts.V2.to_item({'accountNumber': 1, 'firstName': ' Maria ', 'lastName': 'DOE', 'pin': None})
+
+    assert item == {
+        'AccountNumber': 1,
+        'First Name': ' Maria ',
+        'Last Name': 'DOE',
+        'First Name Normalized': 'maria',
+        'Last Name Normalized': 'doe',
+    }
+
+
+def test_projection_uses_placeholders_for_every_name():
+    assert dynamo.projection(['Account Balance', 'phone-number', 'Account Balance']) == {
+        'ProjectionExpression': '#p0, #p1',
+        'ExpressionAttributeNames': {'#p0': 'Account Balance', '#p1': 'phone-number'},
+    }
+
+
+def test_reads_project_the_fields_and_only_balance_is_consistent(backend):
+    repository = accounts.AccountRepository('BankAccountsNew', accounts.V2)
+
+    pin_options = repository._read_options(('pin',), None)
+    assert pin_options['ConsistentRead'] is False
+    assert sorted(pin_options['ExpressionAttributeNames'].values()) == ['AccountNumber', 'Pin']
+
+    balance_options = repository._read_options(('balance',), None)
+    assert balance_options['ConsistentRead'] is True
+    assert sorted(balance_options['ExpressionAttributeNames'].values()) == ['Account Balance', 'AccountNumber']
+
+    assert repository._read_options(('balance',), False)['ConsistentRead'] is False
+
+
+def test_get_returns_only_the_fields_read(backend):
+    v1 = accounts.AccountRepository('BankAccounts', accounts.V1)
+    v2 = accounts.AccountRepository('BankAccountsNew', accounts.V2)
+
+    account = v1.get(189714330257, ('pin', 'balance'))
+    assert account.pin == 1534
+    assert account.balance == Decimal(389162) and isinstance(account.balance, Decimal)
+    assert account.firstName is None
+
+    assert v2.get(330256762208, ('firstName',)).firstName == 'Maria'
+    assert v2.get(100000000000, ('pin',)) is None
@@ -0,0 +1,55 @@
+from bank_common import accounts
+
+
+#Seed account of BankAccounts (Bank_Contact_Flow/finalbankdata.json), stored without normalized names
+ACCOUNT_NUMBER = 189714330257
+PIN = '1534'
+
+
+def test_replaces_card_on_an_account_without_normalized_names(backend):
+    repository = accounts.AccountRepository('BankAccounts', accounts.V1)
+    old_card = repository.get(ACCOUNT_NUMBER, ('cardNumber',)).cardNumber
+
+    result = repository.replace_card(ACCOUNT_NUMBER, PIN, 'MARIA', ' doe')
+
+    assert result.replaced
+    assert result.account.cardNumber != old_card
+    assert result.account.firstNameNormalized == 'maria'
+    #First update failed on the missing normalized names, the second matched the stored names
+    assert backend.calls['UpdateItem'] == 2
+
+    assert repository.replace_card(ACCOUNT_NUMBER, PIN, 'Maria', 'Doe').replaced
+    assert backend.calls['UpdateItem'] == 3
+
+
+def test_wrong_pin_fails_on_pin(backend):
+    repository = accounts.AccountRepository('BankAccounts', accounts.V1)
+
+    result = repository.replace_card(ACCOUNT_NUMBER, '9999', 'Maria', 'Doe')
+
+    assert not result.replaced
+    assert result.failed_field == 'pin'
+
+
+def test_wrong_name_fails_on_that_name(backend):
+    repository = accounts.AccountRepository('BankAccounts', accounts.V1)
+
+    assert repository.replace_card(ACCOUNT_NUMBER, PIN, 'Maria', 'Smith').failed_field == 'lastName'
+    assert repository.replace_card(ACCOUNT_NUMBER, PIN, 'Anna', 'Doe').failed_field == 'firstName'
+
+
+def test_unknown_account_fails_without_a_field(backend):
+    repository = accounts.AccountRepository('BankAccounts', accounts.V1)
+
+    result = repository.replace_card(100000000000, PIN, 'Maria', 'Doe')
+
+    assert not result.replaced
+    assert result.failed_field is None
+
+
+def test_missing_or_non_numeric_pin_fails_without_a_call(backend):
+    repository = accounts.AccountRepository('BankAccounts', accounts.V1)
+
+    for pin in (None, '', '12a4'):
+        assert repository.replace_card(ACCOUNT_NUMBER, pin, 'Maria', 'Doe').failed_field == 'pin'
+    assert sum(backend.calls.values()) == 0
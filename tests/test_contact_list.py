@@ -0,0 +1,67 @@
+from bank_common import contact_list, dynamo
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def route_table(clock):
+    return contact_list.RouteTable(
+        region_name='ap-southeast-2', segments=2, refresh_seconds=60, reload_seconds=3600, clock=clock
+    )
+
+
+def test_loads_once_and_serves_from_memory(backend):
+    routes = route_table(Clock())
+
+    assert routes.get('+61400000001') == '+61255550100'
+    assert routes.get('+61400000001') == '+61255550100'
+    assert routes.get('+10000000000') is None
+    assert backend.calls['Scan'] == 2
+    assert backend.calls['GetItem'] == 0
+
+
+def test_refresh_queries_only_changed_routes(backend):
+    clock = Clock()
+    routes = route_table(clock)
+    other = route_table(clock)
+    len(routes)
+
+    other.put('+61400000099', '+61255550199')
+    assert routes.get('+61400000099') is None
+
+    clock.now = 60
+    assert routes.get('+61400000099') == '+61255550199'
+    assert backend.calls['Query'] == 1
+    assert backend.calls['Scan'] == 2
+
+
+def test_full_reload_drops_deleted_routes(backend):
+    clock = Clock()
+    routes = route_table(clock)
+    assert routes.get('+61400000001')
+
+    dynamo.get_table('contact-list', region_name='ap-southeast-2').delete_item(Key={'origin': '+61400000001'})
+    clock.now = 60
+    assert routes.get('+61400000001')
+
+    clock.now = 3600
+    assert routes.get('+61400000001') is None
+    assert backend.calls['Scan'] == 4
+
+
+def test_failed_refresh_keeps_the_routes_in_memory(backend, monkeypatch):
+    clock = Clock()
+    routes = route_table(clock)
+    assert routes.get('+61400000001')
+
+    def fail(**kwargs):
+        raise RuntimeError('unavailable')
+
+    monkeypatch.setattr(routes.table, 'query', fail)
+    clock.now = 60
+    assert routes.get('+61400000001') == '+61255550100'
@@ -0,0 +1,35 @@
+import json
+from decimal import Decimal
+
+from bank_common import dynamo
+
+
+def dumps(value):
+    return json.dumps(value, cls=dynamo.JSONEncoder)
+
+
+def test_fractional_money_is_exact():
+    balance = Decimal('0.10') + Decimal('0.20')
+
+    assert dumps({'balance': balance}) == '{"balance": "0.30"}'
+    assert Decimal(json.loads(dumps(balance))) == Decimal('0.30')
+
+
+def test_large_balances_keep_every_digit():
+    assert dumps(Decimal('12345678901234567.89')) == '"12345678901234567.89"'
+    assert dumps(Decimal('98765432109876543210')) == '98765432109876543210'
+    assert dumps(Decimal('1E+20')) == '100000000000000000000'
+
+
+def test_whole_decimals_are_numbers():
+    assert dumps({'balance': Decimal('389162'), 'cents': Decimal('5.00')}) == '{"balance": 389162, "cents": 5}'
+
+
+def test_deserialized_items_round_trip_through_json():
+    item = dynamo.deserialize_item(
+        {'AccountNumber': {'N': '189714330257'}, 'AccountBalance': {'N': '1000000000000.01'}},
+        decimal_attributes={'AccountBalance'}
+    )
+
+    assert json.loads(dumps(item)) == {'AccountNumber': 189714330257, 'AccountBalance': '1000000000000.01'}
+    assert json.loads(json.dumps(item, default=dynamo.json_default)) == json.loads(dumps(item))
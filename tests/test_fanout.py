@@ -0,0 +1,80 @@
+import time
+import contextvars
+
+import pytest
+
+from bank_common import dynamo, fanout
+
+
+def sleeper(seconds, value):
+    def call():
+        time.sleep(seconds)
+        return value
+    return call
+
+
+def test_wall_clock_is_the_slowest_call_not_the_sum():
+    #Warm the pool first, containers keep it across invocations
+    with fanout.Fanout() as calls:
+        for _ in range(3):
+            calls.call(sleeper(0, None))
+
+    delays = (0.1, 0.2, 0.3)
+    start = time.perf_counter()
+    with fanout.Fanout() as calls:
+        results = [calls.call(sleeper(delay, delay)) for delay in delays]
+    elapsed = time.perf_counter() - start
+
+    assert [result.result() for result in results] == list(delays)
+    assert max(delays) <= elapsed < max(delays) + 0.15 < sum(delays)
+
+
+def test_errors_are_kept_per_call():
+    def fail():
+        raise ValueError('boom')
+
+    with fanout.Fanout() as calls:
+        failed = calls.call(fail)
+        succeeded = calls.call(sleeper(0, 'ok'))
+
+    assert succeeded.result() == 'ok'
+    with pytest.raises(ValueError):
+        failed.result()
+
+
+def test_calls_see_the_invocation_context():
+    invocation = contextvars.ContextVar('invocation')
+    invocation.set('contact-1')
+
+    with fanout.Fanout() as calls:
+        seen = [calls.call(invocation.get) for _ in range(3)]
+
+    assert [result.result() for result in seen] == ['contact-1'] * 3
+
+
+def test_keys_of_one_table_become_one_batch_get(backend):
+    table = dynamo.get_table('data_dip_table', region_name='ap-southeast-2')
+    contacts = dynamo.get_table('contact-list', region_name='ap-southeast-2')
+
+    with fanout.Fanout() as calls:
+        maria = calls.get_item(table, Key={'phone-number': '+61400000001'})
+        nobody = calls.get_item(table, Key={'phone-number': '+10000000000'})
+        route = calls.get_item(contacts, Key={'origin': '+61400000001'})
+
+    assert maria.result()['Item']['first-name'] == 'Maria'
+    assert nobody.result() == {}
+    assert route.result()['Item']['transferTo'] == '+61255550100'
+    assert backend.calls['BatchGetItem'] == 1
+    assert backend.calls['GetItem'] == 1
+
+
+def test_data_dip_reads_greeting_and_route_together(backend):
+    import replay
+
+    handler = replay.load_handler('Lambda_Call_DB.py')
+    event = {'Details': {'ContactData': {'CustomerEndpoint': {'Address': '+61400000001'}}}, 'Name': 'ContactFlowEvent'}
+
+    response = handler.lambda_handler(event, None)
+
+    assert response == {'welcomeMessage': 'WelcomeMaria to Our data dip', 'transferTo': '+61255550100'}
+    assert backend.calls['GetItem'] == 2
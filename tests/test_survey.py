@@ -0,0 +1,103 @@
+from bank_common import survey
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTable:
+    '''batch_write leaves the last `throttle` requests of every call unprocessed'''
+
+    name = 'survey-responses'
+
+    def __init__(self, throttle=0):
+        self.throttle = throttle
+        self.written = []
+
+    def batch_write(self, requests):
+        processed = requests[:len(requests) - self.throttle]
+        self.written.extend(request['PutRequest']['Item'] for request in processed)
+        return requests[len(processed):]
+
+
+def answers(items):
+    return [(item['question']['S'], item['answer']['S']) for item in items]
+
+
+def buffer(table, tmp_path, clock=None):
+    return survey.AnswerBuffer(
+        table=table, batch_size=25, max_age_seconds=30, spool_path=str(tmp_path / 'spool.ndjson'),
+        clock=clock or Clock()
+    )
+
+
+def test_unprocessed_answers_stay_buffered(tmp_path):
+    table = FakeTable(throttle=2)
+    answers_buffer = buffer(table, tmp_path)
+    for question in ('q1', 'q2', 'q3'):
+        answers_buffer.record('session-1', question, 'yes')
+
+    assert answers_buffer.flush() == 1
+    assert answers(table.written) == [('q1', 'yes')]
+    assert len(answers_buffer) == 2
+
+    table.throttle = 0
+    assert answers_buffer.flush() == 2
+    assert answers(table.written) == [('q1', 'yes'), ('q2', 'yes'), ('q3', 'yes')]
+    assert len(answers_buffer) == 0
+
+
+def test_requeue_keeps_answers_recorded_meanwhile(tmp_path):
+    table = FakeTable(throttle=1)
+    answers_buffer = buffer(table, tmp_path)
+    answers_buffer.record('session-1', 'q1', 'no')
+
+    class Racing(FakeTable):
+        def batch_write(self, requests):
+            #The caller changes the answer while the throttled flush is in flight
+            answers_buffer.record('session-1', 'q1', 'yes')
+            return super().batch_write(requests)
+
+    answers_buffer.table = Racing(throttle=1)
+    assert answers_buffer.flush() == 0
+
+    answers_buffer.table = table
+    table.throttle = 0
+    answers_buffer.flush()
+    assert answers(table.written) == [('q1', 'yes')]
+
+
+def test_requeued_answers_wait_for_the_next_flush(tmp_path):
+    clock = Clock()
+    answers_buffer = buffer(FakeTable(throttle=1), tmp_path, clock)
+    answers_buffer.record('session-1', 'q1', 'yes')
+    answers_buffer.flush()
+
+    assert not answers_buffer.due()
+    clock.now = 30
+    assert answers_buffer.due()
+
+
+def test_failed_flush_spools_and_resends(tmp_path):
+    clock = Clock()
+    table = FakeTable()
+    answers_buffer = buffer(table, tmp_path, clock)
+    answers_buffer.record('session-1', 'q1', 'yes')
+
+    def fail(requests):
+        raise RuntimeError('unavailable')
+
+    answers_buffer.table.batch_write = fail
+    assert answers_buffer.flush() == 0
+    assert (tmp_path / 'spool.ndjson').exists()
+
+    del answers_buffer.table.batch_write
+    clock.now = 30
+    assert answers_buffer.due()
+    assert answers_buffer.flush() == 1
+    assert answers(table.written) == [('q1', 'yes')]
+    assert not (tmp_path / 'spool.ndjson').exists()